@@ -0,0 +1,63 @@
+"""Benchmark the month arithmetic behind monthly recurring actions.
+
+Run from the repository root:
+
+    python -m benchmarks.calendar_benchmark
+"""
+
+import datetime
+
+import dateutil.relativedelta
+
+from benchmarks.parse_benchmark import Best, Report
+
+import libvtd.node
+
+
+def _DateutilAdvanceByMonths(date_and_time, num, from_start):
+    """AdvanceByMonths, as it was before it used integer arithmetic."""
+    if from_start:
+        return date_and_time + dateutil.relativedelta.relativedelta(months=num)
+    time = date_and_time.time()
+    first_day_next_month = ((date_and_time.date() +
+                             dateutil.relativedelta.relativedelta(months=1))
+                            .replace(day=1))
+    offset = first_day_next_month - date_and_time.date()
+    date = (date_and_time.date() + offset +
+            dateutil.relativedelta.relativedelta(months=num)) - offset
+    return datetime.datetime.combine(date, time)
+
+
+def _UseAdvanceByMonths(advance):
+    """Make recurring actions use the given AdvanceByMonths implementation."""
+    libvtd.node.DoableNode._date_advancing_function['month'] = advance
+    libvtd.node.AdvanceByMonths = advance
+
+
+def main():
+    start = datetime.datetime(2013, 1, 1, 9, 30)
+    days = [start + datetime.timedelta(days=i) for i in range(10000)]
+    action = libvtd.node.NextAction()
+    action.AbsorbText('Pay rent EVERY month [-5 - 1] '
+                      '(LASTDONE 2013-09-01 10:00)')
+
+    integer_advance = libvtd.node.AdvanceByMonths
+    for (name, advance) in [('dateutil', _DateutilAdvanceByMonths),
+                            ('integer', integer_advance)]:
+        Report('AdvanceByMonths x{} ({})'.format(4 * len(days), name),
+               Best(lambda: [advance(day, num, from_start)
+                             for day in days
+                             for num in (-1, 3)
+                             for from_start in (True, False)]))
+
+        # (DateState() remembers the dates it computed, so it would only call
+        # AdvanceByMonths once; time the computation itself.)
+        _UseAdvanceByMonths(advance)
+        Report('Monthly recurring dates x10000 ({})'.format(name),
+               Best(lambda: [action._ComputeRecurringDates()
+                             for _ in range(10000)]))
+    _UseAdvanceByMonths(integer_advance)
+
+
+if __name__ == '__main__':
+    main()
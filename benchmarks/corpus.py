@@ -0,0 +1,104 @@
+"""Synthetic, but realistic, VTD file contents for benchmarks."""
+
+import contextlib
+import os
+import random
+import shutil
+import tempfile
+
+_WORDS = ('call the bank about mortgage renewal read chapter review code for '
+          'release write up notes from meeting buy groceries fix leaky faucet '
+          'plan trip schedule dentist appointment email team lead draft '
+          'proposal clean garage update budget spreadsheet').split()
+_CONTEXTS = ['home', 'work', 'phone', 'online', 'errands', 'computer']
+_RECURRENCES = ['EVERY day', 'EVERY week [Sun]', 'EVERY 2-3 weeks',
+                'EVERY month [7 - 10]', 'EVERY 3-5 days']
+
+
+def _Words(rng, low, high):
+    return ' '.join(rng.choice(_WORDS) for _ in range(rng.randint(low, high)))
+
+
+def _Date(rng):
+    return '2013-{:02d}-{:02d}'.format(rng.randint(1, 12), rng.randint(1, 28))
+
+
+def _Tags(rng):
+    tags = []
+    if rng.random() < 0.5:
+        tags.append('@' + rng.choice(_CONTEXTS))
+    if rng.random() < 0.1:
+        tags.append('<' + _Date(rng))
+    if rng.random() < 0.05:
+        tags.append('>' + _Date(rng))
+    if rng.random() < 0.05:
+        tags.append('@p:{}'.format(rng.randint(0, 4)))
+    return tags
+
+
+def _Action(rng, indent, lines):
+    words = [_Words(rng, 2, 6)] + _Tags(rng)
+    if rng.random() < 0.05:
+        words.append(rng.choice(_RECURRENCES))
+        words.append('(LASTDONE {} 08:30)'.format(_Date(rng)))
+    elif rng.random() < 0.3:
+        words.append('(DONE {} 12:00)'.format(_Date(rng)))
+    rng.shuffle(words)
+    lines.append('{}@ {}'.format(' ' * indent, ' '.join(words)))
+    for _ in range(rng.choice([0, 0, 0, 1, 2])):
+        lines.append('{}{}'.format(' ' * (indent + 2), _Words(rng, 5, 12)))
+
+
+def _Project(rng, indent, lines, depth=0):
+    marker = rng.choice('#-')
+    lines.append('{}{} {}'.format(' ' * indent, marker,
+                                  ' '.join([_Words(rng, 2, 5)] + _Tags(rng))))
+    for _ in range(rng.randint(0, 2)):
+        lines.append('{}{}'.format(' ' * (indent + 2), _Words(rng, 6, 12)))
+    for _ in range(rng.randint(2, 8)):
+        roll = rng.random()
+        if roll < 0.15 and depth < 2:
+            _Project(rng, indent + 2, lines, depth + 1)
+        elif roll < 0.3:
+            lines.append('{}* {}'.format(' ' * (indent + 2),
+                                         _Words(rng, 4, 10)))
+            lines.append('{}{}'.format(' ' * (indent + 4), _Words(rng, 6, 12)))
+        else:
+            _Action(rng, indent + 2, lines)
+    lines.append('')
+
+
+def FileLines(num_lines, seed=0):
+    """Lines of a plausible VTD file, roughly num_lines long."""
+    rng = random.Random(seed)
+    lines = []
+    while len(lines) < num_lines:
+        lines.append('= {} ='.format(_Words(rng, 1, 3).title()))
+        lines.append('')
+        for _ in range(rng.randint(3, 10)):
+            if rng.random() < 0.7:
+                _Project(rng, 0, lines)
+            else:
+                _Action(rng, 0, lines)
+                lines.append('')
+    return lines[:num_lines]
+
+
+@contextlib.contextmanager
+def TempFiles(num_files, lines_per_file, seed=0):
+    """A temporary directory holding num_files synthetic VTD files.
+
+    Yields:
+        A list of the file names.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        file_names = []
+        for i in range(num_files):
+            file_name = os.path.join(directory, 'file{:04d}.txt'.format(i))
+            with open(file_name, 'w') as vtd_file:
+                vtd_file.write('\n'.join(FileLines(lines_per_file, seed + i)))
+            file_names.append(file_name)
+        yield file_names
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,43 @@
+"""Benchmark loading many files into a TrustedSystem.
+
+Run from the repository root:
+
+    python -m benchmarks.load_benchmark
+"""
+
+import os
+
+from benchmarks import corpus
+from benchmarks.parse_benchmark import Best, Report
+
+import libvtd.trusted_system
+
+
+def _AddEachFile(file_names):
+    trusted_system = libvtd.trusted_system.TrustedSystem()
+    for file_name in file_names:
+        trusted_system.AddFile(file_name)
+
+
+def main():
+    with corpus.TempFiles(300, 200) as file_names:
+        Report('AddFile() x{}'.format(len(file_names)),
+               Best(lambda: _AddEachFile(file_names), repeat=3))
+        Report('AddFiles()',
+               Best(lambda: libvtd.trusted_system.TrustedSystem().AddFiles(
+                   file_names), repeat=3))
+        workers = os.cpu_count() if hasattr(os, 'cpu_count') else 2
+        Report('AddFiles(workers={})'.format(workers),
+               Best(lambda: libvtd.trusted_system.TrustedSystem().AddFiles(
+                   file_names, workers=workers), repeat=3))
+
+        reports = libvtd.trusted_system.TrustedSystem().AddDirectory(
+            os.path.dirname(file_names[0]), '*.txt')
+        slowest = max(reports, key=lambda report: report.seconds)
+        print('Slowest file: {} ({:.4f} s, {} bad lines)'.format(
+            os.path.basename(slowest.file_name), slowest.seconds,
+            slowest.bad_lines))
+
+
+if __name__ == '__main__':
+    main()
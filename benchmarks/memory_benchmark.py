@@ -0,0 +1,71 @@
+"""Benchmark how much memory a parsed tree of Nodes takes.
+
+Run from the repository root (needs Python 3, for tracemalloc):
+
+    python -m benchmarks.memory_benchmark [REVISION ...]
+
+Each git REVISION given (e.g., HEAD~1) gets measured alongside the working
+tree, using libvtd/node.py as it was at that revision.
+"""
+
+import gc
+import subprocess
+import sys
+import tracemalloc
+import types
+
+from benchmarks import corpus
+
+import libvtd.node
+
+
+def _NodeModuleAt(revision):
+    """libvtd.node, as it was at the given git revision."""
+    source = subprocess.check_output(
+        ['git', 'show', '{}:libvtd/node.py'.format(revision)])
+    module = types.ModuleType('libvtd.node@{}'.format(revision))
+    exec(compile(source, 'node.py@{}'.format(revision), 'exec'),
+         module.__dict__)
+    return module
+
+
+def _CountNodes(node):
+    count = 0
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        count += 1
+        stack.extend(node.children)
+    return count
+
+
+def BytesPerNode(node_module, file_name):
+    """The memory allocated by parsing file_name, per Node in its tree."""
+    # Parse once beforehand, so that the memos of dates and recurrences are
+    # already full, and don't get counted.
+    node_module.File(file_name)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        vtd_file = node_module.File(file_name)
+        (size, _) = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return float(size) / _CountNodes(vtd_file)
+
+
+def main():
+    modules = [('working tree', libvtd.node)]
+    modules.extend((revision, _NodeModuleAt(revision))
+                   for revision in sys.argv[1:])
+    with corpus.TempFiles(1, 20000) as (file_name,):
+        print('{} Nodes in 20000 lines.'.format(
+            _CountNodes(libvtd.node.File(file_name))))
+        for (name, module) in modules:
+            print('{:<45}{:8.1f} bytes'.format(
+                'Per Node ({}):'.format(name),
+                BytesPerNode(module, file_name)))
+
+
+if __name__ == '__main__':
+    main()
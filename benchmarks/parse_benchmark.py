@@ -0,0 +1,120 @@
+"""Benchmark parsing of realistic VTD files.
+
+Run from the repository root:
+
+    python -m benchmarks.parse_benchmark
+"""
+
+import timeit
+
+from benchmarks import corpus
+
+import libvtd.node
+
+
+def _CreateNodeTypeTryingEveryPattern(text):
+    """File._CreateCorrectNodeType, as it was before first-character dispatch.
+    """
+    File = libvtd.node.File
+    section_match = File._section_pattern.match(text)
+    if section_match:
+        section = libvtd.node.Section(level=len(section_match.group('level')))
+        return (section, section_match.group('text'))
+
+    project_match = File._project_pattern.match(text)
+    if project_match:
+        is_ordered = (project_match.group('type') == '#')
+        indent = len(project_match.group('indent'))
+        project = libvtd.node.Project(is_ordered=is_ordered, indent=indent)
+        return (project, project_match.group('text'))
+
+    next_action_match = File._next_action_pattern.match(text)
+    if next_action_match:
+        indent = len(next_action_match.group('indent'))
+        action = libvtd.node.NextAction(indent=indent)
+        return (action, next_action_match.group('text'))
+
+    comment_match = File._comment_pattern.match(text)
+    if comment_match:
+        indent = len(comment_match.group('indent'))
+        comment = libvtd.node.Comment(indent=indent)
+        return (comment, comment_match.group('text'))
+
+    return (None, '')
+
+
+def _AddChildScanningEveryChild(project, other):
+    """Project.AddChild, as it was before it kept track of the open children.
+    """
+    DoableNode = libvtd.node.DoableNode
+    if not libvtd.node.Node.AddChild(project, other):
+        return False
+    if project.ordered and isinstance(other, DoableNode):
+        last_doable_node = None
+        for child in project.children:
+            if (isinstance(child, DoableNode) and not child.done and
+                    child != other):
+                last_doable_node = child
+        other.predecessor = last_doable_node
+    if project.recurring and isinstance(other, DoableNode):
+        other._SetRecurrence(project._recurrence)
+    return True
+
+
+def Best(function, repeat=5):
+    """The fastest of several timings of function(), in seconds."""
+    return min(timeit.Timer(function).repeat(repeat=repeat, number=1))
+
+
+def Report(label, seconds):
+    print('{:<45}{:8.4f} s'.format(label + ':', seconds))
+
+
+def main():
+    lines = corpus.FileLines(20000)
+    plain_lines = [line for line in lines
+                   if not libvtd.node.File._CreateCorrectNodeType(line)[0]]
+    print('{} lines; {} blank or plain text.'.format(len(lines),
+                                                    len(plain_lines)))
+
+    for (name, create) in [
+            ('every pattern', _CreateNodeTypeTryingEveryPattern),
+            ('first character', libvtd.node.File._CreateCorrectNodeType)]:
+        Report('Classify all lines ({})'.format(name),
+               Best(lambda: [create(l) for l in lines]))
+        Report('Classify plain text ({})'.format(name),
+               Best(lambda: [create(l) for l in plain_lines]))
+
+    with corpus.TempFiles(1, len(lines)) as file_names:
+        Report('Parse whole file',
+               Best(lambda: libvtd.node.File(file_names[0])))
+
+    # Tick off one action in the middle of the file, and untick it again.
+    index = next(i for i in range(len(lines) // 2, len(lines))
+                 if lines[i].lstrip().startswith('@ '))
+    edited_lines = list(lines)
+    edited_lines[index] += ' (DONE)'
+    vtd_file = libvtd.node.File.FromLines(lines)
+
+    def UpdateTwice():
+        assert vtd_file.Update(edited_lines)
+        assert vtd_file.Update(lines)
+    Report('Update one line (x2)', Best(UpdateTwice))
+
+    # One long checklist, where each step waits for the previous one.
+    checklist = ['# Checklist'] + ['  @ Step {}'.format(i)
+                                   for i in range(10000)]
+    add_child = libvtd.node.Project.AddChild
+    for (name, add) in [('scan children', _AddChildScanningEveryChild),
+                        ('incremental', add_child)]:
+        libvtd.node.Project.AddChild = add
+        try:
+            Report('Parse 10k-step checklist ({})'.format(name),
+                   Best(lambda: libvtd.node.File.FromLines(checklist),
+                        repeat=1))
+        finally:
+            libvtd.node.Project.AddChild = add_child
+
+
+if __name__ == '__main__':
+    main()
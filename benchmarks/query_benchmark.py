@@ -0,0 +1,62 @@
+"""Benchmark the lists a TrustedSystem gives, as time passes between queries.
+
+Run from the repository root:
+
+    python -m benchmarks.query_benchmark [REVISION ...]
+
+Each git REVISION given (e.g., HEAD~1) gets measured alongside the working
+tree, using libvtd/trusted_system.py as it was at that revision.
+"""
+
+import datetime
+import subprocess
+import sys
+import types
+
+from benchmarks import corpus
+from benchmarks.parse_benchmark import Best, Report
+
+import libvtd.trusted_system
+
+
+def _TrustedSystemModuleAt(revision):
+    """libvtd.trusted_system, as it was at the given git revision."""
+    source = subprocess.check_output(
+        ['git', 'show', '{}:libvtd/trusted_system.py'.format(revision)])
+    module = types.ModuleType('libvtd.trusted_system@{}'.format(revision))
+    exec(compile(source, 'trusted_system.py@{}'.format(revision), 'exec'),
+         module.__dict__)
+    return module
+
+
+def main():
+    start = datetime.datetime(2013, 9, 10, 9, 0)
+    modules = [('working tree', libvtd.trusted_system)]
+    modules.extend((revision, _TrustedSystemModuleAt(revision))
+                   for revision in sys.argv[1:])
+    with corpus.TempFiles(10, 2000) as file_names:
+        for (name, module) in modules:
+            trusted_system = module.TrustedSystem()
+            trusted_system.Refresh(also_parse=file_names)
+            minutes = iter(range(10 ** 6))
+
+            def NextMinute():
+                return start + datetime.timedelta(minutes=next(minutes))
+
+            Report('NextActions(), minutes apart ({})'.format(name),
+                   Best(lambda: trusted_system.NextActions(NextMinute())))
+            Report('Snapshot(), minutes apart ({})'.format(name),
+                   Best(lambda: trusted_system.Snapshot(NextMinute())))
+            Report('Snapshot(), months apart ({})'.format(name),
+                   Best(lambda: trusted_system.Snapshot(
+                       start + datetime.timedelta(
+                           days=30 * (next(minutes) % 12)))))
+            Report('ContextList(), minutes apart ({})'.format(name),
+                   Best(lambda: trusted_system.ContextList(NextMinute())))
+            trusted_system.SetContexts(include=['phone'])
+            Report('NextActions(), one context ({})'.format(name),
+                   Best(lambda: trusted_system.NextActions(NextMinute())))
+
+
+if __name__ == '__main__':
+    main()
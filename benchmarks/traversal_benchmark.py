@@ -0,0 +1,85 @@
+"""Benchmark walking parsed trees, as every TrustedSystem list does.
+
+Run from the repository root:
+
+    python -m benchmarks.traversal_benchmark
+"""
+
+import sys
+
+from benchmarks import corpus
+from benchmarks.parse_benchmark import Best, Report
+
+import libvtd.node
+import libvtd.trusted_system
+
+
+def _CollectRecursively(match_list, node, matcher,
+                        pruner=lambda x: getattr(x, 'done', False)):
+    """TrustedSystem.Collect, as it was before it used an explicit stack."""
+    if not pruner(node):
+        for child in node.children:
+            _CollectRecursively(match_list=match_list,
+                                node=child,
+                                matcher=matcher,
+                                pruner=pruner)
+    if matcher(node):
+        match_list.append(node)
+
+
+def _WideFile(num_actions):
+    """A File with one project, holding num_actions actions side by side."""
+    return libvtd.node.File.FromLines(
+        ['- Wide project'] + ['  @ Action {}'.format(i)
+                             for i in range(num_actions)])
+
+
+def _DeepFile(num_chains, depth):
+    """A File with num_chains chains of depth nested projects."""
+    vtd_file = libvtd.node.File()
+    for _ in range(num_chains):
+        parent = vtd_file
+        for level in range(depth):
+            project = libvtd.node.Project(indent=2 * level)
+            assert parent.AddChild(project)
+            parent = project
+        assert parent.AddChild(libvtd.node.NextAction(indent=2 * depth))
+    return vtd_file
+
+
+def main():
+    trusted_system = libvtd.trusted_system.TrustedSystem()
+    is_action = lambda x: isinstance(x, libvtd.node.NextAction)
+
+    # Stay clear of the recursion limit for the recursive version; beyond it,
+    # only the explicit stack still works.
+    depth = sys.getrecursionlimit() - 100
+    trees = [
+        ('realistic', libvtd.node.File.FromLines(corpus.FileLines(20000))),
+        ('wide', _WideFile(50000)),
+        ('deep', _DeepFile(50, depth)),
+    ]
+    for (name, vtd_file) in trees:
+        print('{} tree: {} Nodes.'.format(
+            name, len(list(libvtd.node.PreOrder([vtd_file])))))
+        for (method, collect) in [('recursive', _CollectRecursively),
+                                  ('explicit stack', trusted_system.Collect)]:
+            Report('Collect actions, {} ({})'.format(name, method),
+                   Best(lambda: collect([], vtd_file, is_action)))
+
+    too_deep = _DeepFile(1, 10 * sys.getrecursionlimit())
+    for (method, collect) in [('recursive', _CollectRecursively),
+                              ('explicit stack', trusted_system.Collect)]:
+        try:
+            collect([], too_deep, is_action)
+            outcome = 'ok'
+        except RuntimeError:  # (RecursionError, in Python 3.)
+            outcome = 'too deep'
+        print('{:<45}{:>10}'.format(
+            'Collect, {} levels ({}):'.format(10 * sys.getrecursionlimit(),
+                                              method),
+            outcome))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+import bisect
+
+
+class DateIndex(object):
+    """The DateStates of many DoableNodes, kept up to date as time passes.
+
+    A DoableNode's DateState() only changes at its DateBoundaries().  This
+    keeps every Node's boundaries in one sorted list, so that moving on from
+    the time of the last query to a new one only checks the Nodes with a
+    boundary in between; every other Node's state is already known.
+    """
+
+    def __init__(self, nodes, on_change=None):
+        """Index the given DoableNodes.
+
+        Their dates mustn't change afterwards; build a new DateIndex instead.
+
+        Args:
+            nodes: An iterable of DoableNodes.  Recurring DoableNodes should
+                come after their ancestors, whose recurring dates they may
+                inherit (as in libvtd.node.PreOrder()).
+            on_change: A function, called as on_change(node, old, new)
+                whenever the index finds that node's DateState() has changed
+                from old to new.  (The first query finds every Node's state,
+                with old = None.)
+        """
+        self._on_change = on_change
+        self._nodes = []
+        boundaries = []
+        for node in nodes:
+            self._nodes.append(node)
+            boundaries.extend((time, node) for time in node.DateBoundaries())
+        boundaries.sort(key=lambda x: x[0])
+        self._times = [time for (time, _) in boundaries]
+        self._nodes_by_time = [node for (_, node) in boundaries]
+        # Each Node's DateState() as of self._now; None until the first query.
+        self._now = None
+        self._states = {}
+
+    def DateState(self, node, now):
+        """node.DateState(now), looked up in the index if possible.
+
+        Args:
+            node: A DoableNode (if not indexed, its DateState() gets called).
+            now: datetime.datetime object giving the current time.
+
+        Returns:
+            An element of the libvtd.node.DateStates enum.
+        """
+        if now != self._now:
+            self.MoveTo(now)
+        state = self._states.get(node)
+        return node.DateState(now) if state is None else state
+
+    def MoveTo(self, now):
+        """Bring the state of every Node up to date, as of now.
+
+        Args:
+            now: datetime.datetime object giving the current time.
+        """
+        if now == self._now:
+            return
+        if self._now is None:
+            changed = self._nodes
+        else:
+            # States change at (or just after) a boundary, so include any
+            # boundary at either end.
+            (start, end) = sorted([self._now, now])
+            changed = set(self._nodes_by_time[
+                bisect.bisect_left(self._times, start):
+                bisect.bisect_right(self._times, end)])
+        for node in changed:
+            old = self._states.get(node)
+            new = node.DateState(now)
+            if new != old:
+                self._states[node] = new
+                if self._on_change:
+                    self._on_change(node, old, new)
+        self._now = now
@@ -1,13 +1,22 @@
+import bisect
+import calendar
 import collections
 import datetime
 import dateutil.parser
-import dateutil.relativedelta
+import hashlib
 import re
+import threading
 
 
 class _Enum(tuple):
     """A simple way to make enum types."""
-    __getattr__ = tuple.index
+
+    def __new__(cls, names):
+        enum = super(_Enum, cls).__new__(cls, names)
+        # Plain attributes, so that looking up a value takes constant time.
+        for (index, name) in enumerate(names):
+            setattr(enum, name, index)
+        return enum
 
 
 # 'new' only makes sense for recurring actions.  It represents a recurring
@@ -28,10 +37,19 @@ def PreviousTime(date_and_time, time_string=None, due=True):
         A datetime.datetime object; the last datetime before 'date_and_time'
         whose time was 'time_string'.
     """
+    return _PreviousTime(date_and_time, _ParseTimeBoundary(time_string, due))
+
+
+def _ParseTimeBoundary(time_string, due=True):
+    """Parse the time_string argument of PreviousTime(), once and for all."""
     try:
-        time = datetime.datetime.strptime(time_string, '%H:%M').time()
+        return datetime.datetime.strptime(time_string, '%H:%M').time()
     except:
-        time = datetime.time()
+        return datetime.time()
+
+
+def _PreviousTime(date_and_time, time):
+    """PreviousTime(), for a time from _ParseTimeBoundary()."""
     new_datetime = datetime.datetime.combine(date_and_time.date(), time)
     if new_datetime > date_and_time:
         new_datetime -= datetime.timedelta(days=1)
@@ -52,24 +70,38 @@ def PreviousWeekDay(date_and_time, weekday_string=None, due=True):
         A datetime.datetime object; the last datetime before 'date_and_time'
         whose time and day-of-week match 'weekday_string'.
     """
+    return _PreviousWeekDay(date_and_time,
+                            _ParseWeekDayBoundary(weekday_string, due))
+
+
+def _ParseWeekDayBoundary(weekday_string, due=True):
+    """Parse the weekday_string argument of PreviousWeekDay() just once.
+
+    Returns:
+        A tuple (weekday, time), where weekday counts from 0 for Monday.
+    """
     try:
         weekday_and_time = dateutil.parser.parse(weekday_string)
-        if due and not re.search('\d:\d\d', weekday_string):
+        if due and not re.search(r'\d:\d\d', weekday_string):
             weekday_and_time = weekday_and_time.replace(hour=23, minute=59)
     except:
         weekday_and_time = dateutil.parser.parse('Sun 00:00')
+    return (weekday_and_time.weekday(), weekday_and_time.time())
 
-    if date_and_time.weekday() == weekday_and_time.weekday():
-        new_datetime = datetime.datetime.combine(date_and_time.date(),
-                                                 weekday_and_time.time())
+
+def _PreviousWeekDay(date_and_time, weekday_and_time):
+    """PreviousWeekDay(), for (weekday, time) from _ParseWeekDayBoundary()."""
+    (weekday, time) = weekday_and_time
+    if date_and_time.weekday() == weekday:
+        new_datetime = datetime.datetime.combine(date_and_time.date(), time)
         if new_datetime > date_and_time:
             new_datetime += datetime.timedelta(days=-7)
     else:
         new_datetime = datetime.datetime.combine(
             date_and_time.date() +
-            datetime.timedelta(days=-((date_and_time.weekday() -
-                                       weekday_and_time.weekday()) % 7)),
-            weekday_and_time.time())
+            datetime.timedelta(days=-((date_and_time.weekday() - weekday) %
+                                      7)),
+            time)
     assert new_datetime <= date_and_time
     return new_datetime
 
@@ -90,6 +122,36 @@ def PreviousMonthDay(date_and_time, monthday_string=None, due=True):
         A datetime.datetime object; the last datetime before 'date_and_time'
         whose time and day-of-month match 'monthday_string'.
     """
+    return _PreviousMonthDay(date_and_time,
+                             _ParseMonthDayBoundary(monthday_string, due))
+
+
+def _ParseMonthDayBoundary(monthday_string, due=True):
+    """Parse the monthday_string argument of PreviousMonthDay(), once and for
+    all.
+
+    Returns:
+        A tuple (month_day, time).
+    """
+    time = datetime.time(0, 0)
+    try:
+        m = re.match(r'(?P<day>-?\d+)(\s+(?P<time>\d\d?:\d\d))?',
+                     monthday_string)
+        month_day = int(m.group('day'))
+        if m.group('time'):
+            time = dateutil.parser.parse(m.group('time')).time()
+    except:
+        month_day = 0
+    if due:
+        if not monthday_string or not re.search(r'\d:\d\d', monthday_string):
+            time = datetime.time(23, 59)
+    return (month_day, time)
+
+
+def _PreviousMonthDay(date_and_time, month_day_and_time):
+    """PreviousMonthDay(), for a (month_day, time) from
+    _ParseMonthDayBoundary().
+    """
     def DayOfMonth(date_and_time, offset):
         """Date which is 'offset' days from the end of the prior month.
 
@@ -107,23 +169,12 @@ def PreviousMonthDay(date_and_time, monthday_string=None, due=True):
         return (date_and_time.date().replace(day=1) +
                 datetime.timedelta(days=offset - 1))
 
-    # Set up the day of the month, and the time of day.
-    time = datetime.time(0, 0)
-    try:
-        m = re.match(r'(?P<day>-?\d+)(\s+(?P<time>\d\d?:\d\d))?',
-                     monthday_string)
-        month_day = int(m.group('day'))
-        if m.group('time'):
-            time = dateutil.parser.parse(m.group('time')).time()
-    except:
-        month_day = 0
-    if due:
-        if not monthday_string or not re.search(r'\d:\d\d', monthday_string):
-            time = datetime.time(23, 59)
-
+    (month_day, time) = month_day_and_time
     new_datetime = datetime.datetime.combine(
         DayOfMonth(date_and_time, month_day), time)
     from_start = (month_day > 0)
+    # new_datetime starts out near date_and_time's month, so each of these
+    # loops only takes a step or two.
     while new_datetime < date_and_time:
         new_datetime = AdvanceByMonths(new_datetime, 1, from_start)
     while new_datetime > date_and_time:
@@ -148,22 +199,427 @@ def AdvanceByMonths(date_and_time, num, from_start):
         datetime.datetime object corresponding to 'date_and_time' advanced by
         'num' months.
     """
+    (year, month) = _AddMonths(date_and_time.year, date_and_time.month, num)
     if from_start:
-        return date_and_time + dateutil.relativedelta.relativedelta(months=num)
+        # Days past the end of the new month get clipped to its last day.
+        return date_and_time.replace(
+            year=year, month=month,
+            day=min(date_and_time.day, _DaysInMonth(year, month)))
 
     # If we're still here, we need to count backwards from the end of the
     # month.  We do this by computing an offset which takes us to the beginning
-    # of the next month.  Add the offset before changing the month; subtract it
-    # before returning the result.
-    time = date_and_time.time()
-    first_day_next_month = ((date_and_time.date() +
-                             dateutil.relativedelta.relativedelta(months=1))
-                            .replace(day=1))
-    offset = first_day_next_month - date_and_time.date()
+    # of the next month, and subtracting it from the beginning of the month
+    # after the new one.
+    offset = (_DaysInMonth(date_and_time.year, date_and_time.month) -
+              date_and_time.day + 1)
+    (year, month) = _AddMonths(year, month, 1)
+    date = datetime.date.fromordinal(
+        datetime.date(year, month, 1).toordinal() - offset)
+    return datetime.datetime.combine(date, date_and_time.time())
+
+
+def _AddMonths(year, month, num):
+    """The (year, month) which is 'num' months after (year, month)."""
+    (years, month_index) = divmod(month - 1 + num, 12)
+    return (year + years, month_index + 1)
+
 
-    date = (date_and_time.date() + offset +
-            dateutil.relativedelta.relativedelta(months=num)) - offset
-    return datetime.datetime.combine(date, time)
+_days_in_month = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+
+
+def _DaysInMonth(year, month):
+    """The number of days in the given month."""
+    if month == 2 and calendar.isleap(year):
+        return 29
+    return _days_in_month[month - 1]
+
+
+# The same few dates tend to occur over and over, so _ParseDateTime()
+# remembers them: up to this many at a time.
+_parsed_datetimes = {}
+_max_parsed_datetimes = 4096
+
+
+def _ParseDateTime(text, need_time=False):
+    """Parse a date, with optional time, in 'YYYY-MM-DD[ HH:MM]' format.
+
+    A much faster equivalent of datetime.datetime.strptime() for this one
+    fixed format.
+
+    Args:
+        text: A string which matches Node._date_pattern.
+        need_time: Whether text must include the time.
+
+    Returns:
+        A datetime.datetime object.
+
+    Raises:
+        ValueError: text is not a valid date and time (e.g., 2013-02-30).
+    """
+    try:
+        date_and_time = _parsed_datetimes[text]
+    except KeyError:
+        try:
+            date_and_time = datetime.datetime(
+                int(text[0:4]), int(text[5:7]), int(text[8:10]),
+                *([int(text[11:13]), int(text[14:16])] if len(text) > 10
+                  else []))
+        except ValueError:
+            date_and_time = None
+        if len(_parsed_datetimes) >= _max_parsed_datetimes:
+            _parsed_datetimes.clear()
+        _parsed_datetimes[text] = date_and_time
+
+    if not date_and_time or (need_time and len(text) <= 10):
+        raise ValueError('Invalid date and time: "{}"'.format(text))
+    return date_and_time
+
+
+class _Recurrence(collections.namedtuple(
+        '_Recurrence', ['unit', 'min_units', 'max_units', 'due_boundary',
+                        'vis_boundary', 'due_from_start', 'vis_from_start'])):
+    """The schedule of a recurring DoableNode, parsed from its 'EVERY' token.
+
+    Each distinct spec gets parsed only once; DoableNodes with the same spec
+    (such as the children of a recurring Project) share the same object.
+
+    Attributes:
+        unit: 'day', 'week', or 'month'.
+        min_units: The minimum number of units between repetitions.
+        max_units: The maximum number of units between repetitions.
+        due_boundary: The part of the unit where the action is due, as parsed
+            by the _boundary_parsers function for the unit.
+        vis_boundary: The part of the unit where the action becomes visible
+            (parsed likewise), or None if it's visible for the whole unit.
+        due_from_start: Whether the due date counts from the start (as opposed
+            to the end) of the month, when advancing by months.
+        vis_from_start: Likewise, for the visible date.
+    """
+    __slots__ = ()
+
+    _boundary_parsers = {
+        'day': _ParseTimeBoundary,
+        'week': _ParseWeekDayBoundary,
+        'month': _ParseMonthDayBoundary,
+    }
+    _parsed = {}
+
+    @classmethod
+    def FromMatch(cls, match):
+        """The _Recurrence for a match from DoableNode._recur_pattern."""
+        spec = match.group('unit', 'min', 'max', 'vis', 'due')
+        try:
+            return cls._parsed[spec]
+        except KeyError:
+            pass
+
+        (unit, min_units, max_units, vis, due) = spec
+        max_units = int(max_units) if max_units else 1
+        min_units = int(min_units) if min_units else max_units
+        parse = cls._boundary_parsers[unit]
+        recurrence = cls(unit=unit, min_units=min_units, max_units=max_units,
+                         due_boundary=parse(due),
+                         vis_boundary=parse(vis, due=False) if vis else None,
+                         due_from_start=cls._CountsFromStart(unit, due),
+                         vis_from_start=cls._CountsFromStart(unit, vis))
+        cls._parsed[spec] = recurrence
+        return recurrence
+
+    @staticmethod
+    def _CountsFromStart(unit, boundary):
+        """Whether to advance dates from the beginning of the interval, or the
+        end.  (The distinction is only relevant for variable-length intervals,
+        such as months.)
+        """
+        if unit != 'month' or not boundary:
+            return True
+        try:
+            return int(boundary.split()[0]) >= 1
+        except ValueError:
+            return True
+
+
+# Nodes share this empty sequence in place of each list attribute (children,
+# contexts, ...) which has nothing in it yet: most of them never do.  (It's a
+# tuple, so nobody can add to it by mistake; see Node._AppendTo().)
+_NO_ITEMS = ()
+
+
+class ContextRegistry(object):
+    """Numbers each distinct context, so that sets of contexts can be bitmasks.
+
+    A context's number is only meaningful within one process: Nodes which get
+    pickled (say, by libvtd.tree_cache) recompute their masks when unpickled.
+    """
+
+    def __init__(self):
+        self._bit_for_context = {}
+        self._lock = threading.Lock()
+
+    def Mask(self, contexts):
+        """The bitmask for an iterable of contexts."""
+        mask = 0
+        for context in contexts:
+            try:
+                mask |= self._bit_for_context[context]
+            except KeyError:
+                mask |= self._Register(context)
+        return mask
+
+    def Contexts(self, mask):
+        """The list of contexts in the given bitmask."""
+        return [context
+                for (context, bit) in list(self._bit_for_context.items())
+                if mask & bit]
+
+    def _Register(self, context):
+        """The bit for a new context."""
+        with self._lock:
+            return self._bit_for_context.setdefault(
+                context, 1 << len(self._bit_for_context))
+
+
+context_registry = ContextRegistry()
+
+
+class _Inherited(collections.namedtuple(
+        '_Inherited', ['contexts', 'due_date', 'ready_date', 'visible_date',
+                       'priority', 'file_name', 'context_mask'])):
+    """What a Node inherits from its ancestors, merged with its own values.
+
+    Each Node stores these (see Node._Inherit()), rather than walking up the
+    tree every time they're read.  A Node with no values of its own shares its
+    parent's object.
+
+    Attributes:
+        contexts: A tuple of the Node's contexts (as from Node.contexts).
+        due_date: The earliest due date of the Node and its ancestors.
+        ready_date: The earliest ready date of the Node and its ancestors.
+        visible_date: The latest visible date of the Node and its ancestors.
+        priority: The priority of the Node or its closest ancestor with one.
+        file_name: The name of the File which the Node belongs to.
+        context_mask: The bitmask of contexts, from context_registry.
+    """
+    __slots__ = ()
+
+    def __reduce__(self):
+        return (_NewInherited, tuple(self)[:-1])
+
+
+def _NewInherited(contexts, due_date, ready_date, visible_date, priority,
+                  file_name):
+    """An _Inherited, with the context_mask for its contexts."""
+    return _Inherited(contexts, due_date, ready_date, visible_date, priority,
+                      file_name, context_registry.Mask(contexts))
+
+
+_NOTHING_INHERITED = _NewInherited(contexts=(), due_date=None,
+                                   ready_date=None, visible_date=None,
+                                   priority=None, file_name=None)
+
+
+def _Merged(own, inherited, choose):
+    """Merge a Node's own date with its inherited one, using choose()."""
+    if not own:
+        return inherited
+    if not inherited:
+        return own
+    return choose(own, inherited)
+
+
+def _FlagProperty(flag):
+    """A read-only boolean property for one bit of a Node's _flags."""
+    return property(lambda self: bool(self._flags & flag))
+
+
+class _Token(collections.namedtuple(
+        '_Token', ['trigger', 'pattern', 'handler', 'keyword', 'extensible'])):
+    """A special sequence which a Node strips out of its text.
+
+    Attributes:
+        trigger: A literal which every occurrence of the token starts with.
+        pattern: The compiled regex for the token.  It must start with
+            Node._r_start, and it must not use backreferences.
+        handler: The name of the Node method which parses a match of pattern,
+            returning the text to replace the match with.
+        keyword: A regex for words which may only be parsed as part of this
+            token, or None.  (The token might only match once some other token
+            has been stripped from its middle.)
+        extensible: Whether the token has optional trailing parts, which might
+            only match once some other token has been stripped after it.
+    """
+    __slots__ = ()
+
+    def __new__(cls, trigger, pattern, handler, keyword=None,
+                extensible=False):
+        return super(_Token, cls).__new__(cls, trigger, pattern, handler,
+                                          keyword, extensible)
+
+
+class _TokenScanner(object):
+    """Strips a list of tokens out of a line of text in a single pass.
+
+    The result is identical to running one re.sub() pass per token, in order.
+    For the rare lines where that equivalence could break (say, a token hidden
+    inside another, a keyword which only becomes a token after another token
+    gets stripped from its middle, or a stray trigger which only becomes a
+    token once the token after it is stripped), we fall back to the
+    sequential passes.
+    """
+
+    def __init__(self, tokens, start):
+        """Compile the combined regex for 'tokens'.
+
+        Args:
+            tokens: A list of _Token objects, in the order they would be
+                stripped by sequential passes.
+            start: The pattern which every token's pattern starts with.
+        """
+        self._tokens = tokens
+        self._token_for_group = {}
+        self._order = {}
+        self._inner_triggers = {}
+        self._later_triggers = {}
+        alternatives = []
+        for (i, token) in enumerate(tokens):
+            assert token.pattern.pattern.startswith(start)
+            group = '_t{}'.format(i)
+            body = re.sub(r'\(\?P<\w+>', '(',
+                          token.pattern.pattern[len(start):])
+            alternatives.append('(?P<{}>{})'.format(group, body))
+            self._token_for_group[group] = token
+            self._order[group] = i
+            self._inner_triggers[group] = _AnyLiteral(
+                t.trigger for t in tokens[:i])
+            # A later token's trigger, where a token could start.
+            self._later_triggers[group] = re.compile('(?:{})(?:{})'.format(
+                start[1:-1], _AnyLiteral(
+                    t.trigger for t in tokens[i + 1:]).pattern))
+        self._pattern = re.compile('(?:{})(?:{})'.format(
+            start[1:-1], '|'.join(alternatives)))
+        self._trigger = _AnyLiteral(token.trigger for token in tokens)
+        self._keyword = _AnyLiteral(
+            (token.keyword for token in tokens if token.keyword), escape=False)
+
+    def Scan(self, node, text):
+        """Strip all tokens out of text, parsing them into node.
+
+        Args:
+            node: The Node whose handler methods parse the tokens.
+            text: The text to scan.
+
+        Returns:
+            The text which is left over.
+        """
+        if not self._trigger.search(text):
+            return text
+        matches = list(self._pattern.finditer(text))
+        if not matches:
+            return text
+        if self._NeedsSequentialScan(text, matches):
+            return self.ScanSequentially(node, text)
+
+        pieces = []
+        position = 0
+        for match in matches:
+            token = self._token_for_group[match.lastgroup]
+            pieces.append(text[position:match.start()])
+            pieces.append(getattr(node, token.handler)(
+                token.pattern.match(text, match.start())))
+            position = match.end()
+        pieces.append(text[position:])
+        return ''.join(pieces)
+
+    def ScanSequentially(self, node, text):
+        """Strip all tokens out of text, one re.sub() pass per token."""
+        for token in self._tokens:
+            text = token.pattern.sub(getattr(node, token.handler), text)
+        return text
+
+    def _NeedsSequentialScan(self, text, matches):
+        """Whether a single pass might disagree with the sequential passes."""
+        leftover = []
+        position = 0
+        previous_end = 0
+        for (i, match) in enumerate(matches):
+            group = match.lastgroup
+            token = self._token_for_group[group]
+            inside = text[match.start(group) + len(token.trigger):match.end()]
+            if self._inner_triggers[group].search(inside):
+                return True
+            # The text before the match runs straight into the text after it,
+            # once the match is stripped; that could complete a later token.
+            if self._later_triggers[group].search(text, previous_end,
+                                                  match.start()):
+                return True
+            previous_end = match.end()
+            if token.extensible and i + 1 < len(matches):
+                following = matches[i + 1]
+                if (following.start() == match.end() and
+                        self._order[following.lastgroup] <
+                        self._order[group]):
+                    return True
+            if token.keyword:
+                leftover.append(text[position:match.start()])
+                position = match.end()
+        leftover.append(text[position:])
+        return bool(self._keyword.search(''.join(leftover)))
+
+
+def _AnyLiteral(literals, escape=True):
+    """A compiled regex which matches any of the given literals.
+
+    Matches nothing at all if there are no literals.
+    """
+    alternatives = sorted(set(re.escape(l) if escape else l
+                              for l in literals))
+    return re.compile('|'.join(alternatives) if alternatives else r'(?!)')
+
+
+def PreOrder(nodes, pruner=None):
+    """Every Node in the subtrees rooted at nodes, in the order of the file.
+
+    Each Node comes before its children.  This walks an explicit stack
+    rather than recursing, so it copes with trees of any depth.
+
+    Args:
+        nodes: Any iterable of Nodes; their subtrees get walked in turn.
+        pruner: A function which decides whether a Node's children should be
+            skipped (the Node itself still gets yielded); defaults to no
+            pruning.
+    """
+    stack = list(nodes)
+    stack.reverse()
+    while stack:
+        node = stack.pop()
+        yield node
+        if node.children and not (pruner and pruner(node)):
+            stack.extend(reversed(node.children))
+
+
+def PostOrder(nodes, pruner=None):
+    """Every Node in the subtrees rooted at nodes, each after its children.
+
+    Apart from that, Nodes come in the order of the file.  Like PreOrder(),
+    this walks an explicit stack rather than recursing.
+
+    Args:
+        nodes: Any iterable of Nodes; their subtrees get walked in turn.
+        pruner: A function which decides whether a Node's children should be
+            skipped (the Node itself still gets yielded); defaults to no
+            pruning.
+    """
+    # Post-order is pre-order backwards, if children get visited last to
+    # first.  That avoids keeping track of which Nodes have had their children
+    # visited already.
+    backwards = []
+    stack = list(nodes)
+    while stack:
+        node = stack.pop()
+        backwards.append(node)
+        if node.children and not (pruner and pruner(node)):
+            stack.extend(node.children)
+    return reversed(backwards)
 
 
 class Node(object):
@@ -177,12 +633,17 @@ class Node(object):
     _level = 0
     _can_nest_same_type = False
 
+    # There can be a great many Nodes, so they have no __dict__: each subclass
+    # lists the attributes it adds in its own __slots__.
+    __slots__ = ('children', '_parent', '_visible_date', '_contexts',
+                 '_canceled_contexts', '_cancel_inheriting_all_contexts',
+                 '_due_date', '_ready_date', '_priority', '_raw_text', '_text',
+                 '_flags', '_line_in_file', '_inherited')
+
     # Handy patterns and regexes.
     # Tags either start at the beginning of the line, or with a space.
     _r_start = r'(^| )'
     _r_end = r'(?=[.!?)"'';:]*(\s|$))'
-    _date_format = r'%Y-%m-%d'
-    _datetime_format = r'%Y-%m-%d %H:%M'
     _date_pattern = (r'(?P<datetime>\d{4}-\d{2}-\d{2}'
                      r'( (?P<time>\d{2}:\d{2}))?)')
     _due_within_pattern = r'(\((?P<due_within>\d+)\))?'
@@ -194,32 +655,49 @@ class Node(object):
     _cancel_inheritance = re.compile(_r_start + r'@!' + _r_end)
     _priority_pattern = re.compile(_r_start + r'@p:(?P<priority>[01234])' +
                                    _r_end)
-    _reserved_contexts = ['inbox', 'waiting']
+
+    # Contexts which aren't really contexts: each sets a flag instead (one bit
+    # of _flags), which is readable as the property of the same name.
+    _reserved_context_flags = {'inbox': 1, 'waiting': 2}
+    inbox = _FlagProperty(_reserved_context_flags['inbox'])
+    waiting = _FlagProperty(_reserved_context_flags['waiting'])
+
+    # Which method (if any) makes the patch for each element of Actions;
+    # Patch() returns the empty patch for all other actions.
+    _patch_methods = {}
+
+    # Tokens which are common to all Node instances: due date; visible-after
+    # date; contexts; priority.  Subclasses may extend this list with tokens
+    # which only make sense for them.  The order matters: it's the order in
+    # which the tokens get stripped out of the text.
+    _tokens = [
+        _Token('<', _due_date_pattern, '_ParseDueDate'),
+        _Token('>', _vis_date_pattern, '_ParseVisDate', extensible=True),
+        _Token('@', _context, '_ParseContext'),
+        _Token('@', _cancel_inheritance, '_ParseCancelInheritance'),
+        _Token('@', _priority_pattern, '_ParsePriority'),
+    ]
+    _token_scanner = _TokenScanner(_tokens, start=_r_start)
 
     def __init__(self, text, priority, *args, **kwargs):
         super(Node, self).__init__(*args, **kwargs)
 
         # Public properties.
-        self.children = []
-        self.parent = None
+        self.children = _NO_ITEMS
+        self._parent = None
         self._visible_date = None
 
         # Private variables
-        self._contexts = []
-        self._canceled_contexts = []
+        self._contexts = _NO_ITEMS
+        self._canceled_contexts = _NO_ITEMS
         self._cancel_inheriting_all_contexts = False
         self._due_date = None
         self._ready_date = None
         self._priority = priority
-        self._raw_text = []
+        self._raw_text = _NO_ITEMS
         self._text = text
-
-        # A function which takes no arguments and returns a patch (as from
-        # diff).  Default is the identity patch (i.e., the empty string).
-        self._diff_functions = collections.defaultdict(lambda: lambda d: '')
-
-        for i in Node._reserved_contexts:
-            setattr(self, i, False)
+        self._flags = 0
+        self._InheritFromParent()
 
     def AbsorbText(self, text, raw_text=None):
         """Strip out special sequences and add whatever's left to the text.
@@ -238,20 +716,15 @@ class Node(object):
         """
         if not self._CanAbsorbText(text):
             return False
-        self._raw_text.append(raw_text if raw_text else text)
+        self._AppendTo('_raw_text', raw_text if raw_text else text)
 
-        # Tokens which are common to all Node instances: due date;
-        # visible-after date; contexts; priority.
-        text = self._due_date_pattern.sub(self._ParseDueDate, text)
-        text = self._vis_date_pattern.sub(self._ParseVisDate, text)
-        text = self._context.sub(self._ParseContext, text)
-        text = self._cancel_inheritance.sub(self._ParseCancelInheritance, text)
-        text = self._priority_pattern.sub(self._ParsePriority, text)
+        scanned_text = self._token_scanner.Scan(self, text)
+        # Every token which sets a value also changes the text.
+        if scanned_text != text:
+            self._Inherit()
 
-        # Optional extra parsing and stripping for subclasses.
-        text = self._ParseSpecializedTokens(text)
-
-        self._text = (self._text + '\n' if self._text else '') + text.strip()
+        self._text = ((self._text + '\n' if self._text else '') +
+                      scanned_text.strip())
         return True
 
     def AddChild(self, other):
@@ -266,20 +739,13 @@ class Node(object):
         if not self._CanContain(other):
             return False
         other.parent = self
-        self.children.append(other)
+        self._AppendTo('children', other)
         return True
 
     def AddContext(self, context, cancel=False):
         """Add context to this Node's contexts list."""
-        canonical_context = context.lower()
-
-        if canonical_context in Node._reserved_contexts:
-            setattr(self, canonical_context, True)
-            return
-
-        context_list = self._canceled_contexts if cancel else self._contexts
-        if canonical_context not in context_list:
-            context_list.append(canonical_context)
+        self._AddOwnContext(context, cancel)
+        self._Inherit()
 
     def DebugName(self):
         old_name = ('{} :: '.format(self.parent.DebugName()) if self.parent
@@ -301,9 +767,12 @@ class Node(object):
             applied to the file, it performs the requested action.
         """
         assert action in range(len(Actions))
+        method = self._patch_methods.get(action)
+        if not method:
+            return ''
         if not now:
             now = datetime.datetime.now()
-        return self._diff_functions[action](now)
+        return getattr(self, method)(now)
 
     def Source(self):
         """The source which generated this Node.
@@ -315,43 +784,40 @@ class Node(object):
             A (file name, line number) tuple.  (The return type could change in
             the future.)
         """
-        line = self._line_in_file if '_line_in_file' in self.__dict__ else 1
-        return (self.file_name, line)
+        return (self.file_name, getattr(self, '_line_in_file', 1))
+
+    @property
+    def context_mask(self):
+        return self._inherited.context_mask
 
     @property
     def contexts(self):
-        context_list = list(self._contexts)
-        if self.parent and not self._cancel_inheriting_all_contexts:
-            context_list.extend(self.parent.contexts)
-        return [c for c in context_list if c not in self._canceled_contexts]
+        return list(self._inherited.contexts)
 
     @property
     def due_date(self):
-        parent_due_date = self.parent.due_date if self.parent else None
-        if not self._due_date:
-            return parent_due_date
-        if not parent_due_date:
-            return self._due_date
-        return min(self._due_date, parent_due_date)
+        return self._inherited.due_date
 
     @property
     def file_name(self):
-        return self.parent.file_name if self.parent else None
+        return self._inherited.file_name
+
+    @property
+    def parent(self):
+        return self._parent
+
+    @parent.setter
+    def parent(self, parent):
+        self._parent = parent
+        self._Inherit()
 
     @property
     def priority(self):
-        if self._priority is not None:
-            return self._priority
-        return self.parent.priority if self.parent else None
+        return self._inherited.priority
 
     @property
     def ready_date(self):
-        parent_ready_date = self.parent.ready_date if self.parent else None
-        if not self._ready_date:
-            return parent_ready_date
-        if not parent_ready_date:
-            return self._ready_date
-        return min(self._ready_date, parent_ready_date)
+        return self._inherited.ready_date
 
     @property
     def text(self):
@@ -359,12 +825,69 @@ class Node(object):
 
     @property
     def visible_date(self):
-        parent_visible_date = self.parent.visible_date if self.parent else None
-        if not self._visible_date:
-            return parent_visible_date
-        if not parent_visible_date:
-            return self._visible_date
-        return max(self._visible_date, parent_visible_date)
+        return self._inherited.visible_date
+
+    def _AppendTo(self, name, item):
+        """Append item to the list attribute called name.
+
+        The first item replaces the shared _NO_ITEMS with a list of its own.
+        """
+        items = getattr(self, name)
+        if items is _NO_ITEMS:
+            items = []
+            setattr(self, name, items)
+        items.append(item)
+
+    def _Inherit(self):
+        """Recompute the inherited values of this Node's whole subtree.
+
+        Must be called whenever the Node's own values, or its parent, change.
+        """
+        if not self.children:
+            self._InheritFromParent()
+            return
+        for node in PreOrder([self]):
+            node._InheritFromParent()
+
+    def _InheritFromParent(self):
+        """Merge this Node's own values with its parent's inherited values."""
+        inherited = (self._parent._inherited if self._parent
+                     else _NOTHING_INHERITED)
+        has_own_contexts = (self._contexts or self._canceled_contexts or
+                            self._cancel_inheriting_all_contexts)
+        if not (has_own_contexts or self._due_date or self._ready_date or
+                self._visible_date or self._priority is not None):
+            self._inherited = inherited
+            return
+
+        contexts = inherited.contexts
+        if has_own_contexts:
+            context_list = list(self._contexts)
+            if not self._cancel_inheriting_all_contexts:
+                context_list.extend(contexts)
+            contexts = tuple(c for c in context_list
+                             if c not in self._canceled_contexts)
+        self._inherited = _NewInherited(
+            contexts=contexts,
+            due_date=_Merged(self._due_date, inherited.due_date, min),
+            ready_date=_Merged(self._ready_date, inherited.ready_date, min),
+            visible_date=_Merged(self._visible_date, inherited.visible_date,
+                                 max),
+            priority=(self._priority if self._priority is not None
+                      else inherited.priority),
+            file_name=inherited.file_name)
+
+    def _AddOwnContext(self, context, cancel=False):
+        """AddContext(), without updating the inherited values."""
+        canonical_context = context.lower()
+
+        if canonical_context in Node._reserved_context_flags:
+            self._flags |= Node._reserved_context_flags[canonical_context]
+            return
+
+        name = '_canceled_contexts' if cancel else '_contexts'
+        if canonical_context not in getattr(self, name):
+            self._AppendTo(name, canonical_context)
 
     def _CanAbsorbText(self, text):
         """Indicates whether this Node can absorb the given line of text.
@@ -390,7 +913,7 @@ class Node(object):
             context name; else, the original text.
         """
         cancel = (match.group('cancel') == '!')
-        self.AddContext(match.group('context'), cancel=cancel)
+        self._AddOwnContext(match.group('context'), cancel=cancel)
         return (' ' + match.group('context') if match.group('prefix') == '@@'
                 else '')
 
@@ -416,12 +939,8 @@ class Node(object):
             The text to replace match with.  If successful, this should be the
             empty string; else, the original text.
         """
-        strptime_format = (self._datetime_format if match.group('time')
-                           else self._date_format)
         try:
-            date = datetime.datetime.strptime(match.group('datetime'),
-                                              strptime_format)
-            self._due_date = date
+            self._due_date = _ParseDateTime(match.group('datetime'))
 
             # Date-only due dates occur at the *end* of the day.
             if not match.group('time'):
@@ -448,14 +967,6 @@ class Node(object):
         self._priority = int(match.group('priority'))
         return ''
 
-    def _ParseSpecializedTokens(self, text):
-        """Parse tokens which only make sense for a particular subclass.
-
-        For example, a field for the time it takes to complete a task only
-        makes sense for the NextAction subclass.
-        """
-        return text
-
     def _ParseVisDate(self, match):
         """Parses the visible-after date from a match object.
 
@@ -466,12 +977,8 @@ class Node(object):
             The text to replace match with.  If successful, this should be the
             empty string; else, the original text.
         """
-        strptime_format = (self._datetime_format if match.group('time')
-                           else self._date_format)
         try:
-            date = datetime.datetime.strptime(match.group('datetime'),
-                                              strptime_format)
-            self._visible_date = date
+            self._visible_date = _ParseDateTime(match.group('datetime'))
             return ''
         except ValueError:
             return match.group(0)
@@ -481,10 +988,18 @@ class IndentedNode(Node):
     """A Node which supports multiple lines, at a given level of indentation.
     """
 
+    # Subclasses must provide an 'indent' slot.  (It can't go here, because a
+    # class can't inherit non-empty __slots__ from both IndentedNode and
+    # DoableNode.)
+    __slots__ = ()
+
     def __init__(self, indent=0, *args, **kwargs):
         super(IndentedNode, self).__init__(*args, **kwargs)
         self.indent = indent
-        self.text_indent = indent + 2
+
+    @property
+    def text_indent(self):
+        return self.indent + 2
 
     def _CanContain(self, other):
         return super(IndentedNode, self)._CanContain(other) and (self.indent <
@@ -503,6 +1018,9 @@ class IndentedNode(Node):
 class DoableNode(Node):
     """A Node which can be sensibly marked as DONE."""
 
+    __slots__ = ('done', 'recurring', 'last_done', '_recurrence',
+                 '_recurring_dates', 'blockers', 'predecessor', '_ids')
+
     _done_pattern = re.compile(Node._r_start +
                                r'\((DONE|WONTDO)( {})?\)'.format(
                                    Node._date_pattern)
@@ -537,6 +1055,17 @@ class DoableNode(Node):
                                 ]) +
                                 Node._r_end)
 
+    # Tokens specific to things which can be marked DONE.
+    _tokens = Node._tokens + [
+        _Token('(', _done_pattern, '_ParseDone', keyword=r'DONE|WONTDO'),
+        _Token('#', _id_pattern, '_ParseId'),
+        _Token('@', _after_pattern, '_ParseAfter'),
+        _Token('EVERY', _recur_pattern, '_ParseRecur', keyword=r'EVERY',
+               extensible=True),
+        _Token('(', _last_done_pattern, '_ParseLastDone', keyword=r'DONE'),
+    ]
+    _token_scanner = _TokenScanner(_tokens, start=Node._r_start)
+
     # Functions which reset a datetime to the beginning of an interval
     # boundary: a day, a week, a month, etc.  This boundary can be arbitrary
     # (e.g., reset to "the previous 14th of a month" or "the previous Tuesday
@@ -546,11 +1075,12 @@ class DoableNode(Node):
     #
     # Args:
     #   d: A datetime to reset.
-    #   b: The boundary of the interval: a string to be parsed.
+    #   b: The boundary of the interval, as parsed by the matching
+    #      _Recurrence._boundary_parsers function.
     _interval_boundary_function = {
-        'day': PreviousTime,
-        'week': PreviousWeekDay,
-        'month': PreviousMonthDay,
+        'day': _PreviousTime,
+        'week': _PreviousWeekDay,
+        'month': _PreviousMonthDay,
     }
 
     # Functions which advance a datetime by some number of units.
@@ -568,24 +1098,43 @@ class DoableNode(Node):
         'month': AdvanceByMonths
     }
 
+    _patch_methods = {
+        Actions.MarkDONE: '_PatchMarkDone',
+        Actions.UpdateLASTDONE: '_PatchUpdateLastdone',
+        Actions.DefaultCheckoff: '_PatchDefaultCheckoff',
+    }
+
     def __init__(self, *args, **kwargs):
         super(DoableNode, self).__init__(*args, **kwargs)
         self.done = False
         self.recurring = False
         self.last_done = None
-        self._diff_functions[Actions.MarkDONE] = self._PatchMarkDone
-        self._diff_functions[Actions.UpdateLASTDONE] = \
-            self._PatchUpdateLastdone
-        self._diff_functions[Actions.DefaultCheckoff] = self._PatchMarkDone
+        self._recurrence = None
+        # For recurring actions: the last_done and _recurrence which the
+        # (visible, ready, due) dates were last computed from, and the dates.
+        self._recurring_dates = (None, None, None)
 
         # A list of ids for DoableNode objects which must be marked DONE before
         # *this* DoableNode will be visible.
-        self.blockers = []
+        self.blockers = _NO_ITEMS
 
-        # A list of ids for this DoableNode.  The initial id is for internal
-        # usage only; note that it can never match the _id_pattern regex.
-        # Other IDs may be added using the _id_pattern regex.
-        self.ids = ['*{}'.format(id(self))]
+        # In an ordered Project: the previous not-done DoableNode sibling,
+        # which must also be marked DONE before *this* DoableNode will be
+        # visible.
+        self.predecessor = None
+
+        # The ids added using the _id_pattern regex.
+        self._ids = _NO_ITEMS
+
+    @property
+    def ids(self):
+        """A list of ids for this DoableNode.
+
+        The initial id is for internal usage only; note that it can never match
+        the _id_pattern regex.  The others were added using the _id_pattern
+        regex.
+        """
+        return ['*{}'.format(id(self))] + list(self._ids)
 
     def DateState(self, now):
         """The state of this node relative to now: late; ready; due; invisible.
@@ -610,50 +1159,66 @@ class DoableNode(Node):
             return DateStates.due
         return DateStates.ready
 
+    def DateBoundaries(self):
+        """The times at which this node's DateState() may change.
+
+        DateState(now) stays the same for every now between two consecutive
+        boundaries (or before the first, or after the last); only at (or just
+        after) a boundary can it change.
+
+        Returns:
+            A sorted list of datetime.datetime objects.
+        """
+        if self.recurring:
+            if not self.last_done:
+                return []
+            self._SetRecurringDates()
+        return sorted(set(date for date in (self.visible_date,
+                                            self.ready_date,
+                                            self.due_date)
+                          if date is not None))
+
     def _ParseAfter(self, match):
-        self.blockers.extend([match.group('id')])
+        self._AppendTo('blockers', match.group('id'))
         return ''
 
     def _ParseDone(self, match):
-        self.done = True
+        if not self.done:
+            self.done = True
+            if isinstance(self._parent, Project):
+                self._parent._open_children -= 1
         return ''
 
     def _ParseId(self, match):
-        self.ids.extend([match.group('id')])
+        self._AppendTo('_ids', match.group('id'))
         return ''
 
     def _ParseLastDone(self, match):
         try:
-            last_done = datetime.datetime.strptime(match.group('datetime'),
-                                                   self._datetime_format)
-            self.last_done = last_done
+            self.last_done = _ParseDateTime(match.group('datetime'),
+                                            need_time=True)
             return ''
         except ValueError:
             return match.group(0)
 
     def _ParseRecur(self, match):
-        self._recur_raw_string = match
-        self.recurring = True
-        self._diff_functions[Actions.DefaultCheckoff] = \
-            self._PatchUpdateLastdone
-        self._recur_max = int(match.group('max')) if match.group('max') else 1
-        self._recur_min = int(match.group('min')) if match.group('min') else \
-            self._recur_max
-        self._recur_unit = match.group('unit')
-        self._recur_unit_boundary = match.group('due')
-        self._recur_subunit_visible = match.group('vis')
+        self._SetRecurrence(_Recurrence.FromMatch(match))
         return ''
 
-    def _ParseSpecializedTokens(self, text):
-        """Parse tokens specific to indented blocks.
+    def _SetRecurrence(self, recurrence):
+        """Make this DoableNode recur on the given schedule (a _Recurrence)."""
+        self._recurrence = recurrence
+        self.recurring = True
+
+    def _PatchDefaultCheckoff(self, now):
+        """A patch which checks off this DoableNode in the usual way.
+
+        That means updating the LASTDONE timestamp of a recurring DoableNode,
+        and marking any other DoableNode as 'DONE'.
         """
-        text = super(DoableNode, self)._ParseSpecializedTokens(text)
-        text = self._done_pattern.sub(self._ParseDone, text)
-        text = self._id_pattern.sub(self._ParseId, text)
-        text = self._after_pattern.sub(self._ParseAfter, text)
-        text = self._recur_pattern.sub(self._ParseRecur, text)
-        text = self._last_done_pattern.sub(self._ParseLastDone, text)
-        return text
+        if self.recurring:
+            return self._PatchUpdateLastdone(now)
+        return self._PatchMarkDone(now)
 
     def _PatchMarkDone(self, now):
         """A patch which marks this DoableNode as 'DONE'."""
@@ -693,57 +1258,86 @@ class DoableNode(Node):
 
     def _SetRecurringDates(self):
         """Set dates (visible, due, etc.) based on last-done date."""
-        unit = self._recur_unit
-
-        # For computing the due date and visible date: do we go from the
-        # beginning of the interval, or the end?  (The distinction is only
-        # relevant for variable-length intervals, such as months.)
-        due_from_start = vis_from_start = True
-        if unit == 'month':
-            if self._recur_unit_boundary and \
-                    int(self._recur_unit_boundary.split()[0]) < 1:
-                due_from_start = False
-            if self._recur_subunit_visible and \
-                    int(self._recur_subunit_visible.split()[0]) < 1:
-                vis_from_start = False
+        # The dates only depend on last_done and the recurrence, so only
+        # compute them again if one of those has changed.
+        (last_done, recurrence, dates) = self._recurring_dates
+        if (last_done is not self.last_done or
+                recurrence is not self._recurrence):
+            dates = self._ComputeRecurringDates()
+            self._recurring_dates = (self.last_done, self._recurrence, dates)
+        if (self._visible_date, self._ready_date, self._due_date) != dates:
+            (self._visible_date, self._ready_date, self._due_date) = dates
+            self._Inherit()
+
+    def _ComputeRecurringDates(self):
+        """The (visible, ready, due) dates, based on last-done date."""
+        recurrence = self._recurrence
+        boundary = self._interval_boundary_function[recurrence.unit]
+        advance = self._date_advancing_function[recurrence.unit]
 
         # Find the previous datetime (before the last-done time) which bounds
         # the time interval (day, week, month, ...).
-        base_datetime = self._interval_boundary_function[unit](
-            self.last_done, self._recur_unit_boundary)
+        base_datetime = boundary(self.last_done, recurrence.due_boundary)
 
         # If an action was completed after the due date, but before the next
         # visible date, associate it with the previous interval.  (An example
         # of the kind of disaster this prevents: suppose the rent is due on the
         # 1st, and we pay it on the 2nd.  Then we risk the system thinking the
         # rent is paid for the *new* month.
-        if self._recur_subunit_visible:
+        if recurrence.vis_boundary is not None:
             # This kind of operation doesn't really make sense if the task is
             # visible for the entire interval.
-            previous_vis_date = self._interval_boundary_function[unit](
-                self.last_done, self._recur_subunit_visible, due=False)
+            previous_vis_date = boundary(self.last_done,
+                                         recurrence.vis_boundary)
             # If we did the task after the due time, but before it was visible,
             # then the previous due date comes *after* the previous visible
             # date.  So, put the base datetime back in the *previous* unit.
             if base_datetime > previous_vis_date:
-                base_datetime = self._date_advancing_function[unit](
-                    base_datetime, -1, due_from_start)
+                base_datetime = advance(base_datetime, -1,
+                                        recurrence.due_from_start)
 
         # Set visible, ready, and due dates relative to base_datetime.
-        self._visible_date = self._date_advancing_function[unit](
-            base_datetime, self._recur_min, vis_from_start)
-        if self._recur_subunit_visible:
+        visible_date = advance(base_datetime, recurrence.min_units,
+                               recurrence.vis_from_start)
+        if recurrence.vis_boundary is not None:
             # Move the visible date forward to the subunit boundary (if any).
             # To do this, move it forward one full unit, then move it back
             # until it matches the visible subunit boundary.
-            self._visible_date = self._date_advancing_function[unit](
-                self._visible_date, 1, vis_from_start)
-            self._visible_date = self._interval_boundary_function[unit](
-                self._visible_date, self._recur_subunit_visible, due=False)
-        self._ready_date = self._date_advancing_function[unit](
-            base_datetime, self._recur_max, due_from_start)
-        self._due_date = self._date_advancing_function[unit](
-            base_datetime, self._recur_max + 1, due_from_start)
+            visible_date = advance(visible_date, 1, recurrence.vis_from_start)
+            visible_date = boundary(visible_date, recurrence.vis_boundary)
+        ready_date = advance(base_datetime, recurrence.max_units,
+                             recurrence.due_from_start)
+        due_date = advance(base_datetime, recurrence.max_units + 1,
+                           recurrence.due_from_start)
+        return (visible_date, ready_date, due_date)
+
+
+# How many bytes of each line's hash a File keeps (see _LineHash()).
+_LINE_HASH_SIZE = 8
+
+
+# Marks a slot which was never set (see _SlotsOf()).
+_UNSET = object()
+
+# The names of all the slots of each Node class, as found by _SlotsOf().
+_slots_of_class = {}
+
+
+def _SlotsOf(cls):
+    """The names of every slot of cls, including those of its base classes."""
+    slots = _slots_of_class.get(cls)
+    if slots is None:
+        slots = tuple(name for base in cls.__mro__
+                      for name in base.__dict__.get('__slots__', ()))
+        _slots_of_class[cls] = slots
+    return slots
+
+
+def _LineHash(line):
+    """A short hash of one line of text (without its trailing newline)."""
+    if not isinstance(line, bytes):
+        line = line.encode('utf-8')
+    return hashlib.sha1(line).digest()[:_LINE_HASH_SIZE]
 
 
 class File(Node):
@@ -768,38 +1362,75 @@ class File(Node):
     _comment_pattern = re.compile(_indent + r'\*' + _text_pattern)
     _project_pattern = re.compile(_indent + r'(?P<type>[#-])' + _text_pattern)
 
+    # Which of the above patterns a line could match, based on its first
+    # non-indent character.
+    _line_type_for_marker = {
+        '=': 'section',
+        '#': 'project',
+        '-': 'project',
+        '@': 'next_action',
+        '*': 'comment',
+    }
+
+    # Update() always splices changes this small into the tree; larger ones
+    # only if they're less than half of the file.
+    _max_lines_always_spliced = 64
+
+    __slots__ = ('bad_lines', '_file_name', '_node_with_id', '_line_hashes')
+
     def __init__(self, file_name=None, *args, **kwargs):
+        # (Node.__init__() needs the file name, for the inherited values.)
+        self._file_name = file_name
         super(File, self).__init__(text='', priority=None, *args, **kwargs)
         self.bad_lines = []
-        self._file_name = file_name
         self._node_with_id = {}
+        # A hash of each line which the tree was parsed from (see _LineHash()),
+        # to diff against on Update().  The Nodes keep the text itself.
+        self._line_hashes = bytearray()
 
         if file_name:
             # Read file contents and create a tree of Nodes from them.
             with open(file_name) as vtd_file:
-                # Parse the file, one line at a time, as follows.
-                # Try creating a Node from the line.
-                # - If successful, make the node a child of the previous node
-                #   -- or at least, the first *ancestor* of the previous node
-                #   which can contain the new one.
-                # - If unsuccessful, try absorbing the text into the previous
-                #   node.
-                previous_node = self
-                for (line_num, line) in enumerate(vtd_file, 1):
-                    raw_text = line.rstrip('\n')
-                    new_node = self.CreateNodeFromLine(raw_text, line_num)
-                    if new_node:
-                        while (previous_node and not
-                               previous_node.AddChild(new_node)):
-                            previous_node = previous_node.parent
-                        previous_node = new_node
-                    else:
-                        if not previous_node.AbsorbText(raw_text):
-                            self.bad_lines.append((line_num, raw_text))
-                    try:
-                        self._TrackIdNode(previous_node)
-                    except KeyError:
-                        self.bad_lines.append((line_num, raw_text))
+                for _ in self._ParseLines(vtd_file):
+                    pass
+
+    @classmethod
+    def FromLines(cls, lines, file_name=None):
+        """Create a File from lines of text, rather than from a file on disk.
+
+        Args:
+            lines: Any iterable of lines (e.g., a list of lines in an editor
+                buffer, or a generator); trailing newlines are optional.
+            file_name: The name to report as the source of the Nodes.
+
+        Returns:
+            A File object whose tree holds the parsed Nodes.
+        """
+        vtd_file = cls()
+        vtd_file.file_name = file_name
+        for _ in vtd_file._ParseLines(lines):
+            pass
+        return vtd_file
+
+    @classmethod
+    def StreamFromLines(cls, lines, file_name=None):
+        """Parse lines of text, yielding each top-level Node once complete.
+
+        Lines are consumed lazily, so callers can query each top-level Node
+        (and its subtree) before the remaining lines have even been read.
+
+        Args:
+            lines: Any iterable of lines; trailing newlines are optional.
+            file_name: The name to report as the source of the Nodes.
+
+        Yields:
+            Each top-level Node (i.e., each child of the File), as soon as a
+            later line starts the next one, or the lines run out.  Its parent
+            is the File being built.
+        """
+        vtd_file = cls()
+        vtd_file.file_name = file_name
+        return vtd_file._ParseLines(lines)
 
     @staticmethod
     def CreateNodeFromLine(line, line_num=1):
@@ -822,6 +1453,11 @@ class File(Node):
     def file_name(self):
         return self._file_name
 
+    @file_name.setter
+    def file_name(self, file_name):
+        self._file_name = file_name
+        self._Inherit()
+
     @staticmethod
     def _CreateCorrectNodeType(text):
         """Creates the Node object and returns the raw text.
@@ -836,35 +1472,91 @@ class File(Node):
                     been stripped out, but *before* other information (e.g.,
                     due dates, priority, etc.) has been stripped out.
         """
-        section_match = File._section_pattern.match(text)
-        if section_match:
-            section = Section(level=len(section_match.group('level')))
-            return (section, section_match.group('text'))
-
-        project_match = File._project_pattern.match(text)
-        if project_match:
-            is_ordered = (project_match.group('type') == '#')
-            indent = len(project_match.group('indent'))
-            project = Project(is_ordered=is_ordered, indent=indent)
-            return (project, project_match.group('text'))
-
-        next_action_match = File._next_action_pattern.match(text)
-        if next_action_match:
-            indent = len(next_action_match.group('indent'))
-            action = NextAction(indent=indent)
-            return (action, next_action_match.group('text'))
-
-        comment_match = File._comment_pattern.match(text)
-        if comment_match:
-            indent = len(comment_match.group('indent'))
-            comment = Comment(indent=indent)
-            return (comment, comment_match.group('text'))
+        # Only one pattern can possibly match, depending on the first
+        # non-indent character; most lines (blank lines, or plain text
+        # continuing the previous Node) need no regex at all.
+        marker = text.lstrip()[:1]
+        line_type = File._line_type_for_marker.get(marker)
+
+        if line_type == 'section':
+            section_match = File._section_pattern.match(text)
+            if section_match:
+                section = Section(level=len(section_match.group('level')))
+                return (section, section_match.group('text'))
+
+        elif line_type == 'project':
+            project_match = File._project_pattern.match(text)
+            if project_match:
+                is_ordered = (project_match.group('type') == '#')
+                indent = len(project_match.group('indent'))
+                project = Project(is_ordered=is_ordered, indent=indent)
+                return (project, project_match.group('text'))
+
+        elif line_type == 'next_action':
+            next_action_match = File._next_action_pattern.match(text)
+            if next_action_match:
+                indent = len(next_action_match.group('indent'))
+                action = NextAction(indent=indent)
+                return (action, next_action_match.group('text'))
+
+        elif line_type == 'comment':
+            comment_match = File._comment_pattern.match(text)
+            if comment_match:
+                indent = len(comment_match.group('indent'))
+                comment = Comment(indent=indent)
+                return (comment, comment_match.group('text'))
 
         return (None, '')
 
     def _CanAbsorbText(self, unused_text):
         return False
 
+    def _InheritFromParent(self):
+        super(File, self)._InheritFromParent()
+        if self._inherited.file_name != self._file_name:
+            self._inherited = self._inherited._replace(
+                file_name=self._file_name)
+
+    def _ParseLines(self, lines):
+        """Create a tree of Nodes under this File from lines of text.
+
+        Args:
+            lines: An iterable of lines; trailing newlines are optional.
+
+        Yields:
+            Each top-level Node, as soon as it's complete.
+        """
+        # Parse the file, one line at a time, as follows.
+        # Try creating a Node from the line.
+        # - If successful, make the node a child of the previous node
+        #   -- or at least, the first *ancestor* of the previous node
+        #   which can contain the new one.
+        # - If unsuccessful, try absorbing the text into the previous
+        #   node.
+        previous_node = self
+        for (line_num, line) in enumerate(lines, 1):
+            raw_text = line.rstrip('\n')
+            self._line_hashes += _LineHash(raw_text)
+            new_node = self.CreateNodeFromLine(raw_text, line_num)
+            if new_node:
+                while (previous_node and not
+                       previous_node.AddChild(new_node)):
+                    previous_node = previous_node.parent
+                # Nothing can change a top-level Node's subtree once the next
+                # top-level Node has started.
+                if previous_node is self and len(self.children) > 1:
+                    yield self.children[-2]
+                previous_node = new_node
+            else:
+                if not previous_node.AbsorbText(raw_text):
+                    self.bad_lines.append((line_num, raw_text))
+            try:
+                self._TrackIdNode(previous_node)
+            except KeyError:
+                self.bad_lines.append((line_num, raw_text))
+        if self.children:
+            yield self.children[-1]
+
     def _TrackIdNode(self, node):
         """If this node has an ID, add it to the (id -> node) map.
 
@@ -872,7 +1564,8 @@ class File(Node):
             node: A libvtd.node.Node object.
         """
         try:
-            for id in node.ids:
+            # (The initial, internal id never needs looking up.)
+            for id in node._ids:
                 if id in self._node_with_id.keys():
                     if self._node_with_id[id] != node:
                         raise KeyError
@@ -881,6 +1574,28 @@ class File(Node):
         except AttributeError:
             return
 
+    def ContentHash(self):
+        """A hash of the lines which this File was parsed from."""
+        return hashlib.sha1(bytes(self._line_hashes)).hexdigest()
+
+    @staticmethod
+    def ContentHashOf(lines):
+        """The ContentHash() of a File parsed from lines.
+
+        Args:
+            lines: An iterable of lines; trailing newlines are optional.
+        """
+        return hashlib.sha1(b''.join(
+            _LineHash(line.rstrip('\n')) for line in lines)).hexdigest()
+
+    def _NumLines(self):
+        """The number of lines which this File was parsed from."""
+        return len(self._line_hashes) // _LINE_HASH_SIZE
+
+    def Ids(self):
+        """The ids of this file's child nodes, as a list (in no set order)."""
+        return list(self._node_with_id.keys())
+
     def NodeWithId(self, id):
         """The child node of this flie with the given ID (None if none).
 
@@ -891,12 +1606,308 @@ class File(Node):
             return None
         return self._node_with_id[id]
 
+    def Update(self, lines):
+        """Bring this File up to date with new contents, reparsing only the
+        changes.
+
+        The smallest run of sibling subtrees which encloses the changed lines
+        gets reparsed, and spliced into the tree in place of the old run.  The
+        rest of the tree stays as it is, apart from shifted line numbers.
+
+        Args:
+            lines: The new contents of the file, as an iterable of lines;
+                trailing newlines are optional.
+
+        Returns:
+            True if this File is now up to date.  False if the change can't be
+            spliced in (say, because it changes how the lines around it nest,
+            or because it touches most of the file); the File is then left
+            unchanged, and should be reparsed from scratch.
+        """
+        plan = self._PlanUpdate(lines)
+        if not plan:
+            return False
+        (new_lines, new_hashes, run) = plan
+        if run and not self._SpliceRun(*(run + (new_lines,))):
+            return False
+        self._line_hashes = bytearray(b''.join(new_hashes))
+        return True
+
+    def Updated(self, lines):
+        """A copy of this File, brought up to date as by Update().
+
+        This File and its Nodes don't change at all, so anyone still using
+        them sees the old contents throughout.  Every Node gets copied, since
+        each one links to its parent (see _CopyTree()); but only the changed
+        lines get reparsed, as for Update().
+
+        Args:
+            lines: As for Update().
+
+        Returns:
+            The new File (or this one, if nothing changed); None if the change
+            can't be spliced in, as for Update().
+        """
+        plan = self._PlanUpdate(lines)
+        if not plan:
+            return None
+        (new_lines, new_hashes, run) = plan
+        if not run:
+            return self
+        (parent, first, last, run_begin, run_end) = run
+        (new_file, copies) = self._CopyTree()
+        if not new_file._SpliceRun(copies[parent], first, last, run_begin,
+                                   run_end, new_lines):
+            return None
+        new_file._line_hashes = bytearray(b''.join(new_hashes))
+        return new_file
+
+    def _CopyTree(self):
+        """A copy of this File's whole tree, which can change independently.
+
+        Each Node gets copied shallowly: the copies share their text, dates,
+        and so on, but link to each other (as parents, children,
+        predecessors, and owners of ids) rather than to the originals.  That's
+        far cheaper than parsing the lines again.
+
+        Returns:
+            A tuple (new_file, copies): the copy of this File, and a dict
+            mapping each original Node to its copy.
+        """
+        copies = {}
+        for node in PreOrder([self]):
+            new_node = object.__new__(node.__class__)
+            for name in _SlotsOf(node.__class__):
+                value = getattr(node, name, _UNSET)
+                if value is not _UNSET:
+                    setattr(new_node, name, value)
+            copies[node] = new_node
+        for (node, new_node) in copies.items():
+            if node.children:
+                new_node.children = [copies[child] for child in node.children]
+            if node._parent is not None:
+                new_node._parent = copies[node._parent]
+            if getattr(node, 'predecessor', None) is not None:
+                new_node.predecessor = copies[node.predecessor]
+            if getattr(node, '_doable_children', None):
+                new_node._doable_children = [
+                    copies[child] for child in node._doable_children]
+        new_file = copies[self]
+        new_file.bad_lines = list(self.bad_lines)
+        new_file._node_with_id = dict(
+            (id, copies[node]) for (id, node) in self._node_with_id.items())
+        new_file._line_hashes = bytearray(self._line_hashes)
+        return (new_file, copies)
+
+    def _PlanUpdate(self, lines):
+        """Work out what Update() has to reparse.
+
+        Args:
+            lines: As for Update().
+
+        Returns:
+            A tuple (new_lines, new_hashes, run): the new lines, their
+            _LineHash()es, and the run of children to splice them into, as
+            from _EnclosingRun() (None if nothing changed).  None if the
+            change can't be spliced in.
+        """
+        new_lines = [line.rstrip('\n') for line in lines]
+        new_hashes = [_LineHash(line) for line in new_lines]
+        old_hashes = self._line_hashes
+        num_old_lines = self._NumLines()
+
+        def OldHash(i):
+            return old_hashes[i * _LINE_HASH_SIZE:(i + 1) * _LINE_HASH_SIZE]
+
+        # The changed lines are [begin, old_end) in the old lines, and
+        # [begin, new_end) in new_lines.
+        shortest = min(num_old_lines, len(new_lines))
+        begin = 0
+        while begin < shortest and OldHash(begin) == new_hashes[begin]:
+            begin += 1
+        if begin == num_old_lines == len(new_lines):
+            return (new_lines, new_hashes, None)
+        (old_end, new_end) = (num_old_lines, len(new_lines))
+        while (old_end > begin and new_end > begin and
+               OldHash(old_end - 1) == new_hashes[new_end - 1]):
+            old_end -= 1
+            new_end -= 1
+        if old_end == begin:
+            # Only insertions: count a neighbouring line as changed too, so
+            # that there's an old Node to replace.
+            if old_end < num_old_lines:
+                old_end += 1
+            elif begin > 0:
+                begin -= 1
+            else:
+                return None
+
+        run = self._EnclosingRun(begin, old_end)
+        if not run:
+            return None
+        (parent, first, last, run_begin, run_end) = run
+        run_length = run_end + len(new_lines) - num_old_lines - run_begin
+        if run_length > max(self._max_lines_always_spliced,
+                            len(new_lines) // 2):
+            return None
+        return (new_lines, new_hashes, run)
+
+    def _EnclosingRun(self, begin, end):
+        """The smallest run of sibling subtrees which encloses some old lines.
+
+        Args:
+            begin: Index (in the old lines) of the first line to enclose.
+            end: Index just past the last line to enclose.
+
+        Returns:
+            A tuple (parent, first, last, run_begin, run_end), where the
+            subtrees of parent.children[first:last + 1] span exactly the lines
+            [run_begin, run_end).  None if no Node encloses line begin.
+        """
+        parent = self
+        parent_end = self._NumLines()
+        while True:
+            starts = [child._line_in_file - 1 for child in parent.children]
+            first = bisect.bisect_right(starts, begin) - 1
+            if first < 0:
+                return None
+            last = bisect.bisect_left(starts, end) - 1
+            run_end = (starts[last + 1] if last + 1 < len(starts)
+                       else parent_end)
+            child = parent.children[first]
+            if (first == last and child.children and
+                    child.children[0]._line_in_file - 1 <= begin):
+                # The lines are all within one child's children.
+                (parent, parent_end) = (child, run_end)
+            else:
+                return (parent, first, last, starts[first], run_end)
+
+    def _SpliceRun(self, parent, first, last, run_begin, run_end, new_lines):
+        """Replace a run of parent's children by parsing their new lines.
+
+        The new lines must parse into Nodes which nest exactly where the old
+        ones did, and which leave the Nodes after them nesting as before;
+        otherwise, nothing changes.
+
+        Args:
+            parent: The Node (possibly this File) whose children to replace.
+            first: The index of the first child to replace.
+            last: The index of the last child to replace.
+            run_begin: Index (in the old lines) of the first line of the run.
+            run_end: Index just past the last line of the run.
+            new_lines: The new contents of the whole file.
+
+        Returns:
+            A boolean indicating success.
+        """
+        delta = len(new_lines) - self._NumLines()
+        old_run = parent.children[first:last + 1]
+        num_children = len(parent.children)
+
+        # The old run's ids are up for grabs again.
+        released_ids = {}
+        for node in PreOrder(old_run):
+            for id in getattr(node, '_ids', _NO_ITEMS):
+                if self._node_with_id.get(id) is node:
+                    released_ids[id] = node
+        for id in released_ids:
+            del self._node_with_id[id]
+
+        new_nodes = set()
+
+        def Abandon():
+            del parent.children[num_children:]
+            if isinstance(parent, Project):
+                parent._ReplacedChildren()
+            for node in new_nodes:
+                for id in getattr(node, '_ids', _NO_ITEMS):
+                    if self._node_with_id.get(id) is node:
+                        del self._node_with_id[id]
+            self._node_with_id.update(released_ids)
+            return False
+
+        # Parse the new lines as _ParseLines would, except that Nodes outside
+        # the run must not change: if a line would nest inside (or be absorbed
+        # by) one of them, give up.
+        previous_node = parent.children[first - 1] if first else parent
+        while previous_node is not parent and previous_node.children:
+            previous_node = previous_node.children[-1]
+        bad_lines = []
+        for (line_num, raw_text) in enumerate(
+                new_lines[run_begin:run_end + delta], run_begin + 1):
+            new_node = self.CreateNodeFromLine(raw_text, line_num)
+            if new_node:
+                node = previous_node
+                while node is not parent:
+                    if node in new_nodes:
+                        if node.AddChild(new_node):
+                            break
+                    elif node._CanContain(new_node):
+                        return Abandon()
+                    node = node.parent
+                if node is parent and not parent.AddChild(new_node):
+                    return Abandon()
+                new_nodes.add(new_node)
+                previous_node = new_node
+            elif previous_node in new_nodes:
+                if not previous_node.AbsorbText(raw_text):
+                    bad_lines.append((line_num, raw_text))
+            else:
+                return Abandon()
+
+            # As _TrackIdNode, but Nodes outside the run keep their ids.
+            for id in getattr(previous_node, '_ids', _NO_ITEMS):
+                owner = self._node_with_id.setdefault(id, previous_node)
+                if owner is not previous_node:
+                    if owner in new_nodes or owner._line_in_file <= run_begin:
+                        bad_lines.append((line_num, raw_text))
+                        break
+                    return Abandon()
+
+        # The first Node after the run must still nest outside of it.
+        if run_end + delta < len(new_lines):
+            next_node = self.CreateNodeFromLine(new_lines[run_end + delta])
+            node = previous_node
+            while node is not parent:
+                if node._CanContain(next_node):
+                    return Abandon()
+                node = node.parent
+
+        # Lines after the run which clashed with the old run's ids might not
+        # clash any more.
+        if (any(id not in self._node_with_id for id in released_ids) and
+                any(line_num > run_end for (line_num, _) in self.bad_lines)):
+            return Abandon()
+
+        new_run = parent.children[num_children:]
+        del parent.children[num_children:]
+        parent.children[first:last + 1] = new_run
+        if isinstance(parent, Project):
+            parent._ReplacedChildren()
+
+        if delta:
+            later_nodes = parent.children[first + len(new_run):]
+            ancestor = parent
+            while ancestor is not self:
+                siblings = ancestor.parent.children
+                later_nodes.extend(siblings[siblings.index(ancestor) + 1:])
+                ancestor = ancestor.parent
+            for node in PreOrder(later_nodes):
+                node._line_in_file += delta
+        self.bad_lines = (
+            [(n, text) for (n, text) in self.bad_lines if n <= run_begin] +
+            bad_lines +
+            [(n + delta, text) for (n, text) in self.bad_lines if n > run_end])
+        return True
+
 
 class Section(Node):
 
     _level = File._level + 1
     _can_nest_same_type = True
 
+    __slots__ = ('level',)
+
     def __init__(self, level=1, text=None, priority=None, *args, **kwargs):
         super(Section, self).__init__(text=text, priority=priority, *args,
                                       **kwargs)
@@ -913,37 +1924,86 @@ class Project(DoableNode, IndentedNode):
     _level = Section._level + 1
     _can_nest_same_type = True
 
+    __slots__ = ('indent', 'ordered', '_doable_children', '_open_children')
+
     def __init__(self, is_ordered=False, text=None, priority=None, *args,
                  **kwargs):
         super(Project, self).__init__(text=text, priority=priority, *args,
                                       **kwargs)
         self.ordered = is_ordered
+        # In an ordered Project: the DoableNode children, in order, except
+        # that some of the done ones have been dropped (see AddChild()).
+        self._doable_children = _NO_ITEMS
+        # How many NextAction and Project children aren't done.
+        self._open_children = 0
+
+    @property
+    def needs_next_action(self):
+        """Whether this Project is open, but has no open NextAction or
+        Project children.
+        """
+        return not (self.done or self._open_children)
 
     def AddChild(self, other):
         if super(Project, self).AddChild(other):
             if self.ordered and isinstance(other, DoableNode):
                 # If this Project is ordered, the new DoableNode will be
-                # blocked by the most recent not-done DoableNode child.
-                last_doable_node = None
-                for child in self.children:
-                    if (isinstance(child, DoableNode) and not child.done and
-                            child != other):
-                        last_doable_node = child
-                if last_doable_node and last_doable_node != other:
-                    temp_id = last_doable_node.ids[0]
-                    other.blockers.extend([temp_id])
+                # blocked by the most recent not-done DoableNode child.  A
+                # child can still become done after it's added (by absorbing
+                # more text), so drop done ones from the end as we go.
+                # Children never become un-done, so each gets dropped at most
+                # once.
+                doable_children = self._doable_children
+                while doable_children and doable_children[-1].done:
+                    doable_children.pop()
+                other.predecessor = (doable_children[-1] if doable_children
+                                     else None)
+                self._AppendTo('_doable_children', other)
 
             if self.recurring and isinstance(other, DoableNode):
-                other._ParseRecur(self._recur_raw_string)
+                other._SetRecurrence(self._recurrence)
+
+            # (A child which becomes done later on uncounts itself: see
+            # _ParseDone().)
+            if isinstance(other, DoableNode) and not other.done:
+                self._open_children += 1
             return True
         return False
 
+    def _ReplacedChildren(self):
+        """Update what this Project knows about its children, from scratch.
+
+        Must be called after self.children changes other than by AddChild().
+        """
+        if self.ordered:
+            self._LinkOrderedChildren()
+        self._open_children = sum(
+            1 for child in self.children
+            if isinstance(child, DoableNode) and not child.done)
+
+    def _LinkOrderedChildren(self):
+        """Block each DoableNode child on the previous not-done one, afresh."""
+        predecessor = None
+        doable_children = []
+        for child in self.children:
+            if isinstance(child, DoableNode):
+                child.predecessor = predecessor
+                doable_children.append(child)
+                if not child.done:
+                    predecessor = child
+        self._doable_children = doable_children or _NO_ITEMS
+
 
 class NextAction(DoableNode, IndentedNode):
 
     _level = Project._level + 1
     _time = re.compile(Node._r_start + r'@t:(?P<time>\d+)' + Node._r_end)
 
+    _tokens = DoableNode._tokens + [_Token('@', _time, '_ParseTime')]
+    _token_scanner = _TokenScanner(_tokens, start=Node._r_start)
+
+    __slots__ = ('indent', 'minutes')
+
     def __init__(self, text=None, priority=None, *args, **kwargs):
         super(NextAction, self).__init__(text=text, priority=priority, *args,
                                          **kwargs)
@@ -960,25 +2020,24 @@ class NextAction(DoableNode, IndentedNode):
         self.minutes = int(match.group('time'))
         return ''
 
-    def _ParseSpecializedTokens(self, text):
-        """Parse NextAction-specific tokens.
-        """
-        text = super(NextAction, self)._ParseSpecializedTokens(text)
-        text = self._time.sub(self._ParseTime, text)
-        return text
-
 
 class NeedsNextActionStub(NextAction):
     """A stub to remind the user that a Project needs a NextAction."""
 
     _stub_text = '{MISSING Next Action}'
 
+    __slots__ = ()
+
     def __init__(self, project, *args, **kwargs):
         super(NeedsNextActionStub, self).__init__(
             text=NeedsNextActionStub._stub_text, *args, **kwargs)
         self.parent = project
-        self.Patch = lambda action, now=None: self.parent.Patch(action, now)
-        self.Source = lambda: self.parent.Source()
+
+    def Patch(self, action, now=None):
+        return self.parent.Patch(action, now)
+
+    def Source(self):
+        return self.parent.Source()
 
 
 class Comment(IndentedNode):
@@ -986,6 +2045,8 @@ class Comment(IndentedNode):
     _level = NextAction._level + 1
     _can_nest_same_type = True
 
+    __slots__ = ('indent',)
+
     def __init__(self, text=None, priority=None, *args, **kwargs):
         super(Comment, self).__init__(text=text, priority=priority, *args,
                                       **kwargs)
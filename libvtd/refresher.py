@@ -0,0 +1,140 @@
+import threading
+import time
+
+
+class Refresher(object):
+    """Refreshes a TrustedSystem in a background thread, whenever asked to.
+
+    Request() returns right away; the thread then rereads whatever changed,
+    and the TrustedSystem swaps the new files in all at once.  Meanwhile,
+    queries (on any thread) carry on with the files as they were, so they
+    never wait for parsing.  Requests which come in while a refresh is under
+    way get merged into the next one.
+    """
+
+    def __init__(self, trusted_system, on_refresh=None):
+        """Prepare to refresh trusted_system (see Start()).
+
+        Args:
+            trusted_system: A libvtd.trusted_system.TrustedSystem.
+            on_refresh: A function, called (on the background thread) as
+                on_refresh(file_names) after each refresh which reparsed some
+                files; file_names is the sorted list of their names.
+        """
+        self._trusted_system = trusted_system
+        self._on_refresh = on_refresh
+        self._condition = threading.Condition()
+        # What the next refresh has to do: check every file, or just these.
+        self._refresh_all = False
+        self._file_names = set()
+        # Whether a refresh is under way; and what the last failed one raised,
+        # until Wait() reports it.
+        self._busy = False
+        self._error = None
+        self._stop = False
+        self._thread = None
+
+    def Start(self):
+        """Start refreshing on request, in a daemon thread."""
+        with self._condition:
+            self._stop = False
+        self._thread = threading.Thread(target=self._Run,
+                                        name='libvtd.refresher.Refresher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def Stop(self):
+        """Stop the thread, once any refresh under way is finished.
+
+        Requests which haven't been started yet get dropped.
+        """
+        with self._condition:
+            self._stop = True
+            self._refresh_all = False
+            self._file_names = set()
+            self._condition.notify_all()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        self.Start()
+        return self
+
+    def __exit__(self, *unused_exc_info):
+        self.Stop()
+
+    def Request(self, file_names=None):
+        """Ask for a refresh, without waiting for it.
+
+        Args:
+            file_names: Names of the files which might have changed, as for
+                TrustedSystem.RefreshFiles().  The default, None, checks every
+                file, as for TrustedSystem.Refresh().
+        """
+        with self._condition:
+            if file_names is None:
+                self._refresh_all = True
+            else:
+                self._file_names.update(file_names)
+            self._condition.notify_all()
+
+    def Wait(self, timeout=None):
+        """Wait until every refresh requested so far is finished.
+
+        Args:
+            timeout: The longest time to wait, in seconds; None means no
+                limit.
+
+        Returns:
+            True if the refreshes are finished; False if time ran out first.
+
+        Raises:
+            Whatever the last failed refresh raised (say, an OSError for a
+            file which went missing), if Wait() hasn't already raised it.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while self._busy or self._Pending():
+                if deadline is None:
+                    self._condition.wait()
+                elif time.time() < deadline:
+                    self._condition.wait(deadline - time.time())
+                else:
+                    return False
+            (error, self._error) = (self._error, None)
+        if error:
+            raise error
+        return True
+
+    def _Pending(self):
+        """Whether any requests are waiting for the thread to take them up."""
+        return self._refresh_all or bool(self._file_names)
+
+    def _Run(self):
+        while True:
+            with self._condition:
+                while not self._stop and not self._Pending():
+                    self._condition.wait()
+                if self._stop:
+                    return
+                (refresh_all, file_names) = (self._refresh_all,
+                                             self._file_names)
+                self._refresh_all = False
+                self._file_names = set()
+                self._busy = True
+            error = None
+            try:
+                if refresh_all:
+                    refreshed = self._trusted_system.Refresh()
+                else:
+                    refreshed = self._trusted_system.RefreshFiles(file_names)
+                if refreshed and self._on_refresh:
+                    self._on_refresh(refreshed)
+            except Exception as e:
+                error = e
+            with self._condition:
+                self._busy = False
+                if error:
+                    self._error = error
+                self._condition.notify_all()
@@ -0,0 +1,140 @@
+import hashlib
+import os
+import tempfile
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import libvtd.node
+
+# Bump this whenever the attributes of parsed Nodes change, so that trees
+# cached by older code get parsed afresh instead of being loaded.
+_FORMAT_VERSION = 9
+
+
+class TreeCache(object):
+    """A persistent cache of parsed libvtd.node.File trees, in a directory.
+
+    Each entry holds one pickled File, behind a small header which records
+    which contents were parsed: the file's path, size, mtime, and a hash of
+    its lines.  An entry only gets loaded if all of these still match.
+    """
+
+    _suffix = '.vtdcache'
+
+    def __init__(self, cache_dir, max_entries=1000):
+        """Use (and create, if needed) the cache in cache_dir.
+
+        Args:
+            cache_dir: The directory which holds the cache entries.
+            max_entries: Prune() keeps at most this many entries.
+        """
+        self._cache_dir = cache_dir
+        self._max_entries = max_entries
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def Load(self, file_name):
+        """The cached File for file_name, if it matches the file's contents.
+
+        Args:
+            file_name: The name of a VTD file.
+
+        Returns:
+            A libvtd.node.File, exactly as if freshly parsed from file_name; or
+            None if there's no up-to-date entry.
+        """
+        entry_name = self._EntryName(file_name)
+        try:
+            stat = os.stat(file_name)
+            with open(entry_name, 'rb') as entry:
+                header = pickle.load(entry)
+                if header[:4] != (_FORMAT_VERSION, os.path.abspath(file_name),
+                                  stat.st_size, stat.st_mtime):
+                    return None
+                with open(file_name) as vtd_file:
+                    content_hash = libvtd.node.File.ContentHashOf(vtd_file)
+                if header[4] != content_hash:
+                    return None
+                vtd_file = pickle.load(entry)
+        except Exception:
+            # A missing or unreadable entry (or file) is just a miss; the next
+            # Store() will replace the entry.
+            return None
+
+        # Loading an entry counts as using it, as far as Prune() is concerned.
+        os.utime(entry_name, None)
+        vtd_file.file_name = file_name
+        return vtd_file
+
+    def Store(self, file_name, vtd_file):
+        """Cache vtd_file as the parsed contents of file_name, if possible.
+
+        A cache is only ever a shortcut, so failing to write an entry isn't an
+        error: the file just gets parsed afresh next time.  (Say, because the
+        disk is full, or because the tree is nested too deeply for pickle.)
+
+        Args:
+            file_name: The name of the VTD file which vtd_file was parsed from.
+            vtd_file: A libvtd.node.File.
+
+        Returns:
+            Whether the entry got written.
+        """
+        try:
+            stat = os.stat(file_name)
+            header = (_FORMAT_VERSION, os.path.abspath(file_name),
+                      stat.st_size, stat.st_mtime, vtd_file.ContentHash())
+            # (pickle recurses once per level of the tree: a deep one raises
+            # RecursionError, which is a RuntimeError.)
+            tree = pickle.dumps(vtd_file, pickle.HIGHEST_PROTOCOL)
+        except (EnvironmentError, pickle.PicklingError, RuntimeError):
+            return False
+        # Write to a temporary file first, so readers never see half an entry.
+        temp_name = None
+        try:
+            (handle, temp_name) = tempfile.mkstemp(dir=self._cache_dir)
+            with os.fdopen(handle, 'wb') as entry:
+                pickle.dump(header, entry, pickle.HIGHEST_PROTOCOL)
+                entry.write(tree)
+            getattr(os, 'replace', os.rename)(temp_name,
+                                              self._EntryName(file_name))
+        except EnvironmentError:
+            if temp_name and os.path.exists(temp_name):
+                os.unlink(temp_name)
+            return False
+        return True
+
+    def Prune(self):
+        """Remove entries for missing files, and the least recently used ones.
+
+        At most max_entries entries are left afterwards.
+        """
+        entries = []
+        for name in os.listdir(self._cache_dir):
+            if not name.endswith(self._suffix):
+                continue
+            entry_name = os.path.join(self._cache_dir, name)
+            try:
+                with open(entry_name, 'rb') as entry:
+                    file_name = pickle.load(entry)[1]
+            except (IOError, OSError):
+                continue
+            except Exception:
+                # A corrupt entry is no use to anyone.
+                file_name = None
+            if file_name and os.path.exists(file_name):
+                entries.append((os.path.getmtime(entry_name), entry_name))
+            else:
+                os.unlink(entry_name)
+
+        entries.sort(reverse=True)
+        for (_, entry_name) in entries[self._max_entries:]:
+            os.unlink(entry_name)
+
+    def _EntryName(self, file_name):
+        """The name of the cache entry for file_name."""
+        key = hashlib.sha1(os.path.abspath(file_name).encode('utf-8'))
+        return os.path.join(self._cache_dir, key.hexdigest() + self._suffix)
@@ -1,18 +1,231 @@
 import collections
 import datetime
+import fnmatch
+import functools
+import hashlib
+import itertools
 import os
+import threading
 import time
 
+try:
+    import concurrent.futures
+    _HAVE_PROCESS_POOL = True
+except ImportError:
+    # (Python 2 has no concurrent.futures; files just get parsed serially.)
+    _HAVE_PROCESS_POOL = False
+
+import libvtd.date_index
 import libvtd.node
+import libvtd.tree_cache
+
+
+def _ParseFile(file_name):
+    """Parse file_name into a libvtd.node.File (perhaps in a worker process).
+
+    Returns:
+        A tuple (vtd_file, seconds): the File, and how long it took to parse.
+    """
+    start = time.time()
+    vtd_file = libvtd.node.File(file_name)
+    return (vtd_file, time.time() - start)
+
+
+def _ParseChunk(file_names):
+    """Parse each of file_names with _ParseFile(), in a worker process."""
+    return [_ParseFile(f) for f in file_names]
+
+
+# An unchanged stat() only shows that a file's contents are unchanged if they
+# were read long enough after its mtime: otherwise, a later edit within the
+# same tick of a coarse filesystem clock could have left the mtime alone.  (A
+# generous bound; FAT has 2-second mtimes.)
+_MTIME_GRANULARITY_NS = 2 * 10 ** 9
+
+
+class _FileVersion(collections.namedtuple(
+        '_FileVersion', ['stat', 'content_hash', 'racy'])):
+    """The contents of a file, as of when the TrustedSystem last read it.
+
+    Attributes:
+        stat: The file's (size, mtime in ns, inode), from _Stat().
+        content_hash: A hash of the file's bytes.
+        racy: Whether the file was read so soon after its mtime that stat
+            can't be trusted to show a later change.
+    """
+    __slots__ = ()
+
+
+def _Stat(file_name):
+    """The (size, mtime in ns, inode) of file_name."""
+    stat = os.stat(file_name)
+    mtime_ns = getattr(stat, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        # (Python 2 only has float mtimes.)
+        mtime_ns = int(stat.st_mtime * 10 ** 9)
+    return (stat.st_size, mtime_ns, stat.st_ino)
+
+
+def _ContentHash(file_name):
+    """A hash of the bytes in file_name."""
+    with open(file_name, 'rb') as vtd_file:
+        return hashlib.sha1(vtd_file.read()).hexdigest()
+
+
+def _Done(node):
+    """Whether node is done (only DoableNodes ever are)."""
+    return getattr(node, 'done', False)
+
+
+class ParseReport(collections.namedtuple(
+        'ParseReport', ['file_name', 'seconds', 'bad_lines', 'cached'])):
+    """How parsing one file went, when adding it to a TrustedSystem.
+
+    Attributes:
+        file_name: The name of the file.
+        seconds: How long it took to parse (or to load from the cache).
+        bad_lines: How many lines couldn't be parsed (see
+            libvtd.node.File.bad_lines).
+        cached: Whether the file was loaded from the cache, not parsed.
+    """
+    __slots__ = ()
+
+
+class Snapshot(collections.namedtuple(
+        'Snapshot', ['next_actions', 'recurring_actions', 'inboxes', 'waiting',
+                     'contexts', 'projects_without_next_actions'])):
+    """Every GTD list of a TrustedSystem at one moment (see its Snapshot()).
+
+    Each list is exactly what the TrustedSystem method of the same name would
+    have returned.
+
+    Attributes:
+        next_actions: As from NextActions().
+        recurring_actions: As from RecurringActions().
+        inboxes: As from Inboxes().
+        waiting: As from Waiting().
+        contexts: As from ContextList().
+        projects_without_next_actions: As from ProjectsWithoutNextActions().
+    """
+    __slots__ = ()
+
+
+class _FileIndex(object):
+    """The indices on a single File of a _State.
+
+    They depend on nothing outside the File, except for which ids are open.
+    So a refresh only builds new _FileIndexes for the Files which changed, and
+    for those whose blockers' ids opened or closed; the new _State shares the
+    rest with the old one.
+
+    The DateStates move on as time passes, along with the counts of visible
+    actions: queries hold the _State's lock while they use them.
+
+    Attributes:
+        vtd_file: The libvtd.node.File.
+        blocker_ids: The ids which its DoableNodes' blockers refer to.
+        blocked_nodes: Its DoableNodes which are blocked.
+        waiting_on_blockers: Its not-done DoableNodes which have open
+            blockers.
+        open_actions: Its NextActions which aren't done (nor under a done
+            Node), in the order of the lists.
+        actions_with_context: For each context, the positions in
+            open_actions of the actions which have it (inherited or not).
+        projects_without_next_actions: Its Projects which need a next action,
+            in the same order.
+        stubs: The NeedsNextActionStub for each of those Projects.
+        countable_actions: The open actions which ContextList() counts (when
+            visible).
+        visible_masks: The number of visible countable actions with each
+            context mask, kept up to date by the date index.
+        date_index: The DateState of every open DoableNode, as time passes.
+    """
+    __slots__ = ('vtd_file', 'blocker_ids', 'blocked_nodes',
+                 'waiting_on_blockers', 'open_actions', 'actions_with_context',
+                 'projects_without_next_actions', 'stubs',
+                 'countable_actions', 'visible_masks', 'date_index')
+
+    def __init__(self, vtd_file):
+        """An unindexed _FileIndex (see TrustedSystem._IndexFile())."""
+        self.vtd_file = vtd_file
+
+
+class _State(object):
+    """The files in a TrustedSystem, together with the indices built on them.
+
+    Once a TrustedSystem starts using a _State, neither its files nor its
+    indices change: a refresh builds a new _State, and swaps it in whole.  So
+    a query which reads the _State once, at the start, sees every file and
+    index as of the same refresh, even if another thread refreshes meanwhile.
+
+    The exception is the DateStates, which move on as time passes (along with
+    the counts of visible actions); queries hold lock while they use them.
+    Since _States share _FileIndexes, they all share the same lock, too.
+
+    Attributes:
+        files: A dict mapping each file name to its libvtd.node.File.
+        file_indices: A dict mapping each file name to its _FileIndex, in the
+            same order.
+        nodes_with_id: Every id in every file, mapped to the list of Nodes
+            which have it (one per file, ordered by file name).
+        open_ids: The ids of those Nodes which aren't done.
+        blocker_cycles: The cycles of Nodes which block each other.
+        projects_without_next_actions: The Projects which need a next action,
+            in every file, in the order of the lists.
+        lock: Guards the date indices and the counts of visible actions, in
+            every _FileIndex.
+    """
+    __slots__ = ('files', 'file_indices', 'nodes_with_id', 'open_ids',
+                 'blocker_cycles', 'projects_without_next_actions', 'lock')
+
+    def __init__(self, files, lock):
+        """An unindexed _State for files (see TrustedSystem._NewState())."""
+        self.files = files
+        self.lock = lock
 
 
 class TrustedSystem:
     """A system to keep track of all projects and actions."""
 
-    def __init__(self):
-        self._files = {}
-        self._contexts_to_include = []
-        self._contexts_to_exclude = []
+    # Parsing in a process pool only pays for itself when there are enough
+    # files to parse: otherwise, starting the pool and pickling the parsed
+    # trees dominates.  Smaller batches get parsed serially.
+    _min_parallel_batch = 8
+
+    def __init__(self, workers=1, cache_dir=None):
+        """Create an empty system.
+
+        Queries may run on any number of threads at once, while another
+        thread refreshes the system (or adds files): see _State.  Only one
+        thread at a time gets to refresh; the others wait their turn.
+
+        Args:
+            workers: The number of processes which may parse files in
+                parallel.  The default, 1, parses everything in this process.
+            cache_dir: A directory in which to keep parsed files between
+                sessions (see libvtd.tree_cache.TreeCache), so unchanged files
+                needn't be parsed again.  The default, None, keeps no cache.
+        """
+        # The SetContexts() filter, as bitmasks (see _OkContexts()).  None
+        # means no 'include' filter at all.
+        self._include_mask = None
+        self._exclude_mask = 0
+        self._workers = workers
+        self._cache = (libvtd.tree_cache.TreeCache(cache_dir) if cache_dir
+                       else None)
+        # Held by whichever thread is refreshing; it guards everything below.
+        # (Queries only read self._state, which gets swapped in whole.)
+        self._refresh_lock = threading.RLock()
+        # Held by queries while they use the DateStates (see _State).
+        self._date_lock = threading.RLock()
+        # Files which were updated incrementally, but not yet written to the
+        # cache.
+        self._unsaved_files = set()
+        # The _FileVersion of each file, as last read.
+        self._file_versions = {}
+        # The files, and every index on them.  Replaced whole (never changed)
+        # by Refresh(), but only when some file changed.
+        self._state = self._NewState({})
 
     def AddFile(self, file_name):
         """Read and parse contents of file_name, adding to system.
@@ -23,48 +236,524 @@ class TrustedSystem:
         Args:
             file_name: The name of a file to read.
         """
-        self.Refresh()
-        self._files[file_name] = libvtd.node.File(file_name)
+        self.AddFiles([file_name])
+
+    def AddFiles(self, file_names, workers=None):
+        """Read and parse several files at once, adding them to the system.
+
+        Much cheaper than calling AddFile() for each: existing files only get
+        Refresh()ed once, and the new ones get parsed in a single batch.
+        Files which are already in the system don't get parsed again (unless
+        they changed).
+
+        Args:
+            file_names: The names of the files to read.
+            workers: The number of processes which may parse files in
+                parallel; defaults to the number given to the constructor.
+
+        Returns:
+            A list of ParseReports for the new files, ordered by file name.
+        """
+        with self._refresh_lock:
+            new_files = set(f for f in file_names
+                            if f not in self._state.files)
+            reports = self._Refresh(also_parse=sorted(new_files),
+                                    workers=workers)[1]
+        return [report for report in reports if report.file_name in new_files]
+
+    def AddDirectory(self, root, pattern, workers=None):
+        """Add every file under root whose name matches pattern, at once.
+
+        Args:
+            root: The directory to search, recursively.
+            pattern: A shell-style pattern (as for the fnmatch module), which
+                the names of files to add must match.  As with glob, files and
+                directories whose names begin with a '.' get skipped.
+            workers: As for AddFiles().
+
+        Returns:
+            A list of ParseReports for the new files, ordered by file name.
+        """
+        file_names = []
+        for (directory, subdirectories, names) in os.walk(root):
+            subdirectories[:] = [d for d in subdirectories
+                                 if not d.startswith('.')]
+            file_names.extend(os.path.join(directory, name) for name in names
+                              if not name.startswith('.') and
+                              fnmatch.fnmatch(name, pattern))
+        return self.AddFiles(file_names, workers=workers)
 
     def ClearFiles(self):
         """Clear the list of files (basically emptying the system).
 
-        Also Refresh()es the system, so stale tasks aren't hanging around.
         """
-        self._files.clear()
-        self.Refresh()
+        with self._refresh_lock:
+            self._unsaved_files.clear()
+            self._file_versions.clear()
+            self._state = self._NewState({})
+            self.last_refreshed = time.time()
+
+    def Refresh(self, force=False, also_parse=()):
+        """Reread any files whose contents changed since they were last read.
+
+        A file whose size, mtime, and inode haven't changed since then is
+        assumed unchanged (unless it was read within the same tick as its
+        mtime); otherwise, it only gets reread if a hash of its contents
+        changed.  So files which were merely touched don't get reparsed.
+
+        Where possible, only the changed parts of an updated file get
+        reparsed (see libvtd.node.File.Update).
+
+        Args:
+            force: Reread every file, whether or not it was updated.
+            also_parse: Names of files to parse and add to the system, along
+                with the updated ones.
+
+        Returns:
+            A sorted list of the names of the files which got (re)parsed.
+        """
+        return self._Refresh(force, also_parse)[0]
+
+    def _Refresh(self, force=False, also_parse=(), workers=None):
+        """Refresh(), also reporting on the files parsed from scratch.
+
+        Args:
+            force: As for Refresh().
+            also_parse: As for Refresh().
+            workers: As for AddFiles().
+
+        Returns:
+            A tuple (file_names, reports): the result of Refresh(), and a list
+            of ParseReports for the files parsed from scratch (or loaded from
+            the cache), ordered by file name.
+        """
+        with self._refresh_lock:
+            # The files' new versions only get recorded once they've been
+            # reread: if anything goes wrong first, the next refresh must
+            # still see them as changed.
+            new_versions = {}
+            if force:
+                stale_files = sorted(self._state.files.keys())
+                for file_name in stale_files:
+                    new_versions[file_name] = self._ReadVersion(file_name)
+            else:
+                stale_files = [f for f in sorted(self._state.files.keys())
+                               if self._Changed(f, new_versions)]
+            also_parse = list(also_parse)
+            for file_name in also_parse:
+                new_versions[file_name] = self._ReadVersion(file_name)
+            reports = self._Reread(stale_files, also_parse, workers)
+            self._file_versions.update(new_versions)
+            self.last_refreshed = time.time()
+        return (sorted(set(stale_files + also_parse)), reports)
+
+    def RefreshFiles(self, file_names):
+        """Reread just those of the given files whose contents changed.
+
+        This is for callers which know which files might have changed (such
+        as a libvtd.watcher.Watcher), so that no other file needs checking.
+        Unlike Refresh(), this always compares the hashes of their contents.
+
+        Args:
+            file_names: Names of files in the system; any others are ignored.
+
+        Returns:
+            A sorted list of the names of the files which got reparsed.
+        """
+        with self._refresh_lock:
+            new_versions = {}
+            stale_files = sorted(set(
+                f for f in file_names if f in self._state.files and
+                self._Changed(f, new_versions, trust_stat=False)))
+            self._Reread(stale_files)
+            self._file_versions.update(new_versions)
+        return stale_files
+
+    def FileNames(self):
+        """The names of all the files in the system, in sorted order."""
+        return sorted(self._state.files.keys())
+
+    def _ReadVersion(self, file_name):
+        """The current _FileVersion of file_name (which means reading it)."""
+        read_ns = int(time.time() * 10 ** 9)
+        stat = _Stat(file_name)
+        return _FileVersion(stat=stat, content_hash=_ContentHash(file_name),
+                            racy=read_ns - stat[1] < _MTIME_GRANULARITY_NS)
+
+    def _Changed(self, file_name, new_versions, trust_stat=True):
+        """Check whether file_name's contents changed since last read.
+
+        Args:
+            file_name: The name of a file in the system.
+            new_versions: A dict which gets file_name's current _FileVersion,
+                if it had to be read; the caller records it once the file has
+                been reread.
+            trust_stat: Whether an unchanged (and not racy) stat() is enough to
+                show the contents are unchanged.
+        """
+        old_version = self._file_versions.get(file_name)
+        if (trust_stat and old_version and not old_version.racy and
+                _Stat(file_name) == old_version.stat):
+            return False
+        version = self._ReadVersion(file_name)
+        new_versions[file_name] = version
+        return (not old_version or
+                version.content_hash != old_version.content_hash)
+
+    def _Reread(self, stale_files, also_parse=(), workers=None):
+        """Reread stale_files, parse also_parse, and swap in a new _State.
 
-    def Refresh(self, force=False):
-        """Reread any files updated since the last Refresh()."""
-        for file_name in self._files.keys():
-            if force or os.path.getmtime(file_name) > self.last_refreshed:
-                self._files[file_name] = libvtd.node.File(file_name)
-        now = datetime.datetime.now()
-        self.last_refreshed = time.time()
+        The Files which queries may be using stay as they are: stale files
+        which can be updated incrementally get updated copies (see
+        libvtd.node.File.Updated()).
+
+        Args:
+            stale_files: Names of files in the system to reread.
+            also_parse: Names of files to parse and add to the system.
+            workers: As for AddFiles().
+
+        Returns:
+            A list of ParseReports for the files which had to be parsed from
+            scratch, ordered by file name.
+        """
+        if not stale_files and not also_parse:
+            return []
+        files = dict(self._state.files)
+        reparse_files = []
+        for file_name in stale_files:
+            with open(file_name) as vtd_file:
+                updated_file = files[file_name].Updated(vtd_file)
+                if updated_file is not None:
+                    files[file_name] = updated_file
+                    self._unsaved_files.add(file_name)
+                else:
+                    reparse_files.append(file_name)
+        reports = self._ParseFiles(files, reparse_files + list(also_parse),
+                                   workers)
+        self._state = self._NewState(files, self._state)
+        return reports
 
-    def Collect(self, match_list, node, matcher,
-                pruner=lambda x: 'done' in x.__dict__ and x.done):
+    def _NewState(self, files, old_state=None):
+        """A _State for files, with every index built.
+
+        Only what the changed files touch gets indexed afresh: the new _State
+        shares the rest with old_state (see _FileIndex).
+
+        Args:
+            files: A dict mapping file names to libvtd.node.Files, which
+                mustn't change afterwards.
+            old_state: The _State which the new one replaces, if any.
+        """
+        state = _State(files, self._date_lock)
+        old_files = old_state.files if old_state else {}
+        old_indices = old_state.file_indices if old_state else {}
+        changed_files = (
+            [f for (name, f) in old_files.items()
+             if files.get(name) is not f] +
+            [f for (name, f) in files.items()
+             if old_files.get(name) is not f])
+        ids_changed = any(f.Ids() for f in changed_files)
+        if old_state and not ids_changed:
+            state.nodes_with_id = old_state.nodes_with_id
+            state.open_ids = old_state.open_ids
+        else:
+            self._IndexIds(state)
+        changed_ids = (state.open_ids ^ old_state.open_ids if old_state
+                       else set())
+
+        state.file_indices = {}
+        for (file_name, vtd_file) in files.items():
+            index = old_indices.get(file_name)
+            if (not index or index.vtd_file is not vtd_file or
+                    not index.blocker_ids.isdisjoint(changed_ids)):
+                index = self._IndexFile(state, vtd_file, index)
+            state.file_indices[file_name] = index
+        indices = list(state.file_indices.values())
+        state.projects_without_next_actions = list(
+            itertools.chain.from_iterable(
+                index.projects_without_next_actions for index in indices))
+
+        # A cycle must go through a Node waiting on blockers, and then through
+        # a Node with an id: so if none of those changed, nor did any id,
+        # neither did the cycles.
+        replaced_indices = [
+            index for (name, index) in old_indices.items()
+            if state.file_indices.get(name) is not index]
+        new_indices = [index for (name, index) in state.file_indices.items()
+                       if old_indices.get(name) is not index]
+        if old_state and not ids_changed and not any(
+                index.waiting_on_blockers
+                for index in replaced_indices + new_indices):
+            state.blocker_cycles = old_state.blocker_cycles
+        else:
+            state.blocker_cycles = self._FindCycles(
+                state, [node for index in indices
+                        for node in index.waiting_on_blockers])
+        return state
+
+    def _IndexFile(self, state, vtd_file, old_index=None):
+        """A _FileIndex for vtd_file, built afresh.
+
+        Args:
+            state: The _State it's for, whose open_ids are already indexed.
+            vtd_file: The libvtd.node.File to index.
+            old_index: The _FileIndex it replaces, if any.
+        """
+        index = _FileIndex(vtd_file)
+        self._FindBlockedNodes(state, index)
+        self._IndexOpenNodes(index, old_index.stubs if old_index else {})
+        self._IndexDates(index)
+        return index
+
+    def BlockerCycles(self):
+        """Groups of Nodes which can never be unblocked, since they (or their
+        ancestors) block each other.
+
+        The Nodes in a cycle stay blocked, so they never show up in any list;
+        this is the way to find them.
+
+        Returns:
+            A list of cycles, each a list of not-done DoableNodes, where each
+            Node waits for the next (and the last for the first): because it's
+            the Node's parent, predecessor, or blocker.
+        """
+        return [list(cycle) for cycle in self._state.blocker_cycles]
+
+    def DuplicateIds(self):
+        """The ids which belong to Nodes in more than one file.
+
+        (Duplicate ids within a single file show up in that File's bad_lines.)
+
+        Returns:
+            A dict mapping each such id to the list of Nodes which have it,
+            ordered by file name.
+        """
+        return dict((id, nodes)
+                    for (id, nodes) in self._state.nodes_with_id.items()
+                    if len(nodes) > 1)
+
+    def _IndexIds(self, state):
+        """Build state's system-wide index of ids, from every file."""
+        nodes_with_id = collections.defaultdict(list)
+        for file_name in sorted(state.files.keys()):
+            vtd_file = state.files[file_name]
+            for id in vtd_file.Ids():
+                nodes_with_id[id].append(vtd_file.NodeWithId(id))
+        state.nodes_with_id = dict(nodes_with_id)
+        state.open_ids = set(
+            id for (id, nodes) in state.nodes_with_id.items()
+            if any(not node.done for node in nodes))
+
+    def _IndexOpenNodes(self, index, old_stubs):
+        """Build a _FileIndex's lists of open actions and of Projects which
+        need one.
+
+        Also index the actions by context.
+
+        Args:
+            index: The _FileIndex to build, whose blocked_nodes are already
+                found.
+            old_stubs: The stubs of the _FileIndex it replaces: Projects which
+                still need a next action (at the same place in the same file)
+                keep the same stub.
+        """
+        index.open_actions = []
+        index.projects_without_next_actions = []
+        for x in libvtd.node.PostOrder([index.vtd_file], _Done):
+            if isinstance(x, libvtd.node.NextAction):
+                if not x.done:
+                    index.open_actions.append(x)
+            elif (isinstance(x, libvtd.node.Project) and
+                  x.needs_next_action):
+                index.projects_without_next_actions.append(x)
+        # The Projects of an updated file are copies (see
+        # libvtd.node.File.Updated()), so look each stub up by where it is.
+        stub_for_source = dict(((stub.parent.Source(), stub.parent.text), stub)
+                               for stub in old_stubs.values())
+        index.stubs = {}
+        for project in index.projects_without_next_actions:
+            stub = stub_for_source.get((project.Source(), project.text))
+            if not stub:
+                stub = libvtd.node.NeedsNextActionStub(project)
+            elif stub.parent is not project:
+                stub.parent = project
+            index.stubs[project] = stub
+
+        positions_with_mask = collections.defaultdict(list)
+        for (i, action) in enumerate(index.open_actions):
+            positions_with_mask[action.context_mask].append(i)
+        actions_with_context = collections.defaultdict(list)
+        for (mask, positions) in positions_with_mask.items():
+            for context in libvtd.node.context_registry.Contexts(mask):
+                actions_with_context[context].extend(positions)
+        for positions in actions_with_context.values():
+            positions.sort()
+        index.actions_with_context = dict(actions_with_context)
+        index.countable_actions = set(
+            x for x in index.open_actions
+            if not x.waiting and x not in index.blocked_nodes)
+
+    def _IndexDates(self, index):
+        """Build a _FileIndex's index of the DateStates of every open
+        DoableNode.
+        """
+        # Pre-order, so that recurring projects work out their dates before
+        # their children inherit them.
+        index.visible_masks = collections.Counter()
+        index.date_index = libvtd.date_index.DateIndex(
+            (node for node in libvtd.node.PreOrder([index.vtd_file], _Done)
+             if isinstance(node, libvtd.node.DoableNode) and not node.done),
+            on_change=functools.partial(self._DateStateChanged, index))
+
+    def _DateStateChanged(self, index, node, old, new):
+        """Keep count of the visible actions with each context mask."""
+        if node not in index.countable_actions:
+            return
+        invisible = libvtd.node.DateStates.invisible
+        if old is not None and old != invisible:
+            index.visible_masks[node.context_mask] -= 1
+        if new != invisible:
+            index.visible_masks[node.context_mask] += 1
+
+    def _CandidateActions(self, state):
+        """The open actions which could pass the contexts filter, in order.
+
+        With an 'include' filter, that's only the actions which have one of
+        its contexts.
+
+        Returns:
+            A list of (index, actions) pairs, one for each file: its
+            _FileIndex, and its candidate actions.
+        """
+        if self._include_mask is None:
+            return [(index, index.open_actions)
+                    for index in state.file_indices.values()]
+        contexts = list(libvtd.node.context_registry.Contexts(
+            self._include_mask))
+        candidates = []
+        for index in state.file_indices.values():
+            positions = set()
+            for context in contexts:
+                positions.update(index.actions_with_context.get(context, ()))
+            candidates.append(
+                (index, [index.open_actions[i] for i in sorted(positions)]))
+        return candidates
+
+    def SaveCache(self):
+        """Write any files which were updated incrementally to the cache.
+
+        Refresh() only caches the files it parses from scratch: writing out a
+        whole tree after each small, incremental update would cost far more
+        than the update itself.  Nor does it prune the cache, which means
+        reading every entry.  This does both; call it when there's time to
+        spare (say, on exit).
+        """
+        with self._refresh_lock:
+            if self._cache:
+                for file_name in self._unsaved_files:
+                    self._cache.Store(file_name, self._state.files[file_name])
+                self._cache.Prune()
+            self._unsaved_files.clear()
+
+    def _ParseFiles(self, files, file_names, workers=None):
+        """Parse the given files (unless they're cached) into files.
+
+        Args:
+            files: A dict mapping file names to libvtd.node.Files, which gets
+                the newly parsed files.
+            file_names: A list of names of files to parse.
+            workers: As for AddFiles().
+
+        Returns:
+            A list of ParseReports, ordered by file name.
+        """
+        reports = []
+        if self._cache:
+            for file_name in file_names:
+                start = time.time()
+                cached_file = self._cache.Load(file_name)
+                if cached_file:
+                    files[file_name] = cached_file
+                    reports.append(ParseReport(
+                        file_name=file_name, seconds=time.time() - start,
+                        bad_lines=len(cached_file.bad_lines), cached=True))
+        cached_files = set(report.file_name for report in reports)
+
+        parsed_files = self._ParseFilesFromScratch(
+            [f for f in file_names if f not in cached_files], workers)
+        for (file_name, (vtd_file, seconds)) in parsed_files.items():
+            files[file_name] = vtd_file
+            reports.append(ParseReport(
+                file_name=file_name, seconds=seconds,
+                bad_lines=len(vtd_file.bad_lines), cached=False))
+        if self._cache:
+            for (file_name, (vtd_file, _)) in parsed_files.items():
+                self._cache.Store(file_name, vtd_file)
+        self._unsaved_files.difference_update(file_names)
+        return sorted(reports)
+
+    def _ParseFilesFromScratch(self, file_names, workers=None):
+        """Parse the given files, in parallel if so configured.
+
+        Args:
+            file_names: A list of names of files to parse.
+            workers: As for AddFiles().
+
+        Returns:
+            A dict mapping each file name to a tuple (vtd_file, seconds): its
+            libvtd.node.File, and how long that took to parse.
+        """
+        if workers is None:
+            workers = self._workers
+        workers = min(workers, len(file_names))
+        if (workers < 2 or not _HAVE_PROCESS_POOL or
+                len(file_names) < self._min_parallel_batch):
+            return dict((f, _ParseFile(f)) for f in file_names)
+
+        # Each worker sends back the whole tree of its File, pickled; that
+        # includes the id map and the bad lines.
+        chunksize = max(1, len(file_names) // (4 * workers))
+        chunks = [file_names[i:i + chunksize]
+                  for i in range(0, len(file_names), chunksize)]
+        parsed = {}
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            futures = [(chunk, pool.submit(_ParseChunk, chunk))
+                       for chunk in chunks]
+            for (chunk, future) in futures:
+                try:
+                    parsed.update(zip(chunk, future.result()))
+                except Exception:
+                    # Some trees can't make it back: a deep one makes pickle
+                    # raise RecursionError.  Parse the chunk here instead;
+                    # any error that's really about a file gets raised again.
+                    parsed.update((f, _ParseFile(f)) for f in chunk)
+        return parsed
+
+    def Collect(self, match_list, node, matcher, pruner=_Done):
         """Gather Nodes from node and its children which fulfil some criteria
         into match_list.
 
+        Nodes get added after their children (see libvtd.node.PostOrder()).
+
         Args:
-            match_list: A list which is passed around the call stack and
-                extended as we find more elements.
+            match_list: A list which gets extended as we find more elements.
             node: A Node object (presumably from within a tree in the
                 TrustedSystem).
             matcher: A function which decides whether node should be added to
                 the collection.
             pruner: A function which decides whether node's children should be
-                explored; defaults to no pruning.
+                skipped; defaults to skipping the children of done Nodes.
+        """
+        match_list.extend(n for n in libvtd.node.PostOrder([node], pruner)
+                          if matcher(n))
+
+    def _Walk(self, state):
+        """Every Node to consider for the lists, in the order Collect() uses.
+
+        That's every Node in every file of state, except the ones under done
+        Nodes.
         """
-        if not pruner(node):
-            for child in node.children:
-                self.Collect(match_list=match_list,
-                             node=child,
-                             matcher=matcher,
-                             pruner=pruner)
-        if matcher(node):
-            match_list.append(node)
+        return libvtd.node.PostOrder(state.files.values(), _Done)
 
     def ContextList(self, now=None):
         """All contexts with visible NextActions, together with a count.
@@ -73,43 +762,52 @@ class TrustedSystem:
             A list of (context, count) pairs, ordered first by the count
             (descending) and second by the context (alphabetical).
         """
-        contexts = collections.Counter()
-
         if not now:
             now = datetime.datetime.now()
+        return self._ContextList(self._state, now)
 
-        def Matcher(node):
-            if self._VisibleAction(node, now) and not node.waiting:
-                contexts.update(node.contexts)
-            return False
-
-        match_list = []
-        for file in self._files.values():
-            self.Collect(match_list=match_list, node=file, matcher=Matcher)
-
-        return contexts.most_common()
+    def _ContextList(self, state, now):
+        """ContextList(), for the files and indices in state."""
+        # The count of visible actions with each context mask gets updated as
+        # their DateStates change.
+        masks = collections.Counter()
+        with state.lock:
+            for index in state.file_indices.values():
+                index.date_index.MoveTo(now)
+                masks.update(index.visible_masks)
+        # Nodes share just a few distinct sets of contexts: count those, and
+        # only then count the contexts in each.
+        contexts = collections.Counter()
+        for (mask, count) in masks.items():
+            if not count:
+                continue
+            for context in libvtd.node.context_registry.Contexts(mask):
+                contexts[context] += count
+        return sorted(contexts.items(), key=lambda x: (-x[1], x[0]))
 
-    def _VisibleNextAction(self, node, now):
+    def _VisibleNextAction(self, index, node, now):
         """Check whether node is a NextAction which is currently visible.
 
         (Does not check contexts.)
 
         Args:
+            index: The _FileIndex of node's file.
             node: The object to check.
 
         Returns:
             Boolean indicating whether this is a currently-visible (i.e., apart
             from contexts) NextAction.
         """
-        return self._VisibleAction(node, now) and not (node.recurring or
-                                                       node.waiting)
+        return self._VisibleAction(index, node, now) and not (node.recurring or
+                                                              node.waiting)
 
-    def _VisibleAction(self, node, now):
+    def _VisibleAction(self, index, node, now):
         """Check: node is a currently visible Next or Recurring Action.
 
         (Does not check contexts.)
 
         Args:
+            index: The _FileIndex of node's file.
             node: The object to check.
 
         Returns:
@@ -118,137 +816,247 @@ class TrustedSystem:
         """
         return (isinstance(node, libvtd.node.NextAction)
                 and not node.done
-                and node.DateState(now) != libvtd.node.DateStates.invisible
-                and not self._Blocked(node))
+                and (index.date_index.DateState(node, now) !=
+                     libvtd.node.DateStates.invisible)
+                and not self._Blocked(index, node))
 
-    def _VisibleRecurringAction(self, node, now):
+    def _VisibleRecurringAction(self, index, node, now):
         """Check whether node is a Recurring Action which is currently visible.
 
         (Does not check contexts.)
 
         Args:
+            index: The _FileIndex of node's file.
             node: The object to check.
 
         Returns:
             Boolean indicating whether this is a currently-visible (i.e., apart
             from contexts) NextAction.
         """
-        return self._VisibleAction(node, now) and (node.recurring and not
-                                                   node.inbox)
+        return self._VisibleAction(index, node, now) and (node.recurring and
+                                                          not node.inbox)
 
     def NextActions(self, now=None):
         """A list of next actions currently visible in the given contexts."""
         if not now:
             now = datetime.datetime.now()
-        next_actions = []
-        for file in self._files.values():
-            self.Collect(match_list=next_actions, node=file, matcher=lambda x:
-                         self._VisibleNextAction(x, now)
-                         and self._OkContexts(x))
+        state = self._state
+        with state.lock:
+            next_actions = [x for (index, candidates)
+                            in self._CandidateActions(state)
+                            for x in candidates
+                            if self._VisibleNextAction(index, x, now)
+                            and self._OkContexts(x)]
+            return next_actions + self._StubsForMissingActions(state, now)
+
+    def Snapshot(self, now=None):
+        """All the GTD lists at once, from a single pass over the actions.
 
-        return next_actions + self._StubsForMissingActions(now)
+        Much cheaper than calling NextActions(), RecurringActions(), etc., one
+        after the other: each action's date state and blocked state only get
+        checked once.
 
-    def _StubsForMissingActions(self, now=None):
+        Returns:
+            A Snapshot.
+        """
+        if not now:
+            now = datetime.datetime.now()
+        state = self._state
+        with state.lock:
+            snapshot = Snapshot(
+                next_actions=[], recurring_actions=[], inboxes=[], waiting=[],
+                contexts=self._ContextList(state, now),
+                projects_without_next_actions=list(
+                    state.projects_without_next_actions))
+
+            # Waiting ignores the contexts filter, so every open action
+            # counts.
+            for index in state.file_indices.values():
+                for node in index.open_actions:
+                    if not self._VisibleAction(index, node, now):
+                        continue
+                    if node.waiting:
+                        snapshot.waiting.append(node)
+                    if not self._OkContexts(node):
+                        continue
+                    if node.inbox:
+                        snapshot.inboxes.append(node)
+                    if node.recurring:
+                        if not node.inbox:
+                            snapshot.recurring_actions.append(node)
+                    elif not node.waiting:
+                        snapshot.next_actions.append(node)
+
+            snapshot.next_actions.extend(
+                self._StubsForMissingActions(state, now))
+        return snapshot
+
+    def _StubsForMissingActions(self, state, now):
+        """Stubs for the visible projects which lack next actions.
+
+        Each Project keeps the same stub from one call to the next (until a
+        Refresh() finds it no longer needs one).
+
+        Args:
+            state: The _State to look in (whose lock the caller holds).
+            now: The current time.
+        """
         stubs = []
-        for project in self.ProjectsWithoutNextActions():
-            vis = (project.DateState(now) != libvtd.node.DateStates.invisible
-                   and not self._Blocked(project))
-            if vis and self._OkContexts(project):
-                stubs.append(libvtd.node.NeedsNextActionStub(project))
+        for index in state.file_indices.values():
+            for project in index.projects_without_next_actions:
+                vis = ((index.date_index.DateState(project, now) !=
+                        libvtd.node.DateStates.invisible)
+                       and not self._Blocked(index, project))
+                if vis and self._OkContexts(project):
+                    stubs.append(index.stubs[project])
         return stubs
 
-
     def RecurringActions(self, now=None):
         """A list of recurring actions visible given the current contexts."""
         if not now:
             now = datetime.datetime.now()
-        recurs = []
-        for file in self._files.values():
-            self.Collect(match_list=recurs, node=file, matcher=lambda x:
-                         self._VisibleRecurringAction(x, now)
-                         and self._OkContexts(x))
-        return recurs
+        state = self._state
+        with state.lock:
+            return [x for (index, candidates) in self._CandidateActions(state)
+                    for x in candidates
+                    if self._VisibleRecurringAction(index, x, now)
+                    and self._OkContexts(x)]
 
     def NextActionsWithoutContexts(self):
         """A list of NextActions which don't have a context."""
-        next_actions = []
-        for file in self._files.values():
-            self.Collect(match_list=next_actions,
-                         node=file,
-                         matcher=lambda x:
-                             isinstance(x, libvtd.node.NextAction)
-                             and not x.contexts)
-        return next_actions
+        return [x for x in self._Walk(self._state)
+                if isinstance(x, libvtd.node.NextAction) and not x.contexts]
 
     def Inboxes(self, now=None):
         """List of inboxes to empty."""
         if not now:
             now = datetime.datetime.now()
-        inboxes = []
-        for file in self._files.values():
-            self.Collect(match_list=inboxes, node=file, matcher=lambda x:
-                         self._VisibleAction(x, now)
-                         and x.inbox and self._OkContexts(x))
-        return inboxes
+        state = self._state
+        with state.lock:
+            return [x for (index, candidates) in self._CandidateActions(state)
+                    for x in candidates
+                    if self._VisibleAction(index, x, now)
+                    and x.inbox and self._OkContexts(x)]
 
     def AllActions(self, now=None):
         """All "doable" actions: NextActions, RecurringActions, and Inboxes."""
         if not now:
             now = datetime.datetime.now()
-        all_actions = []
-        for file in self._files.values():
-            self.Collect(match_list=all_actions,
-                         node=file,
-                         matcher=lambda x: (self._VisibleAction(x, now)
-                                            and self._OkContexts(x)
-                                            and not x.waiting))
-        return all_actions + self._StubsForMissingActions(now)
+        state = self._state
+        with state.lock:
+            all_actions = [x for (index, candidates)
+                           in self._CandidateActions(state)
+                           for x in candidates
+                           if self._VisibleAction(index, x, now)
+                           and self._OkContexts(x)
+                           and not x.waiting]
+            return all_actions + self._StubsForMissingActions(state, now)
 
     def Waiting(self, now=None):
         """The GTD 'Waiting For' list."""
         if not now:
             now = datetime.datetime.now()
-        waiting = []
-        for file in self._files.values():
-            self.Collect(match_list=waiting, node=file, matcher=lambda x:
-                         self._VisibleAction(x, now) and x.waiting)
-        return waiting
+        state = self._state
+        with state.lock:
+            return [x for index in state.file_indices.values()
+                    for x in index.open_actions
+                    if self._VisibleAction(index, x, now) and x.waiting]
 
-    def _Blocked(self, node):
-        """Checks whether the node is blocked.
+    def _Blocked(self, index, node):
+        """Checks whether the node is blocked, according to the _FileIndex of
+        its file.
 
         Note that a node is also blocked if any ancestor is.
         """
-        # Base case for recursion.
-        if not node:
-            return False
+        return node in index.blocked_nodes
 
-        try:
-            for b in node.blockers:
-                if self._BlockerExists(id=b):
-                    return True
-        except AttributeError:
-            # This Node does not have the concept of blockers; hence, it's not
-            # blocked.
-            return False
+    def _FindBlockedNodes(self, state, index):
+        """Work out which Nodes of a _FileIndex's File are blocked, once and
+        for all (per change to the File, or to the ids it's blocked on).
+
+        A DoableNode is blocked if its predecessor or one of its blockers
+        isn't done yet, or if its parent is a blocked DoableNode.  (Nodes of
+        other types are never blocked, and don't pass it on.)  Since parents
+        come first in a pre-order walk, each Node's blocked state gets
+        worked out right after its parent's.
+
+        Args:
+            state: The _State whose open_ids the blockers refer to.
+            index: The _FileIndex to build.
+        """
+        index.blocker_ids = set()
+        index.blocked_nodes = set()
+        index.waiting_on_blockers = []
+        stack = [(index.vtd_file, False)]
+        while stack:
+            (node, parent_blocked) = stack.pop()
+            blocked = False
+            if isinstance(node, libvtd.node.DoableNode):
+                index.blocker_ids.update(node.blockers)
+                open_blockers = [b for b in node.blockers
+                                 if b in state.open_ids]
+                if open_blockers and not node.done:
+                    index.waiting_on_blockers.append(node)
+                blocked = (parent_blocked or bool(open_blockers) or
+                           bool(node.predecessor and
+                                not node.predecessor.done))
+                if blocked:
+                    index.blocked_nodes.add(node)
+            stack.extend((child, blocked) for child in node.children)
 
-        return self._Blocked(node.parent)
+    def _FindCycles(self, state, starts):
+        """Cycles in the graph of what each not-done DoableNode waits for.
 
-    def _BlockerExists(self, id):
-        """Checks whether a Node with the given id exists."""
+        Args:
+            state: The _State whose ids the blockers refer to.
+            starts: The DoableNodes to search from.
 
-        def Matcher(node):
-            try:
-                return id in node.ids and not node.done
-            except AttributeError:
-                return False
+        Returns:
+            A list of cycles (each a list of Nodes), one for each time the
+            depth-first search comes back around to a Node on its path.
+        """
+        cycles = []
+        on_path = set()
+        finished = set()
+        for start in starts:
+            if start in finished:
+                continue
+            path = [start]
+            dependencies = [self._OpenDependencies(state, start)]
+            on_path.add(start)
+            while path:
+                try:
+                    dependency = next(dependencies[-1])
+                except StopIteration:
+                    node = path.pop()
+                    dependencies.pop()
+                    on_path.discard(node)
+                    finished.add(node)
+                    continue
+                if dependency in on_path:
+                    cycles.append(path[path.index(dependency):])
+                elif dependency not in finished:
+                    path.append(dependency)
+                    dependencies.append(
+                        self._OpenDependencies(state, dependency))
+                    on_path.add(dependency)
+        return cycles
 
-        for file in self._files.values():
-            node = file.NodeWithId(id)
-            if node and not node.done:
-                return True
+    def _OpenDependencies(self, state, node):
+        """The not-done DoableNodes which node waits for.
 
-        return False
+        Those are its parent, its predecessor, and the Nodes with the ids of
+        its blockers.
+        """
+        parent = node.parent
+        if isinstance(parent, libvtd.node.DoableNode) and not parent.done:
+            yield parent
+        if node.predecessor and not node.predecessor.done:
+            yield node.predecessor
+        for id in node.blockers:
+            for other in state.nodes_with_id.get(id, ()):
+                if not other.done:
+                    yield other
 
     def _OkContexts(self, node):
         """Checks whether node passes the contexts filter.
@@ -260,13 +1068,10 @@ class TrustedSystem:
             True if node shows up on at least one current 'include' context,
             and none of the 'exclude' contexts; otherwise False.
         """
-        node_included = False
-        for node_context in node.contexts:
-            if any([c == node_context for c in self._contexts_to_exclude]):
-                return False
-            if any([c == node_context for c in self._contexts_to_include]):
-                node_included = True
-        return node_included or not self._contexts_to_include
+        mask = node.context_mask
+        if mask & self._exclude_mask:
+            return False
+        return self._include_mask is None or bool(mask & self._include_mask)
 
     def SetContexts(self, include=None, exclude=None):
         """Set the active contexts for this object.
@@ -277,23 +1082,10 @@ class TrustedSystem:
             exclude: A list of contexts to exclude: no NextAction having any of
                 these contexts can appear in NextActions().
         """
-        self._contexts_to_include = include if include else []
-        self._contexts_to_exclude = exclude if exclude else []
+        registry = libvtd.node.context_registry
+        self._include_mask = registry.Mask(include) if include else None
+        self._exclude_mask = registry.Mask(exclude) if exclude else 0
 
     def ProjectsWithoutNextActions(self):
         """The list of libvtd.node.Project items which lack Next Actions."""
-        def Matcher(x):
-            """Specialized matcher for projects without next actions."""
-            if not isinstance(x, libvtd.node.Project) or x.done:
-                return False
-            for child in x.children:
-                if ((isinstance(child, libvtd.node.NextAction)
-                        or isinstance(child, libvtd.node.Project))
-                        and not child.done):
-                    return False
-            return True
-
-        projects = []
-        for file in self._files.values():
-            self.Collect(match_list=projects, node=file, matcher=Matcher)
-        return projects
+        return list(self._state.projects_without_next_actions)
@@ -0,0 +1,375 @@
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+# The inotify(7) constants which the watcher uses.
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = 0o2000000
+
+# Editors save by writing in place, or by writing a new file and renaming it
+# over the old one; watching each directory catches both.
+_DIRECTORY_EVENTS = (_IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE |
+                     _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE |
+                     _IN_DELETE_SELF | _IN_MOVE_SELF | _IN_ONLYDIR)
+# Events about the watched directory itself, rather than a file inside it.
+_SELF_EVENTS = _IN_DELETE_SELF | _IN_MOVE_SELF | _IN_IGNORED
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+_FsDecode = getattr(os, 'fsdecode', lambda name: name)
+_FsEncode = getattr(os, 'fsencode', lambda name: name)
+
+_logger = logging.getLogger(__name__)
+
+
+def _LoadInotify():
+    """The C library, if it has inotify; otherwise None."""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+        for function in (libc.inotify_init1, libc.inotify_add_watch,
+                         libc.inotify_rm_watch):
+            function.restype = ctypes.c_int
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+class _InotifyChanges(object):
+    """Notices changes to files via Linux's inotify, by watching their
+    directories.
+    """
+
+    def __init__(self, libc):
+        """Start an inotify instance.
+
+        Raises:
+            OSError: if inotify isn't available after all.
+        """
+        self._libc = libc
+        self._fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        # Writing to this pipe wakes up Wait().
+        (self._wake_read, self._wake_write) = os.pipe()
+        # Watched directories, by watch descriptor and by name.
+        self._directories = {}
+        self._watches = {}
+        # Directories which went away while watched: whatever is there if
+        # they come back is new.
+        self._lost_directories = set()
+
+    def Wait(self, file_names, timeout):
+        """Wait for some of file_names to change, or for timeout to pass.
+
+        Args:
+            file_names: A dict mapping the absolute path of each file to watch
+                to the name it has in the TrustedSystem.
+            timeout: The longest time to wait, in seconds; by the time the
+                directories are watched, it may already have passed (or even
+                be negative).
+
+        Returns:
+            A set of the file names (from file_names' values) which changed.
+        """
+        found_directories = self._WatchDirectories(file_names)
+        if found_directories:
+            return set(file_name for (path, file_name) in file_names.items()
+                       if os.path.dirname(path) in found_directories)
+        (ready, _, _) = select.select([self._fd, self._wake_read], [], [],
+                                      max(0, timeout))
+        if self._wake_read in ready:
+            os.read(self._wake_read, 4096)
+        if self._fd not in ready:
+            return set()
+
+        changed_paths = set()
+        changed_directories = set()
+        for (wd, mask, name) in self._ReadEvents():
+            if mask & _IN_Q_OVERFLOW:
+                # Some events got lost: anything might have changed.
+                return set(file_names.values())
+            directory = self._directories.get(wd)
+            if directory is None:
+                continue
+            if mask & _SELF_EVENTS:
+                # The directory has gone (or moved) along with its files; stop
+                # watching it, so that it gets watched again if it comes back.
+                changed_directories.add(directory)
+                self._lost_directories.add(directory)
+                self._Unwatch(directory, already_gone=bool(mask & _IN_IGNORED))
+            elif name:
+                changed_paths.add(os.path.join(directory, name))
+        return set(file_name for (path, file_name) in file_names.items()
+                   if path in changed_paths or
+                   os.path.dirname(path) in changed_directories)
+
+    def Wake(self):
+        """Make Wait() return right away."""
+        os.write(self._wake_write, b'x')
+
+    def Close(self):
+        os.close(self._fd)
+        os.close(self._wake_read)
+        os.close(self._wake_write)
+
+    def _WatchDirectories(self, file_names):
+        """Watch the directories of file_names, and no others.
+
+        Returns:
+            The set of directories which went away earlier, but are back now.
+        """
+        directories = set(os.path.dirname(path) for path in file_names)
+        self._lost_directories &= directories
+        for directory in set(self._watches) - directories:
+            self._Unwatch(directory)
+        found_directories = set()
+        for directory in directories - set(self._watches):
+            wd = self._libc.inotify_add_watch(self._fd, _FsEncode(directory),
+                                              _DIRECTORY_EVENTS)
+            # A directory which doesn't exist (yet) gets tried again next
+            # time.
+            if wd >= 0:
+                self._watches[directory] = wd
+                self._directories[wd] = directory
+                if directory in self._lost_directories:
+                    self._lost_directories.discard(directory)
+                    found_directories.add(directory)
+        return found_directories
+
+    def _Unwatch(self, directory, already_gone=False):
+        wd = self._watches.pop(directory, None)
+        if wd is None:
+            return
+        del self._directories[wd]
+        if not already_gone:
+            self._libc.inotify_rm_watch(self._fd, wd)
+
+    def _ReadEvents(self):
+        """All the pending events, as (watch descriptor, mask, name) tuples.
+        """
+        events = []
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return events
+                raise
+            offset = 0
+            while offset < len(data):
+                (wd, mask, _, length) = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                events.append((wd, mask, _FsDecode(name)))
+
+
+class _PollingChanges(object):
+    """Notices changes to files by checking their stat() results, now and
+    then.
+    """
+
+    def __init__(self, interval):
+        """Check for changes every interval seconds."""
+        self._interval = interval
+        self._wake = threading.Event()
+        self._stats = {}
+
+    def Wait(self, file_names, timeout):
+        """Like _InotifyChanges.Wait(), but only checks once per interval."""
+        self._wake.wait(max(0, min(timeout, self._interval)))
+        self._wake.clear()
+        changed = set()
+        stats = {}
+        for (path, file_name) in file_names.items():
+            stats[path] = self._Stat(path)
+            if path in self._stats and stats[path] != self._stats[path]:
+                changed.add(file_name)
+        self._stats = stats
+        return changed
+
+    def Wake(self):
+        self._wake.set()
+
+    def Close(self):
+        pass
+
+    def _Stat(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (getattr(stat, 'st_mtime_ns', stat.st_mtime), stat.st_size,
+                stat.st_ino)
+
+
+class Watcher(object):
+    """Keeps a TrustedSystem up to date in the background, as files change.
+
+    A background thread watches the system's files, and their directories,
+    for writes and renames: using inotify on Linux, and polling elsewhere.
+    After a burst of changes (an editor's save often takes several) dies
+    down, it rereads just the files which changed, using
+    TrustedSystem.RefreshFiles().  So queries don't need to Refresh() first;
+    and, since the system swaps in the reread files all at once, queries on
+    other threads can carry on meanwhile.
+    """
+
+    def __init__(self, trusted_system, debounce=0.1, poll_interval=1.0,
+                 use_inotify=True):
+        """Prepare to watch the files of trusted_system (see Start()).
+
+        Args:
+            trusted_system: A libvtd.trusted_system.TrustedSystem.  Files
+                added to it later get watched too.
+            debounce: How long (in seconds) to wait for changes to stop,
+                before rereading the changed files.
+            poll_interval: How often (in seconds) to check for changes, when
+                polling.  With inotify, this is how often to check for files
+                added to trusted_system.
+            use_inotify: Whether to use inotify where it's available; if
+                False, always poll.
+        """
+        self._trusted_system = trusted_system
+        self._debounce = debounce
+        self._poll_interval = poll_interval
+        libc = _LoadInotify() if use_inotify else None
+        self._changes = None
+        if libc:
+            try:
+                self._changes = _InotifyChanges(libc)
+            except OSError:
+                pass
+        if not self._changes:
+            self._changes = _PollingChanges(poll_interval)
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def uses_inotify(self):
+        return isinstance(self._changes, _InotifyChanges)
+
+    def Start(self):
+        """Start watching, in a daemon thread."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._Run,
+                                        name='libvtd.watcher.Watcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def Stop(self):
+        """Stop watching, and wait for the thread to finish."""
+        self._stop.set()
+        self._changes.Wake()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def Close(self):
+        """Stop watching for good, releasing the inotify instance (if any)."""
+        self.Stop()
+        self._changes.Close()
+
+    def __enter__(self):
+        self.Start()
+        return self
+
+    def __exit__(self, *unused_exc_info):
+        self.Close()
+
+    def _FileNames(self):
+        """The system's files, keyed by absolute path (for Wait())."""
+        return dict((os.path.abspath(f), f)
+                    for f in self._trusted_system.FileNames())
+
+    def _Run(self):
+        # Files which changed, but haven't been reread yet; and those of them
+        # which couldn't be reread last time.
+        changed = set()
+        failed = set()
+        while not self._stop.is_set():
+            # Nothing must stop the thread for good: else later changes would
+            # silently never get reread.
+            try:
+                changed |= self._changes.Wait(self._FileNames(),
+                                              self._poll_interval)
+                if not changed:
+                    continue
+                self._Debounce(changed)
+                # A file which is missing may be halfway through being
+                # replaced; its next change will bring it back.
+                failed = self._Reread(
+                    sorted(f for f in changed if os.path.exists(f)), failed)
+                changed = set(failed)
+            except Exception:
+                _logger.exception('Failed to watch for changes; will retry')
+                self._stop.wait(self._poll_interval)
+
+    def _Debounce(self, changed):
+        """Wait for a burst of changes to die down: that is, until there are
+        no more for self._debounce seconds.
+
+        Args:
+            changed: A set of the files changed so far, which gets the files
+                changed meanwhile.
+        """
+        quiet_time = time.time() + self._debounce
+        while not self._stop.is_set():
+            timeout = quiet_time - time.time()
+            if timeout <= 0:
+                return
+            more = self._changes.Wait(self._FileNames(), timeout)
+            if more:
+                changed |= more
+                quiet_time = time.time() + self._debounce
+
+    def _Reread(self, file_names, pending):
+        """Reread file_names, as far as possible.
+
+        Args:
+            file_names: The names of the files to reread.
+            pending: The files which couldn't be reread last time; their
+                errors have already been logged.
+
+        Returns:
+            The set of files which couldn't be reread, to try again later.
+        """
+        try:
+            self._trusted_system.RefreshFiles(file_names)
+            return set()
+        except Exception:
+            pass
+        # Reread the files one at a time, so that one which can't be read
+        # (say, because it vanished after all) doesn't hold up the others.
+        failed = set()
+        for file_name in file_names:
+            try:
+                self._trusted_system.RefreshFiles([file_name])
+            except Exception:
+                if file_name not in pending:
+                    _logger.exception('Failed to reread %s; will retry',
+                                      file_name)
+                failed.add(file_name)
+        return failed
@@ -50,3 +50,23 @@ def DueDate(date_string):
     node = libvtd.node.NextAction()
     node.AbsorbText('<{}'.format(date_string))
     return node.due_date
+
+
+def NodeState(node):
+    """A dict of every attribute which has been set on node.
+
+    Nodes have __slots__ instead of a __dict__, so this gathers the slots of
+    every class node inherits from.
+
+    Args:
+        node: A libvtd.node.Node object.
+
+    Returns:
+        A dict mapping each attribute name to its value.
+    """
+    state = {}
+    for cls in type(node).__mro__:
+        for name in cls.__dict__.get('__slots__', ()):
+            if hasattr(node, name):
+                state[name] = getattr(node, name)
+    return state
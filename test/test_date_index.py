@@ -0,0 +1,70 @@
+import datetime
+import unittest
+
+import libvtd.date_index
+import libvtd.node
+
+
+class TestDateIndex(unittest.TestCase):
+    """Test the index of DateStates over time."""
+
+    def setUp(self):
+        vtd_file = libvtd.node.File.FromLines([
+            '@ No dates at all',
+            '@ Visible later >2013-08-20',
+            '@ Due soon <2013-08-27',
+            '- Recurring project EVERY week [Sun] (LASTDONE 2013-08-18 10:00)',
+            '  @ Recurring step (LASTDONE 2013-08-19 10:00)',
+            '@ Never done EVERY day',
+        ])
+        self.nodes = [node for node in libvtd.node.PreOrder([vtd_file])
+                      if isinstance(node, libvtd.node.DoableNode)]
+        self.index = libvtd.date_index.DateIndex(self.nodes)
+
+    def assertMatchesDateState(self, now):
+        self.assertEqual(
+            [node.DateState(now) for node in self.nodes],
+            [self.index.DateState(node, now) for node in self.nodes])
+
+    def testDateBoundaries(self):
+        (no_dates, visible_later, due_soon) = self.nodes[:3]
+        self.assertEqual([], no_dates.DateBoundaries())
+        self.assertEqual([datetime.datetime(2013, 8, 20)],
+                         visible_later.DateBoundaries())
+        self.assertEqual(2, len(due_soon.DateBoundaries()))
+        self.assertEqual([], self.nodes[-1].DateBoundaries())
+
+    def testStatesMatchAtEveryBoundary(self):
+        """The index agrees with DateState(), moving forwards and back."""
+        boundaries = sorted(set(boundary for node in self.nodes
+                                for boundary in node.DateBoundaries()))
+        self.assertTrue(boundaries)
+        tick = datetime.timedelta(microseconds=1)
+        times = [time + offset for time in boundaries
+                 for offset in (-tick, 0 * tick, tick)]
+        for now in times + list(reversed(times)) + times[::7]:
+            self.assertMatchesDateState(now)
+
+    def testOnlyChecksNodesWithBoundariesInBetween(self):
+        start = datetime.datetime(2013, 8, 19, 12)
+        self.assertMatchesDateState(start)
+
+        checked = []
+        date_state = libvtd.node.DoableNode.DateState
+
+        def CountingDateState(node, now):
+            checked.append(node)
+            return date_state(node, now)
+        libvtd.node.DoableNode.DateState = CountingDateState
+        try:
+            self.index.DateState(self.nodes[0], start)
+            self.assertEqual([], checked)
+            self.index.DateState(self.nodes[0],
+                                 datetime.datetime(2013, 8, 21))
+        finally:
+            libvtd.node.DoableNode.DateState = date_state
+        self.assertEqual([self.nodes[1]], checked)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,9 @@
 import copy
 import datetime
+import dateutil.relativedelta
+import itertools
+import pickle
+import sys
 import unittest
 
 from test import libvtd_test
@@ -23,6 +27,66 @@ class TestNode(unittest.TestCase):
         # The valid datetime should have been parsed as the due date.
         self.assertEqual(datetime.datetime(2013, 6, 29, 18, 59), n.due_date)
 
+    def testParseDateTime(self):
+        """The fixed-format parser must agree with strptime()."""
+        parse = libvtd.node._ParseDateTime
+        self.assertEqual(datetime.datetime(2013, 6, 29), parse('2013-06-29'))
+        self.assertEqual(datetime.datetime(2013, 6, 29, 18, 59),
+                         parse('2013-06-29 18:59'))
+        # Memoized results are the same.
+        self.assertEqual(datetime.datetime(2013, 6, 29), parse('2013-06-29'))
+        for invalid in ['2013-02-30', '2013-13-01', '0000-01-01',
+                        '2013-06-29 24:00', '2013-06-29 12:60']:
+            self.assertRaises(ValueError, parse, invalid)
+        self.assertRaises(ValueError, parse, '2013-06-29', need_time=True)
+
+        # LASTDONE needs a time; without one, the token stays in the text.
+        n = libvtd.node.NextAction()
+        n.AbsorbText('Shave EVERY day (LASTDONE 2013-09-01)')
+        self.assertEqual('Shave (LASTDONE 2013-09-01)', n.text)
+        self.assertIsNone(n.last_done)
+
+    def testEnumValues(self):
+        states = libvtd.node.DateStates
+        self.assertEqual(0, states.invisible)
+        self.assertEqual(4, states.late)
+        self.assertEqual('due', states[states.due])
+        self.assertEqual(5, len(states))
+        self.assertRaises(AttributeError, getattr, states, 'bogus')
+
+    def testSinglePassTokenScan(self):
+        """The single-pass scan must agree with one re.sub() pass per token.
+        """
+        lines = [
+            'Plain text, with no tokens at all',
+            '@p:1 @@Read @t:15 chapter 8 >2013-06-28 13:00 @home',
+            'Test VTD <2013-06-31 <2013-06-29 18:59',
+            'Ready early <2013-08-27(2) #id @after:other (DONE)',
+            'Mixed (WONTDO 2013-07-20 15:00) @!work @! text',
+            'Shave EVERY 3-5 days (LASTDONE 2013-09-01 08:30)',
+            'Garbage EVERY week [Monday 12:00 - Tuesday 7:00] @home',
+            # Lines where a token only appears once another is stripped out.
+            'Hidden (DONE @home)',
+            'Hidden EVERY @home day',
+            'Hidden EVERY day @home [Mon]',
+            'Hidden EVERY day [Mon @home]',
+            'Revealed @@EVERY day',
+            'Extended >2013-01-01 <2013-01-02(3) 12:00',
+            'Never done (LASTDONE 2013-09-01)',
+            'Call mom @ >2013-05-01! now',
+            'Call mom @ @home! now',
+        ]
+        for line in lines:
+            for node_type in [libvtd.node.NextAction, libvtd.node.Section]:
+                single = node_type()
+                sequential = node_type()
+                self.assertEqual(
+                    sequential._token_scanner.ScanSequentially(sequential,
+                                                               line),
+                    single._token_scanner.Scan(single, line))
+                self.assertDictEqual(libvtd_test.NodeState(sequential),
+                                     libvtd_test.NodeState(single))
+
     def testNestingUnderFile(self):
         """Check that any non-File Node can be nested under a File."""
         f = libvtd.node.File()
@@ -117,6 +181,127 @@ class TestNode(unittest.TestCase):
         self.assertFalse(c.AddChild(libvtd.node.Comment(indent=c.indent)))
         self.assertTrue(c.AddChild(libvtd.node.Comment(indent=c.indent + 2)))
 
+    def testCompactLayout(self):
+        """Nodes have no __dict__, and share their empty lists."""
+        vtd_file = libvtd.node.File.FromLines([
+            '= Section =',
+            '# Project @@waiting',
+            '  @ Action #first @@Inbox @after:second',
+            '  * Comment',
+        ])
+        section = vtd_file.children[0]
+        project = section.children[0]
+        (action, comment) = project.children
+        for node in [vtd_file, section, project, action, comment,
+                     libvtd.node.NeedsNextActionStub(project)]:
+            self.assertFalse(hasattr(node, '__dict__'))
+
+        self.assertIs(comment.children, action.children)
+        self.assertIs(project.blockers, libvtd.node.NextAction().blockers)
+        self.assertEqual(['second'], action.blockers)
+
+        # Reserved contexts are flags (which don't get inherited), not
+        # contexts.
+        self.assertTrue(project.waiting)
+        self.assertFalse(project.inbox)
+        self.assertFalse(action.waiting)
+        self.assertTrue(action.inbox)
+        self.assertEqual([], action.contexts)
+
+        (internal_id, first_id) = action.ids
+        self.assertEqual('*', internal_id[0])
+        self.assertEqual('first', first_id)
+        self.assertEqual(1, len(project.ids))
+
+    def testInheritedValues(self):
+        """Stored inherited values match a walk up the ancestors."""
+        def Walked(node):
+            """(contexts, due, ready, visible, priority), walking upwards."""
+            if not node:
+                return ([], None, None, None, None)
+            (contexts, due, ready, visible, priority) = Walked(node.parent)
+            if node._cancel_inheriting_all_contexts:
+                contexts = []
+            contexts = [c for c in list(node._contexts) + contexts
+                        if c not in node._canceled_contexts]
+
+            def Merged(own, inherited, choose):
+                return choose(own, inherited) if own and inherited else (
+                    own or inherited)
+            return (contexts,
+                    Merged(node._due_date, due, min),
+                    Merged(node._ready_date, ready, min),
+                    Merged(node._visible_date, visible, max),
+                    node._priority if node._priority is not None else
+                    priority)
+
+        def AssertMatchesWalk(vtd_file):
+            for node in libvtd.node.PreOrder([vtd_file]):
+                self.assertEqual(Walked(node),
+                                 (node.contexts, node.due_date,
+                                  node.ready_date, node.visible_date,
+                                  node.priority))
+                self.assertEqual('inherit.txt', node.file_name)
+
+        vtd_file = libvtd.node.File.FromLines([
+            '= Section @home @p:2 =',
+            '- Project @work <2013-10-10 >2013-09-01',
+            '  @ Action @!home @phone <2013-10-01(3)',
+            '  - Subproject @! @p:1 >2013-09-15',
+            '    @ Subaction @@Home @home <2013-10-20',
+            '    * Comment @!phone',
+            '- Recurring project EVERY week [Sun] '
+            '(LASTDONE 2013-09-01 10:00)',
+            '  @ Recurring action (LASTDONE 2013-09-05 10:00)',
+        ], file_name='inherit.txt')
+        AssertMatchesWalk(vtd_file)
+
+        section = vtd_file.children[0]
+        (project, recurring) = section.children
+        (action, subproject) = project.children
+
+        # New tokens for a Node with children.
+        project.AbsorbText('  @errands <2013-09-20', '  ')
+        section.AddContext('online')
+        AssertMatchesWalk(vtd_file)
+        self.assertEqual(['phone', 'work', 'errands', 'online'],
+                         action.contexts)
+
+        # A new parent.
+        self.assertTrue(action.AddChild(libvtd.node.Comment(indent=4)))
+        moved = subproject.children[0]
+        self.assertTrue(recurring.AddChild(moved))
+        AssertMatchesWalk(vtd_file)
+
+        # Recurring dates are set when first needed.
+        recurring.DateState(datetime.datetime(2013, 9, 10))
+        self.assertIsNotNone(recurring.children[0].due_date)
+        AssertMatchesWalk(vtd_file)
+
+    def testContextMasks(self):
+        """Each Node's contexts are also available as a bitmask."""
+        vtd_file = libvtd.node.File.FromLines([
+            '- Project @home @work',
+            '  @ Action @!work @phone',
+        ])
+        action = vtd_file.children[0].children[0]
+        registry = libvtd.node.context_registry
+        self.assertEqual(registry.Mask(['home', 'phone']), action.context_mask)
+        six.assertCountEqual(self, ['home', 'phone'],
+                             registry.Contexts(action.context_mask))
+
+        # The bits belong to this process: unpickled Nodes get new masks.
+        pickled = pickle.dumps(vtd_file, pickle.HIGHEST_PROTOCOL)
+        libvtd.node.context_registry = libvtd.node.ContextRegistry()
+        try:
+            libvtd.node.context_registry.Mask(['errands'])
+            action = pickle.loads(pickled).children[0].children[0]
+            self.assertEqual(
+                libvtd.node.context_registry.Mask(['home', 'phone']),
+                action.context_mask)
+        finally:
+            libvtd.node.context_registry = registry
+
     def testAtomicAbsorption(self):
         """Failed call to AbsorbText must leave Node in its original state.
         """
@@ -126,15 +311,8 @@ class TestNode(unittest.TestCase):
         # parent text.
         self.assertFalse(test_action.AbsorbText('@p:1 @work @t:15 to do'))
         self.maxDiff = None
-
-        # Kind of ugly, but assertDictEqual fails for _diff_functions because
-        # the (otherwise identical) functions are bound to different objects.
-        keys_to_disregard = ['_diff_functions']
-        for key in keys_to_disregard:
-            test_action.__dict__.pop(key)
-            action.__dict__.pop(key)
-
-        self.assertDictEqual(test_action.__dict__, action.__dict__)
+        self.assertDictEqual(libvtd_test.NodeState(test_action),
+                             libvtd_test.NodeState(action))
 
     def testAbsorption(self):
         # File should not ever absorb text; its text should only come from the
@@ -232,6 +410,26 @@ class TestFile(unittest.TestCase):
         self.assertEqual('A section', section.text)
         self.assertEqual(1, section.level)
 
+    def testCreateCorrectNodeType(self):
+        """Each line creates the right type of Node, if any."""
+        expected_types = [
+            ('', None),
+            ('    ', None),
+            ('Plain text continuing an earlier Node', None),
+            ('= Section =', libvtd.node.Section),
+            ('  = Indented sections are just text =', None),
+            ('=Missing spaces=', None),
+            ('# Ordered project', libvtd.node.Project),
+            ('  - Unordered project', libvtd.node.Project),
+            ('-- Not a project', None),
+            ('\t@ Tab-indented action', libvtd.node.NextAction),
+            ('@Missing space', None),
+            ('    * Comment', libvtd.node.Comment),
+        ]
+        for (line, expected_type) in expected_types:
+            node = libvtd.node.File.CreateNodeFromLine(line)
+            self.assertEqual(expected_type, node.__class__ if node else None)
+
     def testParseSectionWithAttributes(self):
         """Parse a section with default priority and contexts."""
         section = libvtd.node.File.CreateNodeFromLine(
@@ -278,9 +476,412 @@ class TestFile(unittest.TestCase):
             self.assertTupleEqual((file_name, 4), action.Source())
 
 
+    def testFromLines(self):
+        """Files can be created from lines of text, without touching disk."""
+        lines = [
+            '= Section =',
+            '',
+            '# Project #proj',
+            '  @ Action',
+            '@ Duplicate id #proj',
+        ]
+        with libvtd_test.TempInput(lines) as file_name:
+            from_disk = libvtd.node.File(file_name)
+        from_lines = libvtd.node.File.FromLines(
+            (line + '\n' for line in lines), file_name='buffer')
+
+        self.assertEqual(from_disk.bad_lines, from_lines.bad_lines)
+        self.assertEqual('Project', from_lines.NodeWithId('proj').text)
+        action = from_lines.children[0].children[0].children[0]
+        self.assertEqual('Action', action.text)
+        self.assertTupleEqual(('buffer', 4), action.Source())
+
+    def testOrderedProjectPredecessors(self):
+        """Each step waits for the previous step which isn't done yet."""
+        vtd_file = libvtd.node.File.FromLines([
+            '# Ordered project',
+            '  @ Step one',
+            '  * A comment',
+            '  @ Step two',
+            '    which gets done on its second line (DONE)',
+            '  - Step three',
+            '    @ Step three, part one',
+            '  @ Step four (DONE)',
+            '  @ Step five',
+        ])
+        project = vtd_file.children[0]
+        steps = [child for child in project.children
+                 if isinstance(child, libvtd.node.DoableNode)]
+        self.assertEqual([None, steps[0], steps[0], steps[2], steps[2]],
+                         [step.predecessor for step in steps])
+        self.assertIsNone(steps[2].children[0].predecessor)
+
+    def testTraversalOrders(self):
+        """PreOrder() and PostOrder() walk the tree without recursing."""
+        vtd_file = libvtd.node.File.FromLines([
+            '- Project',
+            '  @ First action (DONE)',
+            '    * Hidden comment',
+            '  @ Second action',
+            '@ Last action',
+        ])
+        project = vtd_file.children[0]
+        (first, second) = project.children
+        hidden = first.children[0]
+        last = vtd_file.children[1]
+        done = lambda x: getattr(x, 'done', False)
+
+        self.assertEqual(
+            [vtd_file, project, first, hidden, second, last],
+            list(libvtd.node.PreOrder([vtd_file])))
+        self.assertEqual(
+            [hidden, first, second, project, last, vtd_file],
+            list(libvtd.node.PostOrder([vtd_file])))
+        self.assertEqual([first, second, project, last],
+                         list(libvtd.node.PostOrder([project, last], done)))
+        self.assertEqual([project, first, second],
+                         list(libvtd.node.PreOrder([project], done)))
+
+        # Outlines nested far more deeply than the recursion limit are fine.
+        depth = 3 * sys.getrecursionlimit()
+        deep_file = libvtd.node.File.FromLines(
+            ['  ' * i + '* Note {}'.format(i) for i in range(depth)])
+        innermost = list(libvtd.node.PreOrder([deep_file]))[-1]
+        self.assertEqual(2 * (depth - 1), innermost.indent)
+        self.assertEqual(innermost,
+                         next(libvtd.node.PostOrder([deep_file])))
+
+    def testProjectsNeedingNextActions(self):
+        """Projects know whether they have any open NextAction or Project."""
+        vtd_file = libvtd.node.File.FromLines([
+            '- Empty project',
+            '- Project with only a comment',
+            '  * A comment',
+            '- Project with a done action',
+            '  @ Done action',
+            '    which gets done on its second line (DONE)',
+            '- Project with an open subproject',
+            '  - Subproject',
+            '    @ Open action',
+            '- Done project (DONE)',
+        ])
+        self.assertEqual([True, True, True, False, False, False],
+                         [project.needs_next_action for project in
+                          libvtd.node.PreOrder([vtd_file])
+                          if isinstance(project, libvtd.node.Project)])
+
+    def testStreamFromLines(self):
+        """Top-level Nodes are yielded as soon as they're complete."""
+        lines_read = []
+
+        def Lines():
+            for line in ['# First project', '  @ Action', '',
+                         '@ Standalone action', '  continued',
+                         '= Section =']:
+                lines_read.append(line)
+                yield line
+
+        stream = libvtd.node.File.StreamFromLines(Lines(), file_name='stream')
+        project = next(stream)
+        self.assertEqual('First project', project.text)
+        self.assertEqual(['Action'], [x.text for x in project.children])
+        self.assertEqual(4, len(lines_read))
+
+        action = next(stream)
+        self.assertEqual('Standalone action\ncontinued', action.text)
+        self.assertEqual(6, len(lines_read))
+
+        section = next(stream)
+        self.assertEqual('Section', section.text)
+        self.assertEqual(('stream', 6), section.Source())
+        self.assertEqual([project, action, section], section.parent.children)
+        self.assertRaises(StopIteration, next, stream)
+
+    def testUpdateSplicesChangedSubtree(self):
+        """Update() reparses only the subtree enclosing the changed lines."""
+        lines = [
+            '= Section =',
+            '# Ordered project',
+            '  @ First step',
+            '  @ Second step #second',
+            '  @ Third step',
+            '',
+            '@ Later action #later',
+            '@ Blocked action @after:second',
+        ]
+        file = libvtd.node.File.FromLines(lines)
+        project = file.children[0].children[0]
+        (first, second, third) = project.children
+        later = file.NodeWithId('later')
+
+        new_lines = list(lines)
+        new_lines[2] = '  @ First step (DONE)'
+        new_lines.insert(3, '    with notes')
+        self.assertTrue(file.Update(new_lines))
+
+        # Only the first step was reparsed.
+        self.assertIs(project, file.children[0].children[0])
+        self.assertIsNot(first, project.children[0])
+        self.assertEqual([second, third], project.children[1:])
+        self.assertEqual('First step\nwith notes', project.children[0].text)
+
+        # The steps after it were relinked, and moved down a line.
+        self.assertIsNone(second.predecessor)
+        self.assertIs(second, third.predecessor)
+        self.assertEqual(5, second.Source()[1])
+        self.assertIs(later, file.NodeWithId('later'))
+        self.assertEqual(8, later.Source()[1])
+
+    def testUpdateMatchesFullParse(self):
+        """However much gets reparsed, the result is as if parsed afresh."""
+        def Summary(node):
+            return (node.__class__.__name__, node.text,
+                    getattr(node, '_line_in_file', None),
+                    getattr(node, 'blockers', None),
+                    getattr(node, 'predecessor', None) and
+                    node.predecessor.text,
+                    node.contexts, node.due_date, node.visible_date,
+                    node.priority, node.file_name,
+                    getattr(node, 'needs_next_action', None),
+                    [Summary(child) for child in node.children])
+
+        lines = [
+            '= Section =',
+            '- Project #proj',
+            '  @ Action @home',
+            '  - Subproject',
+            '    @ Subaction',
+            '# Ordered project',
+            '  @ Step one',
+            '  @ Step two',
+            '@ Action #dup',
+            '@ Action with same id #dup',
+            '== Subsection ==',
+            '@ Last action',
+        ]
+        edits = [
+            lambda x: x.__setitem__(4, '    @ Subaction (DONE)'),
+            lambda x: x.__setitem__(1, '- Project #proj @work <2013-10-01'),
+            lambda x: x.__setitem__(3, '  - Subproject @! @p:1 >2013-09-01'),
+            lambda x: x.insert(7, '  @ Step one and a half'),
+            lambda x: x.__setitem__(6, '  @ Step one (DONE)'),
+            lambda x: x.__delitem__(3),
+            lambda x: x.__setitem__(0, '= Renamed section ='),
+            lambda x: x.__setitem__(9, '@ Action with new id #new'),
+            lambda x: x.append('  more text'),
+        ]
+        for edit in edits:
+            new_lines = list(lines)
+            edit(new_lines)
+            file = libvtd.node.File.FromLines(lines, 'file.txt')
+            self.assertTrue(file.Update(new_lines))
+            expected = libvtd.node.File.FromLines(new_lines, 'file.txt')
+            self.assertEqual(Summary(expected), Summary(file))
+            self.assertEqual(expected.bad_lines, file.bad_lines)
+            six.assertCountEqual(self, expected._node_with_id.keys(),
+                                 file._node_with_id.keys())
+            self.assertEqual(expected.ContentHash(), file.ContentHash())
+
+            updated = libvtd.node.File.FromLines(lines, 'file.txt').Updated(
+                new_lines)
+            self.assertEqual(Summary(expected), Summary(updated))
+            self.assertEqual(expected.bad_lines, updated.bad_lines)
+            self.assertEqual(expected.ContentHash(), updated.ContentHash())
+
+    def testUpdatedNeverChangesTheOriginal(self):
+        """Updated() works on a copy of the tree, so the original stays put."""
+        lines = [
+            '= Section =',
+            '# Project',
+            '  @ Action #action',
+            '  @ Other action',
+            '= Other section =',
+            '@ Later action #later',
+        ]
+        file = libvtd.node.File.FromLines(lines)
+        nodes = list(libvtd.node.PreOrder([file]))
+        links = [(node.parent, list(node.children), node.Source(),
+                  getattr(node, 'predecessor', None)) for node in nodes]
+
+        new_lines = list(lines)
+        new_lines[2] = '  @ Action #action (DONE)'
+        new_lines.insert(3, '  @ New action #new')
+        updated = file.Updated(new_lines)
+
+        # The original File, and every one of its Nodes, is as it was.
+        self.assertEqual(links, [(node.parent, list(node.children),
+                                  node.Source(),
+                                  getattr(node, 'predecessor', None))
+                                 for node in nodes])
+        self.assertFalse(file.NodeWithId('action').done)
+        self.assertIsNone(file.NodeWithId('new'))
+        self.assertEqual(libvtd.node.File.ContentHashOf(lines),
+                         file.ContentHash())
+
+        # The new File links only to its own Nodes.
+        new_nodes = list(libvtd.node.PreOrder([updated]))
+        self.assertEqual([], [node for node in new_nodes if node in nodes])
+        for node in new_nodes:
+            for child in node.children:
+                self.assertIs(node, child.parent)
+        (new_action, new_step, other_action) = (
+            updated.children[0].children[0].children)
+        self.assertIs(new_step, other_action.predecessor)
+        self.assertTrue(updated.NodeWithId('action').done)
+        self.assertIs(new_step, updated.NodeWithId('new'))
+        self.assertEqual(7, updated.NodeWithId('later').Source()[1])
+        self.assertEqual(libvtd.node.File.ContentHashOf(new_lines),
+                         updated.ContentHash())
+        self.assertIs(updated, updated.Updated(new_lines))
+
+    def testUpdateRefusesChangesToSurroundingStructure(self):
+        """If other lines would parse differently, Update() changes nothing."""
+        lines = [
+            '= Section =',
+            '@ Action #dup',
+            '= Other section =',
+            '@ Action with same id #dup',
+        ]
+        file = libvtd.node.File.FromLines(lines)
+        children = list(file.children)
+        bad_lines = list(file.bad_lines)
+
+        for new_lines in [
+                # The second section would nest inside the first.
+                ['= Section =', '@ Action #dup', '== Other section ==',
+                 '@ Action with same id #dup'],
+                # The first section would absorb the text.
+                ['= Section =', 'Stray text', '@ Action #dup',
+                 '= Other section =', '@ Action with same id #dup'],
+                # The last action would no longer have a duplicate id.
+                ['= Section =', '@ Action', '= Other section =',
+                 '@ Action with same id #dup']]:
+            self.assertIsNone(file.Updated(new_lines))
+            self.assertFalse(file.Update(new_lines))
+            self.assertEqual(children, file.children)
+            self.assertEqual([file] * len(children),
+                             [child.parent for child in children])
+            self.assertEqual(bad_lines, file.bad_lines)
+            self.assertIs(children[0].children[0], file.NodeWithId('dup'))
+            self.assertEqual(libvtd.node.File.ContentHashOf(lines),
+                             file.ContentHash())
+
+
+class TestMonthArithmetic(unittest.TestCase):
+    """Check the integer month arithmetic against dateutil."""
+
+    @staticmethod
+    def DateutilAdvanceByMonths(date_and_time, num, from_start):
+        """The original, dateutil-based implementation of AdvanceByMonths."""
+        if from_start:
+            return date_and_time + dateutil.relativedelta.relativedelta(
+                months=num)
+        time = date_and_time.time()
+        first_day_next_month = (
+            (date_and_time.date() +
+             dateutil.relativedelta.relativedelta(months=1)).replace(day=1))
+        offset = first_day_next_month - date_and_time.date()
+        date = (date_and_time.date() + offset +
+                dateutil.relativedelta.relativedelta(months=num)) - offset
+        return datetime.datetime.combine(date, time)
+
+    def Days(self, start, end, step=1):
+        """Every step'th day from start until end, at 09:30."""
+        day = datetime.datetime(start.year, start.month, start.day, 9, 30)
+        while day.date() < end:
+            yield day
+            day += datetime.timedelta(days=step)
+
+    def testAdvanceByMonthsMatchesDateutil(self):
+        # Three decades, plus a century year which isn't a leap year.
+        days = itertools.chain(
+            self.Days(datetime.date(1995, 1, 1), datetime.date(2025, 1, 1)),
+            self.Days(datetime.date(2099, 12, 1), datetime.date(2100, 4, 1)))
+        for day in days:
+            for num in [-13, -1, 1, 12]:
+                for from_start in [True, False]:
+                    self.assertEqual(
+                        self.DateutilAdvanceByMonths(day, num, from_start),
+                        libvtd.node.AdvanceByMonths(day, num, from_start),
+                        (day, num, from_start))
+
+    def testPreviousMonthDayMatchesDateutil(self):
+        advance = libvtd.node.AdvanceByMonths
+        libvtd.node.AdvanceByMonths = self.DateutilAdvanceByMonths
+        try:
+            days = list(self.Days(datetime.date(1995, 1, 1),
+                                  datetime.date(2025, 1, 1), step=5))
+            monthdays = ['-3', '0', '1 12:00', '15', '28', '29', '30', '31']
+            expected = [libvtd.node.PreviousMonthDay(day, monthday)
+                        for day in days for monthday in monthdays]
+        finally:
+            libvtd.node.AdvanceByMonths = advance
+        self.assertEqual(expected,
+                         [libvtd.node.PreviousMonthDay(day, monthday)
+                          for day in days for monthday in monthdays])
+
+
 class TestRecurringActions(unittest.TestCase):
     """Test various kinds of recurring actions."""
 
+    def testRecurrenceParsedOnce(self):
+        """Each distinct recurrence spec gets parsed into one shared object."""
+        vtd_file = libvtd.node.File.FromLines([
+            '- Weekly review EVERY week [Fri 9:00 - Sat 17:00]',
+            '  @ Empty inboxes',
+            '  @ Review projects',
+            '@ Elsewhere EVERY week [Fri 9:00 - Sat 17:00]',
+        ])
+        (project, other) = vtd_file.children
+        recurrence = project._recurrence
+        self.assertEqual(('week', 1, 1, (5, datetime.time(17, 0)),
+                          (4, datetime.time(9, 0)), True, True), recurrence)
+        for child in project.children + [other]:
+            self.assertTrue(child.recurring)
+            self.assertIs(recurrence, child._recurrence)
+
+    def testRecurringDatesComputedOnce(self):
+        """DateState() only recomputes dates when LASTDONE changes."""
+        recur = libvtd.node.NextAction()
+        recur.AbsorbText('Pay rent EVERY month [-5 - 1] '
+                         '(LASTDONE 2013-09-01 10:00)')
+        computed = []
+        compute = libvtd.node.DoableNode._ComputeRecurringDates
+
+        def CountingCompute(node):
+            computed.append(node.last_done)
+            return compute(node)
+        libvtd.node.DoableNode._ComputeRecurringDates = CountingCompute
+        try:
+            for day in range(1, 30):
+                recur.DateState(datetime.datetime(2013, 9, day))
+            self.assertEqual([datetime.datetime(2013, 9, 1, 10)], computed)
+            self.assertEqual(datetime.datetime(2013, 10, 1, 23, 59),
+                             recur.due_date)
+
+            recur.AbsorbText('  (LASTDONE 2013-10-02 10:00)')
+            self.assertEqual(libvtd.node.DateStates.invisible,
+                             recur.DateState(datetime.datetime(2013, 10, 3)))
+        finally:
+            libvtd.node.DoableNode._ComputeRecurringDates = compute
+        self.assertEqual(2, len(computed))
+        self.assertEqual(datetime.datetime(2013, 11, 1, 23, 59),
+                         recur.due_date)
+
+    def testPreviousBoundaryFunctions(self):
+        """The string-based functions still work on their own."""
+        now = datetime.datetime(2013, 9, 4, 12)  # A Wednesday.
+        self.assertEqual(datetime.datetime(2013, 9, 3, 17),
+                         libvtd.node.PreviousTime(now, '17:00'))
+        self.assertEqual(datetime.datetime(2013, 9, 2, 23, 59),
+                         libvtd.node.PreviousWeekDay(now, 'Mon'))
+        self.assertEqual(datetime.datetime(2013, 9, 2, 0, 0),
+                         libvtd.node.PreviousWeekDay(now, 'Mon', due=False))
+        self.assertEqual(datetime.datetime(2013, 8, 31, 23, 59),
+                         libvtd.node.PreviousMonthDay(now, '0'))
+        self.assertEqual(datetime.datetime(2013, 8, 15, 9, 30),
+                         libvtd.node.PreviousMonthDay(now, '15 9:30'))
+
     def testDayRecurSimple(self):
         """Test a simple action which recurs every day."""
         recur = libvtd.node.NextAction()
@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import libvtd.node
+import libvtd.refresher
+import libvtd.trusted_system
+
+
+class TestRefresher(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_names = [os.path.join(self.directory, name)
+                           for name in ('first.txt', 'second.txt')]
+        for file_name in self.file_names:
+            self.writeLines(file_name, ['@ Original action'])
+        self.trusted_system = libvtd.trusted_system.TrustedSystem()
+        self.trusted_system.AddFiles(self.file_names)
+        self.refreshed = []
+        self.refresher = libvtd.refresher.Refresher(
+            self.trusted_system, on_refresh=self.refreshed.append)
+        self.refresher.Start()
+
+    def tearDown(self):
+        self.refresher.Stop()
+        shutil.rmtree(self.directory)
+
+    def writeLines(self, file_name, lines):
+        with open(file_name, 'w') as vtd_file:
+            vtd_file.write('\n'.join(lines))
+
+    def actionTexts(self):
+        return sorted(x.text for x in self.trusted_system.NextActions())
+
+    def testRequestEveryFile(self):
+        self.writeLines(self.file_names[1], ['@ Edited action'])
+        self.refresher.Request()
+        self.assertTrue(self.refresher.Wait(5))
+        self.assertEqual(['Edited action', 'Original action'],
+                         self.actionTexts())
+        self.assertEqual([[self.file_names[1]]], self.refreshed)
+
+    def testRequestSomeFiles(self):
+        for file_name in self.file_names:
+            self.writeLines(file_name, ['@ Edited action'])
+        self.refresher.Request([self.file_names[0]])
+        self.assertTrue(self.refresher.Wait(5))
+        self.assertEqual(['Edited action', 'Original action'],
+                         self.actionTexts())
+
+    def testQueriesDontWaitForParsing(self):
+        """Queries keep using the old files while the new ones get parsed."""
+        parsing = threading.Event()
+        finish_parsing = threading.Event()
+        updated = libvtd.node.File.Updated
+
+        def SlowUpdated(vtd_file, lines):
+            parsing.set()
+            finish_parsing.wait(5)
+            return updated(vtd_file, lines)
+        libvtd.node.File.Updated = SlowUpdated
+        try:
+            self.writeLines(self.file_names[0], ['@ Edited action'])
+            self.refresher.Request()
+            self.assertTrue(parsing.wait(5))
+            self.assertEqual(['Original action', 'Original action'],
+                             self.actionTexts())
+            self.assertFalse(self.refresher.Wait(0.01))
+            finish_parsing.set()
+            self.assertTrue(self.refresher.Wait(5))
+        finally:
+            finish_parsing.set()
+            libvtd.node.File.Updated = updated
+        self.assertEqual(['Edited action', 'Original action'],
+                         self.actionTexts())
+
+    def testWaitRaisesErrorsOnce(self):
+        os.remove(self.file_names[0])
+        self.refresher.Request()
+        self.assertRaises(OSError, self.refresher.Wait, 5)
+        self.assertTrue(self.refresher.Wait(5))
+        self.assertEqual(['Original action', 'Original action'],
+                         self.actionTexts())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from test import libvtd_test
+
+import libvtd.node
+import libvtd.tree_cache
+
+
+class TestTreeCache(unittest.TestCase):
+    """Test the on-disk cache of parsed File trees."""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = libvtd.tree_cache.TreeCache(self.cache_dir)
+        self.lines = [
+            '= Section =',
+            '# Ordered project #proj',
+            '  @ First step',
+            '  @ Second step',
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def assertLoadsWithoutParsing(self, file_name):
+        """Check that the cache has an up-to-date entry for file_name."""
+        parse_lines = libvtd.node.File._ParseLines
+
+        def FailToParse(*unused_args):
+            self.fail('{} should have been loaded from the cache'.format(
+                file_name))
+        libvtd.node.File._ParseLines = FailToParse
+        try:
+            vtd_file = self.cache.Load(file_name)
+        finally:
+            libvtd.node.File._ParseLines = parse_lines
+        self.assertIsNotNone(vtd_file)
+        return vtd_file
+
+    def testStoreAndLoad(self):
+        with libvtd_test.TempInput(self.lines) as file_name:
+            self.assertIsNone(self.cache.Load(file_name))
+            self.cache.Store(file_name, libvtd.node.File(file_name))
+
+            vtd_file = self.assertLoadsWithoutParsing(file_name)
+            project = vtd_file.NodeWithId('proj')
+            self.assertEqual('Ordered project', project.text)
+            self.assertIs(project.children[0], project.children[1].predecessor)
+            self.assertTupleEqual((file_name, 4),
+                                  project.children[1].Source())
+
+    def testChangedFileMisses(self):
+        with libvtd_test.TempInput(self.lines) as file_name:
+            self.cache.Store(file_name, libvtd.node.File(file_name))
+            stat = os.stat(file_name)
+
+            # Same size, same mtime: only the content hash can tell.
+            with open(file_name, 'w') as vtd_file:
+                vtd_file.write('\n'.join(self.lines).replace('First',
+                                                             'Fresh'))
+            os.utime(file_name, (stat.st_atime, stat.st_mtime))
+            self.assertIsNone(self.cache.Load(file_name))
+
+            with open(file_name, 'a') as vtd_file:
+                vtd_file.write('\n  @ Third step')
+            self.assertIsNone(self.cache.Load(file_name))
+
+    def testVersionMismatchMisses(self):
+        with libvtd_test.TempInput(self.lines) as file_name:
+            self.cache.Store(file_name, libvtd.node.File(file_name))
+            libvtd.tree_cache._FORMAT_VERSION += 1
+            try:
+                self.assertIsNone(self.cache.Load(file_name))
+            finally:
+                libvtd.tree_cache._FORMAT_VERSION -= 1
+            self.assertLoadsWithoutParsing(file_name)
+
+    def testCorruptEntryMisses(self):
+        with libvtd_test.TempInput(self.lines) as file_name:
+            with open(self.cache._EntryName(file_name), 'wb') as entry:
+                entry.write(b'Not a pickle')
+            self.assertIsNone(self.cache.Load(file_name))
+
+    def testTreeTooDeepToPickleIsSkipped(self):
+        depth = 3 * sys.getrecursionlimit()
+        lines = (['- Deep project'] +
+                 ['  ' * i + '- Step {}'.format(i) for i in range(1, depth)])
+        with libvtd_test.TempInput(lines) as file_name:
+            self.assertFalse(
+                self.cache.Store(file_name, libvtd.node.File(file_name)))
+            self.assertEqual([], os.listdir(self.cache_dir))
+            self.assertIsNone(self.cache.Load(file_name))
+
+    def testPrune(self):
+        cache = libvtd.tree_cache.TreeCache(self.cache_dir, max_entries=2)
+        with libvtd_test.TempInput(self.lines) as first, \
+                libvtd_test.TempInput(self.lines) as second, \
+                libvtd_test.TempInput(self.lines) as third:
+            for file_name in [first, second, third]:
+                cache.Store(file_name, libvtd.node.File(file_name))
+            # Make the first entry the most recently used, and the second the
+            # least recently used.
+            os.utime(cache._EntryName(second), (0, 0))
+            self.assertIsNotNone(cache.Load(first))
+
+            cache.Prune()
+            self.assertIsNotNone(cache.Load(first))
+            self.assertIsNone(cache.Load(second))
+            self.assertIsNotNone(cache.Load(third))
+
+        # Entries for files which no longer exist get pruned, too.
+        cache.Prune()
+        self.assertEqual([], os.listdir(self.cache_dir))
@@ -1,14 +1,18 @@
 import datetime
 import itertools
 import os
+import shutil
 import subprocess
+import sys
 import tempfile
+import threading
 import unittest
 
 from test import libvtd_test
 from third_party import six
 
 import libvtd.node
+import libvtd.tree_cache
 import libvtd.trusted_system
 
 
@@ -229,21 +233,12 @@ class TestTrustedSystemNextActions(TestTrustedSystemBaseClass):
                 ['first action'],
                 [x.text for x in self.trusted_system.NextActions()])
 
-        # Add text to the file, but make the system think it's already been
-        # updated; this new action should not show up.
+        # Add text to the file; Refresh() should find the new action, even if
+        # the system thinks it's refreshed since then.
         with open(temp.name, 'a') as temp_file:
             temp_file.write('\n@ next action')
-        time_interval = 60  # Adjust timestamps by this (arbitrary) amount.
-        self.trusted_system.last_refreshed += time_interval
-        self.trusted_system.Refresh()
-        six.assertCountEqual(
-                self, 
-                ['first action'],
-                [x.text for x in self.trusted_system.NextActions()])
-
-        # Refresh() should update the timestamp and find the new action.
-        self.trusted_system.last_refreshed -= 2 * time_interval
-        self.trusted_system.Refresh()
+        self.trusted_system.last_refreshed += 60
+        self.assertEqual([temp.name], self.trusted_system.Refresh())
         self.assertLess(os.path.getmtime(temp.name),
                         self.trusted_system.last_refreshed)
         six.assertCountEqual(
@@ -254,6 +249,379 @@ class TestTrustedSystemNextActions(TestTrustedSystemBaseClass):
         # Clean up after ourselves.
         os.unlink(temp.name)
 
+    def testRefreshOnlyRereadsChangedContents(self):
+        with libvtd_test.TempInput(["@ first action"]) as file_name:
+            self.trusted_system.AddFile(file_name)
+            action = self.trusted_system.NextActions()[0]
+
+            # Touching the file changes nothing.
+            os.utime(file_name, None)
+            self.assertEqual([], self.trusted_system.Refresh())
+            self.assertIs(action, self.trusted_system.NextActions()[0])
+
+            # Neither does replacing it with a copy.
+            shutil.copy(file_name, file_name + '.new')
+            os.rename(file_name + '.new', file_name)
+            self.assertEqual([], self.trusted_system.Refresh())
+            self.assertIs(action, self.trusted_system.NextActions()[0])
+
+            # An edit which keeps the same size and mtime still gets noticed,
+            # since the file was read within the same tick.
+            stat = os.stat(file_name)
+            with open(file_name, 'w') as vtd_file:
+                vtd_file.write("@ other action")
+            os.utime(file_name, (stat.st_atime, stat.st_mtime))
+            self.assertEqual([file_name], self.trusted_system.Refresh())
+            self.assertEqual(['other action'],
+                             [x.text for x in
+                              self.trusted_system.NextActions()])
+
+    def testFailedRefreshLosesNoChanges(self):
+        """A file which changed before a refresh failed still gets reread."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        (first, second) = [os.path.join(directory, name)
+                           for name in ('a.txt', 'b.txt')]
+        for file_name in (first, second):
+            with open(file_name, 'w') as vtd_file:
+                vtd_file.write('@ Old action')
+        self.trusted_system.AddFiles([first, second])
+
+        for refresh in (self.trusted_system.Refresh,
+                        lambda: self.trusted_system.RefreshFiles(
+                            [first, second])):
+            with open(first, 'w') as vtd_file:
+                vtd_file.write('@ New action')
+            # An editor can move the other file away while saving it.
+            os.rename(second, second + '.moved')
+            self.assertRaises(OSError, refresh)
+            os.rename(second + '.moved', second)
+            self.assertEqual([first], refresh())
+            self.assertEqual(['New action', 'Old action'],
+                             sorted(x.text for x in
+                                    self.trusted_system.NextActions()))
+            with open(first, 'w') as vtd_file:
+                vtd_file.write('@ Old action')
+            self.assertEqual([first], refresh())
+
+    def testFailedRefreshLeavesFilesAlone(self):
+        """Files updated before a refresh failed get updated afresh later."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        (first, second) = [os.path.join(directory, name)
+                           for name in ('a.txt', 'b.txt')]
+        with open(first, 'w') as vtd_file:
+            vtd_file.write('= sec =\n@ one\n@ two')
+        with open(second, 'w') as vtd_file:
+            vtd_file.write('@ Other action')
+        self.trusted_system.AddFiles([first, second])
+
+        with open(first, 'w') as vtd_file:
+            vtd_file.write('= sec =\n# new\n@ one\n@ two')
+        with open(second, 'w') as vtd_file:
+            vtd_file.write('@ Edited action')
+        updated = libvtd.node.File.Updated
+
+        def UpdatedExceptSecond(vtd_file, lines):
+            if vtd_file.file_name == second:
+                raise UnicodeDecodeError('utf-8', b'', 0, 1, 'invalid')
+            return updated(vtd_file, lines)
+        libvtd.node.File.Updated = UpdatedExceptSecond
+        try:
+            self.assertRaises(UnicodeDecodeError,
+                              self.trusted_system.RefreshFiles,
+                              [first, second])
+        finally:
+            libvtd.node.File.Updated = updated
+        self.assertEqual([(first, 2), (first, 3)],
+                         [x.Source() for x in
+                          self.trusted_system.NextActions()
+                          if x.file_name == first])
+
+        self.assertEqual([first], self.trusted_system.RefreshFiles([first]))
+        self.assertEqual([('one', 3), ('two', 4),
+                          ('{MISSING Next Action}', 2)],
+                         [(x.text, x.Source()[1]) for x in
+                          self.trusted_system.NextActions()
+                          if x.file_name == first])
+
+
+class TestTrustedSystemCache(unittest.TestCase):
+    def testCachedFilesSurviveBetweenSystems(self):
+        """A new system loads unchanged files from the cache."""
+        cache_dir = tempfile.mkdtemp()
+        try:
+            with libvtd_test.TempInput(['# Project', '  @ First step',
+                                        '  @ Second step']) as file_name:
+                first = libvtd.trusted_system.TrustedSystem(
+                    cache_dir=cache_dir)
+                first.AddFile(file_name)
+
+                second = libvtd.trusted_system.TrustedSystem(
+                    cache_dir=cache_dir)
+                second.AddFile(file_name)
+                self.assertEqual(
+                    [x.text for x in first.NextActions()],
+                    [x.text for x in second.NextActions()])
+
+                # Files updated in place only get cached on request.
+                with open(file_name, 'a') as vtd_file:
+                    vtd_file.write('\n  @ Third step')
+                second.Refresh(force=True)
+                self.assertIn(file_name, second._unsaved_files)
+                cache = libvtd.tree_cache.TreeCache(cache_dir)
+                self.assertIsNone(cache.Load(file_name))
+                second.SaveCache()
+                self.assertEqual(
+                    ['First step', 'Second step', 'Third step'],
+                    [x.text for x in
+                     cache.Load(file_name).children[0].children])
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def testOnlySaveCachePrunes(self):
+        """Pruning reads every entry, so it stays off the refresh path."""
+        cache_dir = tempfile.mkdtemp()
+        prune = libvtd.tree_cache.TreeCache.Prune
+        prunes = []
+
+        def CountingPrune(cache):
+            prunes.append(cache)
+            prune(cache)
+        libvtd.tree_cache.TreeCache.Prune = CountingPrune
+        try:
+            with libvtd_test.TempInput(['@ Action']) as file_name:
+                trusted_system = libvtd.trusted_system.TrustedSystem(
+                    cache_dir=cache_dir)
+                trusted_system.AddFile(file_name)
+                with open(file_name, 'w') as vtd_file:
+                    vtd_file.write('= Section =')
+                self.assertEqual([file_name],
+                                 trusted_system.Refresh(force=True))
+                self.assertEqual([], prunes)
+                trusted_system.SaveCache()
+                self.assertEqual(1, len(prunes))
+        finally:
+            libvtd.tree_cache.TreeCache.Prune = prune
+            shutil.rmtree(cache_dir)
+
+    def testTreeTooDeepToCacheStillGetsAdded(self):
+        """Failing to write a cache entry doesn't fail the refresh."""
+        cache_dir = tempfile.mkdtemp()
+        depth = 3 * sys.getrecursionlimit()
+        lines = (['- Deep project'] +
+                 ['  ' * i + '- Step {}'.format(i) for i in range(1, depth)] +
+                 ['  ' * depth + '@ Innermost action'])
+        try:
+            with libvtd_test.TempInput(lines) as file_name:
+                trusted_system = libvtd.trusted_system.TrustedSystem(
+                    cache_dir=cache_dir)
+                trusted_system.AddFile(file_name)
+                self.assertEqual(['Innermost action'],
+                                 [x.text for x in
+                                  trusted_system.NextActions()])
+                trusted_system.SaveCache()
+                self.assertEqual([], os.listdir(cache_dir))
+        finally:
+            shutil.rmtree(cache_dir)
+
+
+class TestTrustedSystemParallelParsing(unittest.TestCase):
+    def testParallelParsingMatchesSerialParsing(self):
+        """Files parsed in worker processes come back whole."""
+        contents = [
+            ["@ First file's action @home #first"],
+            ["# Ordered project", "  @ Step one", "  @ Step two @after:first"],
+            ["= Section =", "", "@ Bad id #dup", "@ Another bad id #dup"],
+        ]
+        serial = libvtd.trusted_system.TrustedSystem()
+        parallel = libvtd.trusted_system.TrustedSystem(workers=2)
+        parallel._min_parallel_batch = 1
+        file_names = []
+        try:
+            for data in contents:
+                with tempfile.NamedTemporaryFile('w', delete=False) as temp:
+                    temp.write('\n'.join(data))
+                file_names.append(temp.name)
+            for system in [serial, parallel]:
+                system.Refresh(also_parse=file_names)
+
+            six.assertCountEqual(
+                    self,
+                    [x.text for x in serial.NextActions()],
+                    [x.text for x in parallel.NextActions()])
+            for file_name in file_names:
+                self.assertEqual(serial._state.files[file_name].bad_lines,
+                                 parallel._state.files[file_name].bad_lines)
+                six.assertCountEqual(
+                        self,
+                        serial._state.files[file_name]._node_with_id.keys(),
+                        parallel._state.files[file_name]._node_with_id.keys())
+            self.assertEqual("First file's action",
+                             parallel._state.files[file_names[0]]
+                             .NodeWithId('first').text)
+        finally:
+            for file_name in file_names:
+                os.unlink(file_name)
+
+    def testTreeTooDeepToSendBackGetsParsedHere(self):
+        """A file which a worker can't pickle doesn't sink the batch."""
+        depth = 3 * sys.getrecursionlimit()
+        deep = (['- Deep project'] +
+                ['  ' * i + '- Step {}'.format(i) for i in range(1, depth)] +
+                ['  ' * depth + '@ Innermost action'])
+        contents = [deep] + [['@ Action {}'.format(i)] for i in range(8)]
+        trusted_system = libvtd.trusted_system.TrustedSystem(workers=2)
+        file_names = []
+        try:
+            for data in contents:
+                with tempfile.NamedTemporaryFile('w', delete=False) as temp:
+                    temp.write('\n'.join(data))
+                file_names.append(temp.name)
+            trusted_system.Refresh(also_parse=file_names)
+
+            six.assertCountEqual(
+                    self,
+                    ['Innermost action'] +
+                    ['Action {}'.format(i) for i in range(8)],
+                    [x.text for x in trusted_system.NextActions()])
+        finally:
+            for file_name in file_names:
+                os.unlink(file_name)
+
+
+class TestTrustedSystemBulkLoading(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.contents = {
+            'home.txt': ["@ Sweep @home"],
+            'work/one.txt': ["@ Bad id #dup", "@ Another bad id #dup"],
+            'work/two.txt': ["# Ordered project", "  @ Step one"],
+            'work/notes.md': ["@ Not a VTD file"],
+            '.hidden/three.txt': ["@ Hidden action"],
+        }
+        for (name, lines) in self.contents.items():
+            file_name = os.path.join(self.directory, name)
+            if not os.path.isdir(os.path.dirname(file_name)):
+                os.makedirs(os.path.dirname(file_name))
+            with open(file_name, 'w') as vtd_file:
+                vtd_file.write('\n'.join(lines))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def testAddDirectory(self):
+        trusted_system = libvtd.trusted_system.TrustedSystem()
+        reports = trusted_system.AddDirectory(self.directory, '*.txt')
+        self.assertEqual(
+            [(self.path('home.txt'), 0), (self.path('work/one.txt'), 1),
+             (self.path('work/two.txt'), 0)],
+            [(report.file_name, report.bad_lines) for report in reports])
+        self.assertTrue(all(report.seconds >= 0 and not report.cached
+                            for report in reports))
+        six.assertCountEqual(
+                self,
+                ['Sweep', 'Bad id', 'Another bad id', 'Step one'],
+                [x.text for x in trusted_system.NextActions()])
+
+    def testAddFilesStatsEachFileOnce(self):
+        trusted_system = libvtd.trusted_system.TrustedSystem(workers=2)
+        trusted_system._min_parallel_batch = 1
+        stat = libvtd.trusted_system._Stat
+        stats = []
+
+        def CountingStat(file_name):
+            stats.append(file_name)
+            return stat(file_name)
+        libvtd.trusted_system._Stat = CountingStat
+        try:
+            first_files = [self.path('home.txt'), self.path('work/one.txt')]
+            trusted_system.AddFiles(first_files)
+            six.assertCountEqual(self, first_files, stats)
+
+            # Files already in the system are only checked for changes.
+            del stats[:]
+            all_files = first_files + [self.path('work/two.txt')]
+            reports = trusted_system.AddFiles(all_files)
+            six.assertCountEqual(self, all_files, stats)
+            self.assertEqual([self.path('work/two.txt')],
+                             [report.file_name for report in reports])
+        finally:
+            libvtd.trusted_system._Stat = stat
+        self.assertEqual(all_files, trusted_system.FileNames())
+
+
+class TestTrustedSystemThreads(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_names = [os.path.join(self.directory, name)
+                           for name in ('first.txt', 'second.txt')]
+        self.trusted_system = libvtd.trusted_system.TrustedSystem()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def writeVersion(self, version):
+        """Write the given version of every file: only its last line changes.
+        """
+        for file_name in self.file_names:
+            with open(file_name, 'w') as vtd_file:
+                vtd_file.write('\n'.join(
+                    ['- Project'] +
+                    ['  @ Step {}'.format(i) for i in range(100)] +
+                    ['@ Version {}'.format(version)]))
+
+    def testQueriesSeeOneRefreshAtATime(self):
+        """Queries on one thread never see a refresh on another half-done."""
+        self.writeVersion(0)
+        self.trusted_system.AddFiles(self.file_names)
+        errors = []
+
+        def RefreshRepeatedly():
+            try:
+                for version in range(1, 40):
+                    self.writeVersion(version)
+                    self.trusted_system.Refresh(force=True)
+            except Exception as e:
+                errors.append(e)
+        # Switch threads as often as possible, to give races every chance.
+        if hasattr(sys, 'setswitchinterval'):
+            self.addCleanup(sys.setswitchinterval, sys.getswitchinterval())
+            sys.setswitchinterval(1e-6)
+        refresher = threading.Thread(target=RefreshRepeatedly)
+        refresher.start()
+        versions = set()
+        while refresher.is_alive():
+            actions = [x.text for x in self.trusted_system.NextActions()]
+            snapshot = self.trusted_system.Snapshot()
+            for texts in (actions, [x.text for x in snapshot.next_actions]):
+                self.assertEqual(202, len(texts))
+                self.assertEqual(2, texts.count('Step 99'))
+                self.assertEqual(1, len(set(x for x in texts
+                                            if x.startswith('Version'))))
+                versions.update(x for x in texts if x.startswith('Version'))
+        refresher.join()
+        self.assertEqual([], errors)
+        self.assertEqual(['Version 39'] * 2,
+                         [x.text for x in self.trusted_system.NextActions()
+                          if x.text.startswith('Version')])
+
+    def testRefreshLeavesOldFilesAlone(self):
+        """Nodes from before a refresh stay as they were."""
+        self.writeVersion(0)
+        self.trusted_system.AddFiles(self.file_names)
+        old_actions = self.trusted_system.NextActions()
+        old_file = old_actions[-1].parent
+        self.writeVersion(1)
+        self.assertEqual(self.file_names, self.trusted_system.Refresh())
+        self.assertEqual(['Project', 'Version 0'],
+                         [x.text for x in old_file.children])
+        self.assertIn('Version 1', [x.text for x in
+                                    self.trusted_system.NextActions()])
+
 
 class TestTrustedSystemRecurringActions(TestTrustedSystemBaseClass):
     def testRecurs(self):
@@ -401,6 +769,52 @@ class TestTrustedSystemAll(TestTrustedSystemBaseClass):
                 self, ['{MISSING Next Action}'], [x.text for x in all])
 
 
+class TestTrustedSystemSnapshot(TestTrustedSystemBaseClass):
+    def testSnapshotMatchesEachList(self):
+        self.addAnonymousFile([
+            "= Home @home =",
+            "@ Vacuum",
+            "@ Empty @@inbox EVERY 3 days",
+            "@ @@Waiting for the plumber @@inbox",
+            "@ Water the plants @@waiting EVERY week",
+            "@ Shovel snow >2013-12-01",
+            "- Project without actions",
+            "# Ordered project @work",
+            "  @ First step @phone",
+            "  @ Second step",
+            "  - Blocked subproject",
+            "",
+            "= Work @work =",
+            "@ Review code EVERY day (LASTDONE 2013-10-30 09:00)",
+            "@ Call the bank @phone <2013-11-01",
+            "@ Write report (DONE)",
+            "- Project for no one @!",
+        ])
+        now = datetime.datetime(2013, 10, 31, 12)
+
+        def Summary(nodes):
+            return [(x.__class__.__name__, x.text, x.Source()) for x in nodes]
+
+        for (include, exclude) in [(None, None), (['home'], ['phone'])]:
+            self.trusted_system.SetContexts(include=include, exclude=exclude)
+            snapshot = self.trusted_system.Snapshot(now)
+            system = self.trusted_system
+            self.assertEqual(Summary(system.NextActions(now)),
+                             Summary(snapshot.next_actions))
+            self.assertEqual(Summary(system.RecurringActions(now)),
+                             Summary(snapshot.recurring_actions))
+            self.assertEqual(Summary(system.Inboxes(now)),
+                             Summary(snapshot.inboxes))
+            self.assertEqual(Summary(system.Waiting(now)),
+                             Summary(snapshot.waiting))
+            self.assertEqual(system.ContextList(now), snapshot.contexts)
+            self.assertEqual(
+                Summary(system.ProjectsWithoutNextActions()),
+                Summary(snapshot.projects_without_next_actions))
+        self.assertEqual(['Vacuum', '{MISSING Next Action}'],
+                         [x.text for x in snapshot.next_actions])
+
+
 class TestTrustedSystemContexts(TestTrustedSystemBaseClass):
     def testListContexts(self):
         self.addAnonymousFile([
@@ -440,6 +854,83 @@ class TestTrustedSystemContexts(TestTrustedSystemBaseClass):
                 ['Phone mom', 'Pay rent', 'Fix bug: colons', 'Fix SEGV bug!!'],
                 [x.text for x in self.trusted_system.NextActions()])
 
+    def testListContextsCountsEachActionOnce(self):
+        self.addAnonymousFile([
+            "- Project @home",
+            "  @ Sweep @home",                      # home
+            "  @ Water plants @garden",             # garden, home
+            "@ Weed @garden",                       # garden
+        ])
+        # Ties are broken alphabetically.
+        self.assertEqual([('garden', 2), ('home', 2)],
+                         self.trusted_system.ContextList())
+
+
+    def testListContextsFollowsTime(self):
+        """Counts change as actions become visible, in either direction."""
+        self.addAnonymousFile([
+            "@ Plant bulbs @garden >2013-10-01",
+            "@ Rake leaves @garden >2013-11-01",
+            "- Project @home >2013-11-01",
+            "  @ Clean gutters @!home @roof",
+        ])
+        september = datetime.datetime(2013, 9, 15)
+        october = datetime.datetime(2013, 10, 15)
+        november = datetime.datetime(2013, 11, 15)
+        self.assertEqual([], self.trusted_system.ContextList(september))
+        self.assertEqual([('garden', 1)],
+                         self.trusted_system.ContextList(october))
+        self.assertEqual([('garden', 2), ('roof', 1)],
+                         self.trusted_system.ContextList(november))
+        self.assertEqual([('garden', 1)],
+                         self.trusted_system.ContextList(october))
+
+    def testListContextsFollowsTimeAcrossRefreshes(self):
+        """Files which a refresh leaves alone keep their counts up to date."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        (first, second) = [os.path.join(directory, name)
+                           for name in ('a.txt', 'b.txt')]
+        with open(first, 'w') as vtd_file:
+            vtd_file.write('@ Plant bulbs @garden >2013-10-01\n'
+                           '@ Rake leaves @garden >2013-11-01')
+        with open(second, 'w') as vtd_file:
+            vtd_file.write('@ Call plumber @phone')
+        self.trusted_system.AddFiles([first, second])
+        october = datetime.datetime(2013, 10, 15)
+        november = datetime.datetime(2013, 11, 15)
+        self.assertEqual([('garden', 1), ('phone', 1)],
+                         self.trusted_system.ContextList(october))
+
+        with open(second, 'w') as vtd_file:
+            vtd_file.write('@ Call plumber @phone (DONE)\n'
+                           '@ Call roofer @phone >2013-11-01')
+        self.assertEqual([second], self.trusted_system.Refresh())
+        self.assertEqual([('garden', 1)],
+                         self.trusted_system.ContextList(october))
+        self.assertEqual([('garden', 2), ('phone', 1)],
+                         self.trusted_system.ContextList(november))
+        self.assertEqual(
+                ['Plant bulbs', 'Rake leaves', 'Call roofer'],
+                [x.text for x in self.trusted_system.NextActions(november)])
+
+    def testIncludedContextsIncludeInheritance(self):
+        self.addAnonymousFile([
+            "- Project @home",
+            "  @ Sweep",
+            "  @ Clean gutters @!home @roof",
+            "  @ Paint fence @! @garden",
+            "@ Weed @garden",
+        ])
+        self.trusted_system.SetContexts(include=['home', 'garden'])
+        self.assertEqual(
+                ['Sweep', 'Paint fence', 'Weed'],
+                [x.text for x in self.trusted_system.NextActions()])
+        self.trusted_system.SetContexts(include=['roof'], exclude=['home'])
+        self.assertEqual(
+                ['Clean gutters'],
+                [x.text for x in self.trusted_system.NextActions()])
+
 
 class TestTrustedSystemPatches(TestTrustedSystemBaseClass):
     """Nodes should return a patch to perform various actions."""
@@ -589,6 +1080,86 @@ class TestTrustedSystemProjects(TestTrustedSystemBaseClass):
                 ['First action', 'Newly unblocked action', 'Blocker nonexistent'],
                 [x.text for x in self.trusted_system.NextActions()])
 
+    def testIdsAcrossFiles(self):
+        with libvtd_test.TempInput([
+                "@ Blocked from another file @after:shared",
+                "@ First owner #shared (DONE)",
+                "@ Unique #unique",
+        ]) as first, libvtd_test.TempInput([
+                "@ Second owner #shared",
+        ]) as second:
+            self.trusted_system.AddFile(first)
+            six.assertCountEqual(
+                    self,
+                    ['Blocked from another file', 'Unique'],
+                    [x.text for x in self.trusted_system.NextActions()])
+            self.assertEqual({}, self.trusted_system.DuplicateIds())
+
+            self.trusted_system.AddFile(second)
+            six.assertCountEqual(
+                    self,
+                    ['Unique', 'Second owner'],
+                    [x.text for x in self.trusted_system.NextActions()])
+            duplicates = self.trusted_system.DuplicateIds()
+            self.assertEqual(['shared'], list(duplicates.keys()))
+            self.assertEqual(
+                    sorted([(first, 2), (second, 1)]),
+                    [node.Source() for node in duplicates['shared']])
+
+    def testBlockerCycles(self):
+        self.addAnonymousFile([
+            "- Project waiting for its own action @after:child",
+            "  @ Child action #child",
+            "@ Chicken #chicken @after:egg",
+            "@ Egg #egg @after:chicken",
+            "@ Not in a cycle @after:egg",
+            "@ Free action",
+        ])
+        self.assertEqual(['Free action'],
+                         [x.text for x in self.trusted_system.NextActions()])
+        six.assertCountEqual(
+                self,
+                [['Child action', 'Project waiting for its own action'],
+                 ['Chicken', 'Egg']],
+                [sorted(x.text for x in cycle)
+                 for cycle in self.trusted_system.BlockerCycles()])
+
+    def testBlockersInOtherFilesGetRefreshed(self):
+        """Edits to one file unblock (or block) Nodes in the others."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        (first, second) = [os.path.join(directory, name)
+                           for name in ('a.txt', 'b.txt')]
+
+        def WriteSecond(lines):
+            with open(second, 'w') as vtd_file:
+                vtd_file.write('\n'.join(lines))
+        with open(first, 'w') as vtd_file:
+            vtd_file.write('@ Blocked from another file @after:shared\n'
+                           '@ Chicken #chicken @after:egg')
+        WriteSecond(['@ Blocker #shared', '@ Egg #egg'])
+        self.trusted_system.AddFiles([first, second])
+        first_file = self.trusted_system._state.files[first]
+        six.assertCountEqual(
+                self, ['Blocker', 'Egg'],
+                [x.text for x in self.trusted_system.NextActions()])
+
+        WriteSecond(['@ Blocker #shared (DONE)', '@ Egg #egg @after:chicken'])
+        self.assertEqual([second], self.trusted_system.Refresh())
+        self.assertIs(first_file, self.trusted_system._state.files[first])
+        self.assertEqual(['Blocked from another file'],
+                         [x.text for x in self.trusted_system.NextActions()])
+        self.assertEqual([['Chicken', 'Egg']],
+                         [sorted(x.text for x in cycle)
+                          for cycle in self.trusted_system.BlockerCycles()])
+
+        WriteSecond(['@ Blocker #shared', '@ Egg #egg'])
+        self.assertEqual([second], self.trusted_system.Refresh())
+        six.assertCountEqual(
+                self, ['Blocker', 'Egg'],
+                [x.text for x in self.trusted_system.NextActions()])
+        self.assertEqual([], self.trusted_system.BlockerCycles())
+
     def testOrderedProjects(self):
         self.addAnonymousFile([
             "# Ordered project",
@@ -625,6 +1196,17 @@ class TestTrustedSystemProjects(TestTrustedSystemBaseClass):
                 ['Another second-subproject task'],
                 [x.text for x in self.trusted_system.NextActions()])
 
+    def testDeeplyNestedOutline(self):
+        """Lists don't depend on the recursion limit."""
+        depth = 3 * sys.getrecursionlimit()
+        self.addAnonymousFile(
+            ["- Deep project"] +
+            ["  " * i + "- Step {}".format(i) for i in range(1, depth)] +
+            ["  " * depth + "@ Innermost action"])
+        self.assertEqual(
+                ['Innermost action'],
+                [x.text for x in self.trusted_system.NextActions()])
+
     def testStubForProjectsWithoutNextActions(self):
         """Project without NextAction should prompt user."""
         self.addAnonymousFile([
@@ -658,6 +1240,30 @@ class TestTrustedSystemProjects(TestTrustedSystemBaseClass):
                          stub.parent.Patch(
                              libvtd.node.Actions.DefaultCheckoff))
 
+        # The same stub comes back every time.
+        self.assertIs(stub, libvtd_test.FirstTextMatch(
+            self.trusted_system.AllActions(), "MISSING"))
+
+    def testStubSurvivesEditsWithinItsProject(self):
+        """A Project keeps its stub when some of its other lines change."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        file_name = os.path.join(directory, 'projects.txt')
+        with open(file_name, 'w') as vtd_file:
+            vtd_file.write('- Project\n  * Some notes\n@ Other action')
+        self.trusted_system.AddFile(file_name)
+        stub = libvtd_test.FirstTextMatch(self.trusted_system.NextActions(),
+                                          'MISSING')
+
+        with open(file_name, 'w') as vtd_file:
+            vtd_file.write('- Project\n  * Other notes\n@ Other action')
+        self.assertEqual([file_name], self.trusted_system.Refresh())
+        self.assertIs(stub, libvtd_test.FirstTextMatch(
+            self.trusted_system.NextActions(), 'MISSING'))
+        self.assertEqual(self.trusted_system.ProjectsWithoutNextActions(),
+                         [stub.parent])
+        self.assertEqual('Other notes', stub.parent.children[0].text)
+
 
 class TestTrustedSystemParanoia(TestTrustedSystemBaseClass):
     """Test "paranoia" features.
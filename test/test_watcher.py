@@ -0,0 +1,169 @@
+import logging
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import libvtd.trusted_system
+import libvtd.watcher
+
+
+class TestWatcherBaseClass(unittest.TestCase):
+    """Tests which run with each way of noticing changes."""
+
+    use_inotify = False
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_names = [os.path.join(self.directory, name)
+                           for name in ('first.txt', 'second.txt')]
+        for file_name in self.file_names:
+            self.writeLines(file_name, ['@ Original action'])
+        self.trusted_system = libvtd.trusted_system.TrustedSystem()
+        for file_name in self.file_names:
+            self.trusted_system.AddFile(file_name)
+
+        # Keep track of which files get reread.
+        self.rereads = []
+        refresh_files = self.trusted_system.RefreshFiles
+
+        def RecordingRefreshFiles(file_names):
+            refresh_files(file_names)
+            self.rereads.append(file_names)
+        self.trusted_system.RefreshFiles = RecordingRefreshFiles
+
+        self.watcher = libvtd.watcher.Watcher(
+            self.trusted_system, debounce=0.2, poll_interval=0.05,
+            use_inotify=self.use_inotify)
+        if self.use_inotify and not self.watcher.uses_inotify:
+            self.watcher.Close()
+            self.skipTest('inotify is not available')
+        self.watcher.Start()
+        # Let the watcher take a first look at the files.
+        time.sleep(0.2)
+
+    def tearDown(self):
+        self.watcher.Close()
+        shutil.rmtree(self.directory)
+
+    def writeLines(self, file_name, lines):
+        with open(file_name, 'w') as vtd_file:
+            vtd_file.write('\n'.join(lines))
+
+    def assertEventuallyShows(self, texts, timeout=5):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            actions = [x.text for x in self.trusted_system.NextActions()]
+            if sorted(actions) == sorted(texts):
+                return
+            time.sleep(0.02)
+        self.assertEqual(sorted(texts), sorted(actions))
+
+    def testRereadsOnlyTheChangedFile(self):
+        self.writeLines(self.file_names[0], ['@ Edited action'])
+        self.assertEventuallyShows(['Edited action', 'Original action'])
+        self.assertEqual([[self.file_names[0]]], self.rereads)
+
+    def testRenamingOverFile(self):
+        """Editors often save by renaming a new file over the old one."""
+        temp_name = os.path.join(self.directory, '.first.txt.swp')
+        self.writeLines(temp_name, ['@ Renamed action'])
+        os.rename(temp_name, self.file_names[0])
+        self.assertEventuallyShows(['Renamed action', 'Original action'])
+
+    def testBurstOfWritesGetsDebounced(self):
+        for i in range(5):
+            self.writeLines(self.file_names[1],
+                            ['@ Action version {}'.format(i)])
+            time.sleep(0.01)
+        self.assertEventuallyShows(['Original action', 'Action version 4'])
+        self.assertEqual([[self.file_names[1]]], self.rereads)
+
+    def testUnreadableFileDoesntStopTheWatcher(self):
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger = logging.getLogger('libvtd.watcher')
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+
+        # A directory where a file used to be can't be read.
+        os.remove(self.file_names[0])
+        os.mkdir(self.file_names[0])
+        time.sleep(0.5)
+        self.writeLines(self.file_names[1], ['@ Edited action'])
+        self.assertEventuallyShows(['Edited action', 'Original action'])
+        self.assertEqual(1, len(records))
+
+        # Once the file is back, it gets reread too.
+        os.rmdir(self.file_names[0])
+        self.writeLines(self.file_names[0], ['@ Restored action'])
+        self.assertEventuallyShows(['Edited action', 'Restored action'])
+
+    def testSlowChecksDontStopTheWatcher(self):
+        """Checking for changes may take longer than the debounce time."""
+        file_names = self.watcher._FileNames
+
+        def SlowFileNames():
+            time.sleep(0.01)
+            return file_names()
+        self.watcher._FileNames = SlowFileNames
+        self.watcher._debounce = 0.005
+        self.writeLines(self.file_names[0], ['@ Edited action'])
+        self.assertEventuallyShows(['Edited action', 'Original action'])
+        self.writeLines(self.file_names[0], ['@ Edited again'])
+        self.assertEventuallyShows(['Edited again', 'Original action'])
+
+    def testErrorsDontStopTheWatcher(self):
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger = logging.getLogger('libvtd.watcher')
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        wait = self.watcher._changes.Wait
+        calls = []
+
+        def FailingOnceWait(file_names, timeout):
+            calls.append(timeout)
+            if len(calls) == 1:
+                raise ValueError('Something went wrong')
+            return wait(file_names, timeout)
+        self.watcher._changes.Wait = FailingOnceWait
+        self.writeLines(self.file_names[0], ['@ Edited action'])
+        self.assertEventuallyShows(['Edited action', 'Original action'])
+        self.assertEqual(1, len(records))
+
+    def testStop(self):
+        self.watcher.Stop()
+        self.writeLines(self.file_names[0], ['@ Unnoticed action'])
+        time.sleep(0.5)
+        self.assertEqual([], self.rereads)
+
+
+class TestPollingWatcher(TestWatcherBaseClass):
+    use_inotify = False
+
+
+class TestInotifyWatcher(TestWatcherBaseClass):
+    use_inotify = True
+
+    def testDirectoryComesBack(self):
+        """Files in a directory which moves away and back get reread."""
+        moved_directory = self.directory + '.moved'
+        os.rename(self.directory, moved_directory)
+        try:
+            self.writeLines(os.path.join(moved_directory, 'first.txt'),
+                            ['@ Moved action'])
+            time.sleep(0.5)
+        finally:
+            os.rename(moved_directory, self.directory)
+        self.assertEventuallyShows(['Moved action', 'Original action'])
+
+
+del TestWatcherBaseClass
+
+
+if __name__ == '__main__':
+    unittest.main()